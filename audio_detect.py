@@ -0,0 +1,101 @@
+"""
+音频静音检测
+volumedetect的stderr以流的方式逐行解析；采样模式只分析分布在整个文件中的若干短窗口，
+任一窗口超过阈值即提前结束
+"""
+
+import subprocess
+
+# 采样模式默认参数
+DEFAULT_SAMPLE_WINDOWS = 5
+DEFAULT_WINDOW_SECONDS = 3.0
+
+
+def measure_mean_volume(video_path, start=None, duration=None):
+    """
+    对音频（或其中一段）运行volumedetect
+
+    Args:
+        video_path: 媒体文件路径
+        start: 起始时间（秒），None表示从头开始
+        duration: 分析时长（秒），None表示到文件结束
+    Returns:
+        float: 平均音量(dB)，没有解析到音量信息时返回None
+    """
+    args = ['ffmpeg', '-hide_banner', '-nostats']
+    if start is not None:
+        args += ['-ss', f'{start:.3f}']
+    if duration is not None:
+        args += ['-t', f'{duration:.3f}']
+    args += ['-i', video_path, '-map', '0:a:0', '-af', 'volumedetect', '-f', 'null', '-']
+
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    mean_volume = None
+    try:
+        # 逐行读取stderr，不把整个输出缓存在内存中
+        for raw_line in process.stderr:
+            line = raw_line.decode('utf-8', errors='replace')
+            if 'mean_volume:' in line:
+                try:
+                    mean_volume = float(line.split('mean_volume:')[1].strip().split()[0])
+                except (IndexError, ValueError):
+                    mean_volume = None
+    finally:
+        process.stderr.close()
+        process.wait()
+    return mean_volume
+
+
+def sample_windows(duration, windows=DEFAULT_SAMPLE_WINDOWS, window_seconds=DEFAULT_WINDOW_SECONDS):
+    """
+    计算均匀分布在整个文件中的采样窗口起点
+
+    Returns:
+        list: 窗口起点（秒）列表；文件太短时返回空列表表示应全量分析
+    """
+    if windows <= 0 or duration <= windows * window_seconds:
+        return []
+    if windows == 1:
+        return [(duration - window_seconds) / 2]
+    step = (duration - window_seconds) / (windows - 1)
+    return [i * step for i in range(windows)]
+
+
+def detect_audio(video_path, duration, threshold_db=-60.0, mode="sampled",
+                 windows=DEFAULT_SAMPLE_WINDOWS, window_seconds=DEFAULT_WINDOW_SECONDS):
+    """
+    判断音轨是否有声音
+
+    Args:
+        video_path: 媒体文件路径
+        duration: 文件时长（秒）
+        threshold_db: 静音阈值，平均音量高于此值认为有声音
+        mode: sampled采样检测 / full全量检测
+        windows: 采样窗口数量
+        window_seconds: 每个窗口的时长（秒）
+    Returns:
+        tuple: (是否有声音, 检测到的最大平均音量dB或None, 分析的窗口数)
+    """
+    starts = sample_windows(duration, windows, window_seconds) if mode == "sampled" else []
+
+    if not starts:
+        volume_db = measure_mean_volume(video_path)
+        if volume_db is None:
+            return True, None, 1  # 没有音量信息时默认认为有声音
+        return volume_db > threshold_db, volume_db, 1
+
+    loudest = None
+    analyzed = 0
+    for start in starts:
+        volume_db = measure_mean_volume(video_path, start, window_seconds)
+        analyzed += 1
+        if volume_db is None:
+            continue
+        loudest = volume_db if loudest is None else max(loudest, volume_db)
+        if volume_db > threshold_db:
+            # 任一窗口超过阈值即可判定有声音，提前结束
+            return True, volume_db, analyzed
+
+    if loudest is None:
+        return True, None, analyzed  # 所有窗口都没有音量信息时默认认为有声音
+    return False, loudest, analyzed
@@ -0,0 +1,79 @@
+"""
+基准测试素材
+用ffmpeg的lavfi源（testsrc2画面 + sine音频）在本地合成测试视频和GIF，
+文件名包含生成参数，已存在时直接复用
+"""
+
+import os
+import subprocess
+
+# 测试素材使用的编码参数（与被测节点无关，只要求生成快、结果稳定）
+FIXTURE_FPS = 30
+FIXTURE_GOP_SECONDS = 2
+
+
+def video_spec(width, height, duration, audio=True, fps=FIXTURE_FPS):
+    """测试视频规格"""
+    return {'width': width, 'height': height, 'duration': duration, 'audio': audio, 'fps': fps}
+
+
+def fixture_filename(spec, index):
+    """根据规格生成文件名，规格变化时自动生成新文件"""
+    audio = "a" if spec['audio'] else "na"
+    return f"{index:02d}_{spec['width']}x{spec['height']}_{spec['duration']}s_{spec['fps']}fps_{audio}.mp4"
+
+
+def generate_video(path, spec):
+    """合成一个测试视频"""
+    width, height, duration, fps = spec['width'], spec['height'], spec['duration'], spec['fps']
+    args = ['ffmpeg', '-y', '-v', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={duration}']
+    if spec['audio']:
+        args += ['-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}']
+    args += ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-g', str(fps * FIXTURE_GOP_SECONDS)]
+    if spec['audio']:
+        args += ['-c:a', 'aac', '-b:a', '128k', '-shortest']
+    args.append(path)
+    subprocess.run(args, check=True)
+
+
+def generate_gif(path, width=320, height=120, duration=2, fps=10):
+    """合成一个测试GIF（使用调色板保证颜色稳定）"""
+    args = ['ffmpeg', '-y', '-v', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={duration}',
+            '-filter_complex', 'split[a][b];[a]palettegen[p];[b][p]paletteuse',
+            path]
+    subprocess.run(args, check=True)
+
+
+def ensure_folder(folder, specs):
+    """
+    确保文件夹中包含规格列表对应的测试视频，并删除不属于当前规格的旧文件
+
+    Returns:
+        list: 测试视频路径列表
+    """
+    os.makedirs(folder, exist_ok=True)
+    expected = [fixture_filename(spec, index) for index, spec in enumerate(specs)]
+
+    for filename in os.listdir(folder):
+        if filename not in expected:
+            os.remove(os.path.join(folder, filename))
+
+    paths = []
+    for filename, spec in zip(expected, specs):
+        path = os.path.join(folder, filename)
+        if not os.path.exists(path):
+            print(f"🎬 生成测试视频: {filename}")
+            generate_video(path, spec)
+        paths.append(path)
+    return paths
+
+
+def ensure_gif(path):
+    """确保测试GIF存在"""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f"🎬 生成测试GIF: {os.path.basename(path)}")
+        generate_gif(path)
+    return path
@@ -0,0 +1,411 @@
+"""
+视频编辑节点基准测试
+
+用本地合成的测试视频端到端运行裁切/合并节点，记录
+墙钟时间、CPU时间、峰值内存、写出字节数和输出帧率，结果保存为JSON；
+指定基线文件时与基线比较并标记性能回退
+
+用法:
+    python benchmarks/run_benchmarks.py                          # 运行quick套件
+    python benchmarks/run_benchmarks.py --suite full --repeat 5
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --threshold 0.1
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import importlib.util
+import types
+
+import fixtures
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+DEFAULT_WORKDIR = os.path.join(BENCH_DIR, ".work")
+PACKAGE_NAME = "video_editing_bench"
+
+# 测试素材文件夹（位于工作目录的input下）
+FIXTURE_SETS = {
+    "crop_720p": [fixtures.video_spec(1280, 720, 5, audio=(i % 2 == 0)) for i in range(4)],
+    "crop_1080p": [fixtures.video_spec(1920, 1080, 20, audio=(i % 2 == 0)) for i in range(3)],
+    "games_720p": [fixtures.video_spec(1280, 720, 8, audio=True) for _ in range(2)],
+    "games_1080p": [fixtures.video_spec(1920, 1080, 30, audio=(i % 2 == 0)) for i in range(2)],
+    "materials_mixed": [
+        fixtures.video_spec(640, 360, 4, audio=True),
+        fixtures.video_spec(960, 540, 5, audio=False),
+        fixtures.video_spec(1920, 1080, 3, audio=True),
+        fixtures.video_spec(720, 1280, 6, audio=False),
+        fixtures.video_spec(1280, 720, 4, audio=True),
+        fixtures.video_spec(640, 360, 5, audio=False),
+    ],
+    "materials_long": [fixtures.video_spec(1280, 720, 12, audio=(i % 2 == 0)) for i in range(6)],
+}
+GIF_FIXTURE = os.path.join("gifs", "overlay.gif")
+
+# 各节点统一使用的参数：关闭增量跳过和缓存，保证每次都完整编码
+_COMMON = {'skip_existing': False, 'max_parallel_jobs': 0}
+_MERGE = dict(_COMMON, position="up", audio_mode="mix", material_audio_volume=0.5, game_audio_volume=0.5,
+              material_cache_gb=0.0)
+
+CASES = {
+    "crop_720p": {
+        'node': 'crop', 'fixtures': ['crop_720p'],
+        'params': dict(_COMMON, input_folder="crop_720p", crop_x1=160, crop_y1=0, crop_x2=1120, crop_y2=720),
+    },
+    "enhanced_crop_720p": {
+        'node': 'enhanced_crop', 'fixtures': ['crop_720p'],
+        'params': dict(_COMMON, input_folder="crop_720p", aspect_ratio="9:16", pos_x=438, pos_y=0, crop_width=404, crop_height=720),
+    },
+    "merge_single_pass_720p": {
+        'node': 'merge', 'fixtures': ['games_720p', 'materials_mixed'],
+        'params': dict(_MERGE, game_folder="games_720p", material_folder="materials_mixed", merge_engine="single_pass"),
+    },
+    "merge_classic_720p": {
+        'node': 'merge', 'fixtures': ['games_720p', 'materials_mixed'],
+        'params': dict(_MERGE, game_folder="games_720p", material_folder="materials_mixed", merge_engine="classic"),
+    },
+    "merge_pipe_720p": {
+        'node': 'merge', 'fixtures': ['games_720p', 'materials_mixed'],
+        'params': dict(_MERGE, game_folder="games_720p", material_folder="materials_mixed", merge_engine="pipe"),
+    },
+    "merge_gif_720p": {
+        'node': 'merge', 'fixtures': ['games_720p', 'materials_mixed'], 'gif': True,
+        'params': dict(_MERGE, game_folder="games_720p", material_folder="materials_mixed", merge_engine="single_pass"),
+    },
+    "crop_1080p": {
+        'node': 'crop', 'fixtures': ['crop_1080p'],
+        'params': dict(_COMMON, input_folder="crop_1080p", crop_x1=240, crop_y1=0, crop_x2=1680, crop_y2=1080),
+    },
+    "enhanced_crop_1080p": {
+        'node': 'enhanced_crop', 'fixtures': ['crop_1080p'],
+        'params': dict(_COMMON, input_folder="crop_1080p", aspect_ratio="9:16", pos_x=656, pos_y=0, crop_width=606, crop_height=1080),
+    },
+    "merge_single_pass_1080p": {
+        'node': 'merge', 'fixtures': ['games_1080p', 'materials_long'],
+        'params': dict(_MERGE, game_folder="games_1080p", material_folder="materials_long", merge_engine="single_pass"),
+    },
+    "merge_classic_1080p": {
+        'node': 'merge', 'fixtures': ['games_1080p', 'materials_long'],
+        'params': dict(_MERGE, game_folder="games_1080p", material_folder="materials_long", merge_engine="classic"),
+    },
+    "merge_pipe_1080p": {
+        'node': 'merge', 'fixtures': ['games_1080p', 'materials_long'],
+        'params': dict(_MERGE, game_folder="games_1080p", material_folder="materials_long", merge_engine="pipe"),
+    },
+    "merge_gif_1080p": {
+        'node': 'merge', 'fixtures': ['games_1080p', 'materials_long'], 'gif': True,
+        'params': dict(_MERGE, game_folder="games_1080p", material_folder="materials_long", merge_engine="classic"),
+    },
+}
+
+SUITES = {
+    "quick": ["crop_720p", "enhanced_crop_720p", "merge_single_pass_720p", "merge_classic_720p", "merge_gif_720p"],
+    "full": list(CASES.keys()),
+}
+
+# 比较基线时检查的指标：(指标名, 越小越好)
+COMPARED_METRICS = [
+    ('wall_s', True),
+    ('cpu_s', True),
+    ('peak_rss_mb', True),
+    ('output_fps', False),
+]
+# 绝对差值低于此值时视为噪声，不判定回退
+NOISE_FLOOR = {'wall_s': 0.2, 'cpu_s': 0.5, 'peak_rss_mb': 10.0, 'output_fps': 1.0}
+
+
+# ---------------------------------------------------------------------------
+# 子进程：运行单个用例并测量
+# ---------------------------------------------------------------------------
+
+def install_folder_paths(workdir):
+    """
+    使用独立的folder_paths模块，让节点读写基准测试工作目录，不影响ComfyUI的输入输出目录
+    """
+    input_dir = os.path.join(workdir, "input")
+    output_dir = os.path.join(workdir, "output")
+    module = types.ModuleType("folder_paths")
+    module.get_input_directory = lambda: input_dir
+    module.get_output_directory = lambda: output_dir
+    sys.modules["folder_paths"] = module
+
+
+def load_package():
+    """以包的形式加载节点代码（节点模块使用相对导入）"""
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, os.path.join(REPO_ROOT, "__init__.py"), submodule_search_locations=[REPO_ROOT]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+def invoke_node(case, workdir, output_folder_name):
+    """调用节点，返回输出文件夹路径（失败时抛出异常）"""
+    params = dict(case['params'], output_folder_name=output_folder_name)
+    if case.get('gif'):
+        params['gif_path'] = os.path.join(workdir, "input", GIF_FIXTURE)
+
+    if case['node'] == 'crop':
+        node = sys.modules[f"{PACKAGE_NAME}.edit_video"].VideoCropNode()
+        result = node.crop_videos(**params)
+    elif case['node'] == 'enhanced_crop':
+        node = sys.modules[f"{PACKAGE_NAME}.edit_video"].EnhancedVideoCropNode()
+        result = node.enhanced_crop_videos(**params)
+    else:
+        node = sys.modules[f"{PACKAGE_NAME}.mearge_video"].VideoMergeNode()
+        result = node.merge_videos(**params)
+
+    output_path = result[0] if result else ""
+    if not output_path or not os.path.isdir(output_path):
+        raise RuntimeError(f"节点未产生输出: {output_path}")
+    return output_path
+
+
+def count_frames(path):
+    """统计视频的帧数（只解复用，不解码）"""
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+         '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0', path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+    ).stdout.decode('utf-8').strip()
+    return int(output) if output.isdigit() else 0
+
+
+def folder_size(path):
+    """文件夹中所有文件的总字节数"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_worker(case_name, workdir, result_file):
+    """在独立子进程中运行一次用例，峰值内存和CPU时间不受其他用例影响"""
+    case = CASES[case_name]
+    install_folder_paths(workdir)
+    load_package()
+
+    output_folder_name = f"bench_{case_name}"
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+
+    output_path = invoke_node(case, workdir, output_folder_name)
+
+    wall = time.perf_counter() - started
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    outputs = sorted(
+        os.path.join(output_path, name) for name in os.listdir(output_path) if name.endswith('.mp4')
+    )
+    frames = sum(count_frames(path) for path in outputs)
+
+    # ru_maxrss在Linux上以KB为单位；子进程取所有已结束后代进程中的最大值
+    peak_rss_kb = max(self_after.ru_maxrss, children_after.ru_maxrss)
+    result = {
+        'wall_s': wall,
+        'cpu_s': (cpu_seconds(self_after) - cpu_seconds(self_before)) + (cpu_seconds(children_after) - cpu_seconds(children_before)),
+        'peak_rss_mb': peak_rss_kb / 1024.0,
+        'bytes_written': folder_size(output_path),
+        'output_files': len(outputs),
+        'output_frames': frames,
+        'output_fps': frames / wall if wall > 0 else 0.0,
+    }
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+# ---------------------------------------------------------------------------
+# 主进程：准备素材、重复运行、汇总和比较
+# ---------------------------------------------------------------------------
+
+def prepare_fixtures(case_names, workdir):
+    """生成所选用例需要的测试素材"""
+    input_dir = os.path.join(workdir, "input")
+    needed = sorted({name for case_name in case_names for name in CASES[case_name]['fixtures']})
+    for name in needed:
+        fixtures.ensure_folder(os.path.join(input_dir, name), FIXTURE_SETS[name])
+    if any(CASES[case_name].get('gif') for case_name in case_names):
+        fixtures.ensure_gif(os.path.join(input_dir, GIF_FIXTURE))
+
+
+def reset_outputs(workdir, case_name):
+    """删除上一次运行的输出和缓存，保证每次运行都是冷启动"""
+    output_dir = os.path.join(workdir, "output")
+    for name in (f"bench_{case_name}", ".video_editing_cache", "video_previews"):
+        shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+
+
+def run_case(case_name, workdir, repeat):
+    """重复运行用例，取各指标的中位数"""
+    runs = []
+    for index in range(repeat):
+        reset_outputs(workdir, case_name)
+        result_file = os.path.join(workdir, f"result_{case_name}.json")
+        if os.path.exists(result_file):
+            os.remove(result_file)
+
+        print(f"▶️ {case_name} 第 {index + 1}/{repeat} 次")
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", case_name, "--workdir", workdir, "--result-file", result_file],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        if completed.returncode != 0 or not os.path.exists(result_file):
+            log = completed.stdout.decode('utf-8', errors='replace').strip().splitlines()[-20:]
+            print(f"❌ {case_name} 运行失败:")
+            for line in log:
+                print(f"    {line}")
+            return {'status': 'error', 'runs': runs}
+
+        with open(result_file, 'r', encoding='utf-8') as f:
+            run = json.load(f)
+        runs.append(run)
+        print(f"   {run['wall_s']:.2f}s, CPU {run['cpu_s']:.2f}s, 峰值内存 {run['peak_rss_mb']:.0f}MB, "
+              f"{run['output_frames']} 帧 ({run['output_fps']:.1f} fps)")
+
+    summary = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    summary['status'] = 'ok'
+    summary['runs'] = runs
+    return summary
+
+
+def ffmpeg_version():
+    try:
+        output = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        return output.decode('utf-8', errors='replace').splitlines()[0]
+    except Exception:
+        return None
+
+
+def git_revision():
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        return output.decode('utf-8').strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    与基线比较
+
+    Returns:
+        list: 回退项 (用例, 指标, 基线值, 当前值, 变化比例)
+    """
+    regressions = []
+    print(f"\n📊 与基线比较 (阈值 {threshold * 100:.0f}%)")
+    for case_name, current in results['cases'].items():
+        base = baseline.get('cases', {}).get(case_name)
+        if not base or base.get('status') != 'ok' or current.get('status') != 'ok':
+            print(f"  {case_name}: 无可比较的基线")
+            continue
+        for metric, lower_is_better in COMPARED_METRICS:
+            old, new = base.get(metric), current.get(metric)
+            if not old:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if lower_is_better else change < -threshold
+            flag = "⚠️ 回退" if worse and abs(new - old) >= NOISE_FLOOR[metric] else ""
+            if flag:
+                regressions.append((case_name, metric, old, new, change))
+            print(f"  {case_name:<26} {metric:<12} {old:>10.2f} -> {new:>10.2f} ({change * 100:+.1f}%) {flag}")
+        if base.get('bytes_written') and current.get('bytes_written') != base.get('bytes_written'):
+            change = (current['bytes_written'] - base['bytes_written']) / base['bytes_written']
+            print(f"  {case_name:<26} {'bytes':<12} 输出大小变化 {change * 100:+.1f}%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视频编辑节点基准测试")
+    parser.add_argument("--suite", choices=sorted(SUITES.keys()), default="quick", help="用例套件")
+    parser.add_argument("--cases", default="", help="逗号分隔的用例名，指定时忽略--suite")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例的运行次数（取中位数）")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="测试素材和输出所在的工作目录")
+    parser.add_argument("--output", default="", help="结果JSON的保存路径")
+    parser.add_argument("--baseline", default="", help="基线JSON，提供时比较并在回退时以非0状态退出")
+    parser.add_argument("--save-baseline", default="", help="把本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定回退的相对变化阈值")
+    parser.add_argument("--list", action="store_true", help="列出所有用例")
+    parser.add_argument("--worker", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir)
+
+    if args.worker:
+        run_worker(args.worker, workdir, args.result_file)
+        return 0
+
+    if args.list:
+        for suite, case_names in SUITES.items():
+            print(f"{suite}: {', '.join(case_names)}")
+        return 0
+
+    case_names = [name.strip() for name in args.cases.split(",") if name.strip()] or SUITES[args.suite]
+    unknown = [name for name in case_names if name not in CASES]
+    if unknown:
+        print(f"❌ 未知的用例: {', '.join(unknown)}")
+        return 2
+
+    prepare_fixtures(case_names, workdir)
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'ffmpeg': ffmpeg_version(),
+            'repeat': args.repeat,
+        },
+        'cases': {},
+    }
+    for case_name in case_names:
+        results['cases'][case_name] = run_case(case_name, workdir, max(1, args.repeat))
+
+    output_file = args.output or os.path.join(workdir, f"results_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    for path in filter(None, [output_file, args.save_baseline]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {path}")
+
+    failed = [name for name, result in results['cases'].items() if result['status'] != 'ok']
+    if failed:
+        print(f"❌ 运行失败的用例: {', '.join(failed)}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n⚠️ 发现 {len(regressions)} 项性能回退")
+            return 1
+        print("\n✅ 未发现性能回退")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+内容寻址的磁盘缓存
+按键（通常是内容指纹+参数的哈希）存放中间文件，总大小超过预算时按最近使用时间淘汰；
+任务使用期间可以固定条目（在条目旁写入固定标记），固定的条目不会被任何进程淘汰
+"""
+
+import os
+import time
+import json
+import uuid
+import shutil
+import socket
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # 非POSIX平台只在本进程内互斥
+
+from . import media_cache
+
+# 最近使用过的条目在宽限期内不会被淘汰，避免删除刚查到、还没有固定的文件
+EVICTION_GRACE_SECONDS = 600
+PIN_SUFFIX = ".pin"
+LOCK_FILENAME = ".lock"
+# 其他主机的固定标记无法判断进程是否存在，超过这么久视为遗留
+FOREIGN_PIN_STALE_SECONDS = 24 * 3600
+
+_lock = threading.Lock()
+
+
+def _pin_alive(pin_path):
+    """固定标记的持有进程是否仍在运行（本机检查进程，其他主机按标记的存在时间判断）"""
+    try:
+        with open(pin_path, 'r', encoding='utf-8') as f:
+            owner = json.load(f)
+    except (OSError, ValueError):
+        owner = {}
+    if owner.get('host') != socket.gethostname():
+        try:
+            return time.time() - os.stat(pin_path).st_mtime < FOREIGN_PIN_STALE_SECONDS
+        except OSError:
+            return False
+    try:
+        os.kill(owner.get('pid', 0), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def make_key(*parts):
+    """把若干可JSON序列化的部分组合成缓存键"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    """
+    磁盘缓存目录
+    文件名即缓存键，访问时更新修改时间作为LRU依据
+    """
+
+    def __init__(self, name, budget_bytes):
+        """
+        Args:
+            name: 缓存子目录名（位于 .video_editing_cache 下）
+            budget_bytes: 总大小预算（字节），<=0表示禁用缓存
+        """
+        self.root = os.path.join(media_cache.get_cache_root(), name)
+        self.budget_bytes = budget_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.budget_bytes > 0
+
+    def path_for(self, key, ext):
+        """缓存键对应的文件路径（按前两位分子目录）"""
+        return os.path.join(self.root, key[:2], f"{key}{ext}")
+
+    def lookup(self, key, ext):
+        """
+        查找缓存
+
+        Returns:
+            str: 命中时返回缓存文件路径，否则返回None
+        """
+        if not self.enabled:
+            return None
+        path = self.path_for(key, ext)
+        try:
+            os.utime(path, None)  # 更新使用时间
+            return path
+        except OSError:
+            return None
+
+    @contextmanager
+    def _root_lock(self):
+        """缓存目录上的跨进程锁（淘汰和固定互斥）"""
+        with _lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, LOCK_FILENAME), 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def pinned(self, path):
+        """
+        在with块中固定缓存条目，其他任务（包括其他进程和实例）淘汰时不会删除它
+
+        Yields:
+            bool: 条目是否仍然存在，不存在时调用方按未命中处理
+        """
+        if not self.enabled or not path.startswith(self.root + os.sep):
+            yield os.path.exists(path)
+            return
+        pin_path = f"{path}.{uuid.uuid4().hex[:8]}{PIN_SUFFIX}"
+        with self._root_lock():
+            with open(pin_path, 'w', encoding='utf-8') as f:
+                json.dump({'host': socket.gethostname(), 'pid': os.getpid()}, f)
+            exists = os.path.exists(path)
+        try:
+            yield exists
+        finally:
+            try:
+                os.remove(pin_path)
+            except OSError:
+                pass
+
+    def store(self, key, source_path, ext):
+        """
+        把生成好的文件移入缓存（同一文件系统时是原子重命名）
+
+        Returns:
+            str: 缓存中的文件路径；缓存禁用时返回source_path
+        """
+        if not self.enabled:
+            return source_path
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if os.stat(source_path).st_dev == os.stat(os.path.dirname(path)).st_dev:
+                os.replace(source_path, temp_path)
+            else:
+                shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict()
+        return path
+
+    def total_size(self):
+        """缓存当前占用的总字节数"""
+        return sum(size for _, size, _ in self._entries()[0])
+
+    def _entries(self):
+        """
+        Returns:
+            tuple: ([(条目路径, 大小, 修改时间)], {条目路径: [固定标记路径]})
+        """
+        entries = []
+        pins = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith('.tmp') or filename == LOCK_FILENAME:
+                    continue
+                path = os.path.join(dirpath, filename)
+                if filename.endswith(PIN_SUFFIX):
+                    # {条目路径}.{随机串}.pin
+                    pins.setdefault(path[:-len(PIN_SUFFIX)].rsplit('.', 1)[0], []).append(path)
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries, pins
+
+    def _is_pinned(self, pin_paths):
+        pinned = False
+        for pin_path in pin_paths:
+            if _pin_alive(pin_path):
+                pinned = True
+            else:
+                # 持有进程已退出的遗留标记
+                try:
+                    os.remove(pin_path)
+                except OSError:
+                    pass
+        return pinned
+
+    def evict(self):
+        """淘汰最久未使用且没有被固定的条目直到总大小不超过预算"""
+        with self._root_lock():
+            entries, pins = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total <= self.budget_bytes:
+                return 0
+
+            removed = 0
+            now = time.time()
+            for path, size, mtime in sorted(entries, key=lambda entry: entry[2]):
+                if total <= self.budget_bytes:
+                    break
+                if now - mtime < EVICTION_GRACE_SECONDS or self._is_pinned(pins.get(path, [])):
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                    removed += 1
+                except OSError:
+                    continue
+        if removed:
+            print(f"🧹 缓存 {os.path.basename(self.root)} 淘汰了 {removed} 个文件，当前占用 {total / 1024 ** 3:.2f} GB")
+        return removed
@@ -1,6 +1,7 @@
 import os
 import cv2
-import glob
+import contextlib
+import hashlib
 from pathlib import Path
 import ffmpeg
 import subprocess
@@ -8,6 +9,18 @@ import folder_paths
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+from . import encoder_profiles
+from . import ffmpeg_progress
+from . import folder_index
+from . import job_pool
+from . import manifest
+from . import media_cache
+from . import scheduler
+from . import scratch
+from . import segment_encode
+from . import thumbnail_store
+from . import work_queue
+
 class VideoCropNode:
     """
     视频裁切节点
@@ -17,20 +30,7 @@ class VideoCropNode:
     @classmethod
     def get_input_folders(cls):
         """获取输入目录下的所有子文件夹"""
-        try:
-            input_dir = folder_paths.get_input_directory()
-            if not os.path.exists(input_dir):
-                return ["input"]
-            
-            folders = ["input"]  # 默认包含根目录
-            for item in os.listdir(input_dir):
-                item_path = os.path.join(input_dir, item)
-                if os.path.isdir(item_path):
-                    folders.append(item)
-            
-            return sorted(folders)
-        except Exception:
-            return ["input"]
+        return folder_index.list_input_folders(folder_paths.get_input_directory())
     
     @classmethod
     def INPUT_TYPES(cls):
@@ -45,6 +45,13 @@ class VideoCropNode:
             },
             "optional": {
                 "keep_audio": ("BOOLEAN", {"default": True}),
+                "max_parallel_jobs": ("INT", {"default": 0, "min": 0, "max": 64, "tooltip": "并发处理的视频数量，0表示根据CPU核心数、负载、分辨率和内存上限自动选择"}),
+                "memory_limit_gb": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 4096.0, "step": 0.5, "tooltip": "所有ffmpeg进程的内存上限（GB），超过时新的编码等待其他任务结束；0表示物理内存的75%"}),
+                "segment_count": segment_encode.segment_count_input_type(),
+                **encoder_profiles.encoder_input_types(),
+                "skip_existing": ("BOOLEAN", {"default": True, "tooltip": "输入、参数和编码配置都未变化的输出直接跳过（根据输出文件夹中的清单判断）"}),
+                **work_queue.queue_input_types(),
+                **scratch.scratch_input_types(),
             }
         }
     
@@ -53,7 +60,100 @@ class VideoCropNode:
     FUNCTION = "crop_videos"
     CATEGORY = "video_editing"
     
-    def crop_videos(self, input_folder, output_folder_name, crop_x1, crop_y1, crop_x2, crop_y2, keep_audio=True):
+    def crop_single_video(self, video_file, output_path, crop_x1, crop_y1, crop_x2, crop_y2, keep_audio=True, encoder=None,
+                          output_manifest=None, skip_existing=True, segment_count=1):
+        """
+        裁切单个视频文件
+
+        Args:
+            output_manifest: 输出清单，提供时跳过已是最新的输出并记录新输出
+            segment_count: 按关键帧分段并行编码的段数，1表示不分段，0表示自动
+
+        Returns:
+            tuple: (输出文件路径, 是否保留了音效)
+        """
+        # 获取文件名（不含扩展名）
+        filename = Path(video_file).stem
+        output_file = os.path.join(output_path, f"{filename}_cropped.mp4")
+
+        # 计算裁切宽度和高度
+        crop_width = crop_x2 - crop_x1
+        crop_height = crop_y2 - crop_y1
+
+        # 检查原视频是否有音效
+        has_audio = False
+        source_duration = None
+        try:
+            probe = media_cache.probe(video_file)
+            audio_streams = [stream for stream in probe['streams'] if stream['codec_type'] == 'audio']
+            has_audio = len(audio_streams) > 0
+            source_duration = float(probe.get('format', {}).get('duration') or 0)
+        except Exception:
+            has_audio = False
+
+        # 输入、裁切参数和编码配置都未变化时跳过
+        manifest_params = {
+            'node': 'VideoCropNode',
+            'crop': [crop_x1, crop_y1, crop_x2, crop_y2],
+            'keep_audio': keep_audio,
+            # 分段会改变关键帧位置（与合并节点相同），段数不同时重新编码
+            'segment_count': segment_count,
+            'encoder': encoder,
+        }
+        if output_manifest is not None and skip_existing and output_manifest.is_up_to_date(output_file, [video_file], manifest_params):
+            print(f"⏭️ 输出已是最新，跳过: {output_file}")
+            return output_file, keep_audio and has_audio
+
+        # 长视频按关键帧分段并行编码（只有一段时直接编码整条视频）
+        ranges = segment_encode.plan_ranges(video_file, source_duration, segment_count, crop_width, crop_height)
+
+        # 使用ffmpeg进行裁切（先写临时文件，完成后原子重命名）
+        with manifest.atomic_output(output_file) as temp_output:
+            if len(ranges) > 1:
+                segment_encode.encode_segmented(
+                    lambda start, length: ffmpeg.input(video_file, ss=start, t=length).video.filter('crop', crop_width, crop_height, crop_x1, crop_y1),
+                    ranges, temp_output, encoder,
+                    ffmpeg.input(video_file).audio if keep_audio and has_audio else None, stage="裁切"
+                )
+            elif keep_audio and has_audio:
+                # 保留音效的裁切 - 使用更明确的音视频流处理
+                input_stream = ffmpeg.input(video_file)
+                video_stream = input_stream.video.filter('crop', crop_width, crop_height, crop_x1, crop_y1)
+                audio_stream = input_stream.audio
+
+                ffmpeg_progress.run(
+                    ffmpeg
+                    .output(video_stream, audio_stream, temp_output,
+                           **encoder_profiles.output_kwargs(encoder, with_audio=True))
+                    .overwrite_output(),
+                    stage="裁切", source=video_file
+                )
+            else:
+                # 不保留音效的裁切
+                ffmpeg_progress.run(
+                    ffmpeg
+                    .input(video_file)
+                    .video
+                    .filter('crop', crop_width, crop_height, crop_x1, crop_y1)
+                    .output(temp_output, **encoder_profiles.output_kwargs(encoder, with_audio=False))
+                    .overwrite_output(),
+                    stage="裁切", source=video_file
+                )
+
+        # 校验阶段：输出完整才记入清单，不完整的输出下次运行重新编码
+        problem = manifest.verify_output(output_file, source_duration)
+        if problem:
+            raise RuntimeError(f"输出校验失败: {problem}")
+
+        if output_manifest is not None:
+            output_manifest.record(output_file, [video_file], manifest_params)
+
+        return output_file, keep_audio and has_audio
+
+    def crop_videos(self, input_folder, output_folder_name, crop_x1, crop_y1, crop_x2, crop_y2, keep_audio=True, max_parallel_jobs=0,
+                    encoder_profile="balanced", video_codec="libx264", crf=-1, video_bitrate="", encoder_threads=0, tune="none",
+                    skip_existing=True, queue_mode="off", queue_path="", memory_limit_gb=0.0, segment_count=1,
+                    scratch_dir="", scratch_budget_gb=0.0):
         """
         裁切视频文件
         
@@ -63,6 +163,15 @@ class VideoCropNode:
             crop_x1, crop_y1: 左上角坐标
             crop_x2, crop_y2: 右下角坐标
             keep_audio: 是否保留音效
+            max_parallel_jobs: 并发处理的视频数量，0表示根据CPU核心数自动选择
+            encoder_profile, video_codec, crf, video_bitrate, encoder_threads, tune: 编码参数
+            skip_existing: 是否跳过已是最新的输出（根据输出文件夹中的清单判断）
+            queue_mode: off单独处理/shared多个实例通过共享队列分摊文件
+            queue_path: 共享队列数据库路径，留空时使用输出文件夹中的队列文件
+            memory_limit_gb: ffmpeg进程的内存上限（GB），0表示物理内存的75%
+            segment_count: 单个长视频按关键帧分段并行编码的段数，1表示不分段，0表示自动
+            scratch_dir: 分段编码中间文件的临时目录，留空时使用系统临时目录
+            scratch_budget_gb: 临时目录的空间预算（GB），0表示磁盘可用空间的80%
         """
         try:
             # 使用ComfyUI的默认输入和输出路径
@@ -85,70 +194,56 @@ class VideoCropNode:
             output_path = os.path.join(output_folder, output_folder_name)
             os.makedirs(output_path, exist_ok=True)
             
-            # 支持的视频格式
-            video_extensions = ['*.mp4', '*.avi', '*.mov', '*.mkv', '*.wmv', '*.flv', '*.webm']
-            
-            # 遍历所有视频文件
+            # 收集所有视频文件（共享索引，按文件名排序保证输出顺序确定，扩展名不区分大小写）
+            video_files = folder_index.list_videos(input_folder_path)
+
+            encoder = encoder_profiles.resolve_encoder(encoder_profile, video_codec, crf, video_bitrate, encoder_threads, tune)
+            print(f"🎞️ 编码配置: {encoder_profiles.describe(encoder)}")
+
+            # 按核心数、负载和源视频分辨率分配并发数和每个ffmpeg的线程数
+            source_width, source_height = scheduler.source_size(video_files)
+            workers = scheduler.activate(scheduler.plan(max_parallel_jobs, len(video_files), source_width, source_height,
+                                                        encoder['threads'], memory_limit_gb)).workers
+            if segment_count != 1:
+                # 分段编码的中间文件写在临时目录中（清理之前运行遗留的目录）
+                scratch.configure(scratch_dir, scratch_budget_gb)
+            if workers > 1:
+                print(f"🚀 并发处理 {len(video_files)} 个视频，并发数: {workers}")
+
+            # 流水线：探测（后台线程预先探测）→ 裁切编码 → 校验，阶段之间用有界缓冲连接，
+            # 第一个文件探测完成后就开始编码
+            # 共享队列模式下只处理本实例领取到的文件
+            output_manifest = manifest.OutputManifest(output_path)
+            work = work_queue.open_queue(queue_mode, queue_path, output_path, {
+                'node': 'VideoCropNode',
+                'crop': [crop_x1, crop_y1, crop_x2, crop_y2],
+                'keep_audio': keep_audio,
+                'segment_count': segment_count,
+                'encoder': encoder,
+            })
             processed_count = 0
             output_paths = []
-            for ext in video_extensions:
-                pattern = os.path.join(input_folder_path, ext)
-                video_files = glob.glob(pattern)
-                
-                for video_file in video_files:
-                    try:
-                        # 获取文件名（不含扩展名）
-                        filename = Path(video_file).stem
-                        output_file = os.path.join(output_path, f"{filename}_cropped.mp4")
-                        
-                        # 计算裁切宽度和高度
-                        crop_width = crop_x2 - crop_x1
-                        crop_height = crop_y2 - crop_y1
-                        
-                        # 检查原视频是否有音效
-                        has_audio = False
-                        try:
-                            probe = ffmpeg.probe(video_file)
-                            audio_streams = [stream for stream in probe['streams'] if stream['codec_type'] == 'audio']
-                            has_audio = len(audio_streams) > 0
-                        except Exception:
-                            has_audio = False
-                        
-                        # 使用ffmpeg进行裁切
-                        if keep_audio and has_audio:
-                            # 保留音效的裁切 - 使用更明确的音视频流处理
-                            input_stream = ffmpeg.input(video_file)
-                            video_stream = input_stream.video.filter('crop', crop_width, crop_height, crop_x1, crop_y1)
-                            audio_stream = input_stream.audio
-                            
-                            (
-                                ffmpeg
-                                .output(video_stream, audio_stream, output_file, 
-                                       vcodec='libx264', acodec='aac', 
-                                       audio_bitrate='128k', preset='medium')
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-                        else:
-                            # 不保留音效的裁切
-                            (
-                                ffmpeg
-                                .input(video_file)
-                                .video
-                                .filter('crop', crop_width, crop_height, crop_x1, crop_y1)
-                                .output(output_file, vcodec='libx264', an=None)
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-                        
-                        processed_count += 1
-                        output_paths.append(output_file)
-                        audio_status = "保留音效" if (keep_audio and has_audio) else "无音效"
-                        print(f"已处理: {video_file} -> {output_file} ({audio_status})")
-                        
-                    except Exception as e:
-                        print(f"处理视频文件 {video_file} 时出错: {str(e)}")
+            with work_queue.session(work):
+                results = job_pool.iter_jobs(
+                    lambda video_file: self.crop_single_video(video_file, output_path, crop_x1, crop_y1, crop_x2, crop_y2, keep_audio, encoder,
+                                                              output_manifest, skip_existing, segment_count),
+                    work_queue.claimed_items(work, job_pool.prefetch(job_pool.probe_ahead(video_files, media_cache.probe)),
+                                             lambda video_file: [video_file]),
+                    workers,
+                    ffmpeg_progress.BatchProgress(len(video_files), "视频裁切"),
+                    on_done=work_queue.finish_callback(work, lambda video_file: [video_file])
+                )
+
+                # 按输入顺序汇总结果（每完成一个就输出）
+                for video_file, result, error in results:
+                    if error is not None:
+                        print(f"处理视频文件 {video_file} 时出错: {str(error)}")
                         continue
+                    output_file, kept_audio = result
+                    processed_count += 1
+                    output_paths.append(output_file)
+                    audio_status = "保留音效" if kept_audio else "无音效"
+                    print(f"已处理: {video_file} -> {output_file} ({audio_status})")
             
             if processed_count == 0:
                 return ("",)  # 没有可处理的视频时返回空字符串
@@ -181,20 +276,7 @@ class EnhancedVideoCropNode:
     @classmethod
     def get_input_folders(cls):
         """获取输入目录下的所有子文件夹"""
-        try:
-            input_dir = folder_paths.get_input_directory()
-            if not os.path.exists(input_dir):
-                return ["input"]
-
-            folders = ["input"]  # 默认包含根目录
-            for item in os.listdir(input_dir):
-                item_path = os.path.join(input_dir, item)
-                if os.path.isdir(item_path):
-                    folders.append(item)
-
-            return sorted(folders)
-        except Exception:
-            return ["input"]
+        return folder_index.list_input_folders(folder_paths.get_input_directory())
 
 
     @classmethod
@@ -283,21 +365,20 @@ class EnhancedVideoCropNode:
                 return 1920, 1080  # 默认分辨率
 
             # 查找第一个视频文件
-            for filename in sorted(os.listdir(input_path)):
-                if filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.wmv')):
-                    video_file = os.path.join(input_path, filename)
-                    try:
-                        # 使用ffprobe获取视频信息
-                        probe = ffmpeg.probe(video_file)
-                        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-                        if video_stream:
-                            width = int(video_stream['width'])
-                            height = int(video_stream['height'])
-                            print(f"📐 检测到视频分辨率: {width}×{height} (文件: {filename})")
-                            return width, height
-                    except Exception as e:
-                        print(f"⚠️ 无法读取视频 {filename}: {e}")
-                        continue
+            for video_file in folder_index.list_videos(input_path):
+                filename = os.path.basename(video_file)
+                try:
+                    # 使用ffprobe获取视频信息
+                    probe = media_cache.probe(video_file)
+                    video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+                    if video_stream:
+                        width = int(video_stream['width'])
+                        height = int(video_stream['height'])
+                        print(f"📐 检测到视频分辨率: {width}×{height} (文件: {filename})")
+                        return width, height
+                except Exception as e:
+                    print(f"⚠️ 无法读取视频 {filename}: {e}")
+                    continue
 
             print("⚠️ 未找到有效视频文件，使用默认分辨率 1920×1080")
             return 1920, 1080
@@ -306,12 +387,13 @@ class EnhancedVideoCropNode:
             return 1920, 1080
 
     @classmethod
-    def extract_video_frame(cls, input_folder, frame_time=1.0):
+    def extract_video_frame(cls, input_folder, frame_time=1.0, thumbnail_cache_mb=thumbnail_store.DEFAULT_BUDGET_MB):
         """
         提取视频首帧用于预览
         Args:
             input_folder: 输入文件夹
-            frame_time: 提取帧的时间点（秒）
+            frame_time: 提取帧的时间点（秒），取该时间点之前最近的关键帧
+            thumbnail_cache_mb: 预览帧缓存的磁盘预算（MB）
         Returns:
             (frame_path, video_width, video_height) 或 (None, None, None)
         """
@@ -320,100 +402,122 @@ class EnhancedVideoCropNode:
             if not os.path.exists(input_path):
                 return None, None, None
 
-            # 查找第一个视频文件
-            for filename in sorted(os.listdir(input_path)):
-                if filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.wmv')):
-                    video_file = os.path.join(input_path, filename)
-                    try:
-                        # 使用ComfyUI的输出目录来存储预览帧（可被Web访问）
-                        output_dir = folder_paths.get_output_directory()
-                        cache_dir = os.path.join(output_dir, "video_previews")
-                        os.makedirs(cache_dir, exist_ok=True)
-
-                        # 生成唯一的帧文件名，包含路径哈希避免同名文件冲突
-                        import hashlib
-                        path_hash = hashlib.md5(video_file.encode('utf-8')).hexdigest()[:8]
-                        frame_filename = f"{filename}_{path_hash}_{int(frame_time)}s_frame.jpg"
-                        frame_path = os.path.join(cache_dir, frame_filename)
-
-                        # 检查帧文件是否已存在且比视频文件新
-                        frame_cached = False
-                        if os.path.exists(frame_path):
-                            video_mtime = os.path.getmtime(video_file)
-                            frame_mtime = os.path.getmtime(frame_path)
-                            if frame_mtime > video_mtime:
-                                # 缓存有效，跳过帧生成
-                                frame_cached = True
-                                print(f"🎯 使用缓存的预览帧: {frame_path}")
-                            else:
-                                print(f"🔄 视频文件已更新，重新生成预览帧: {video_file}")
+            output_dir = folder_paths.get_output_directory()
+            thumbnail_store.remove_legacy_previews(output_dir)
+            store = thumbnail_store.ThumbnailStore(thumbnail_cache_mb * 1024 * 1024)
 
-                        # 如果没有缓存，提取视频帧
+            # 查找第一个视频文件
+            for video_file in folder_index.list_videos(input_path):
+                filename = os.path.basename(video_file)
+                try:
+                    # 预览帧存放在受预算限制的缓存中，视频文件变化时指纹随之变化
+                    frame_path, frame_cached = store.get(video_file, frame_time)
+
+                    # 获取视频分辨率
+                    probe = media_cache.probe(video_file)
+                    video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+                    if video_stream:
+                        width = int(video_stream['width'])
+                        height = int(video_stream['height'])
                         if not frame_cached:
-                            (
-                                ffmpeg
-                                .input(video_file, ss=frame_time)
-                                .output(frame_path, vframes=1, format='image2', vcodec='mjpeg')
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-
-                        # 获取视频分辨率
-                        probe = ffmpeg.probe(video_file)
-                        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-                        if video_stream:
-                            width = int(video_stream['width'])
-                            height = int(video_stream['height'])
-                            if not frame_cached:
-                                print(f"📸 提取视频帧: {frame_path} ({width}×{height})")
+                            print(f"📸 提取视频帧: {frame_path} ({width}×{height})")
+                        else:
+                            print(f"📸 使用缓存帧: {frame_path} ({width}×{height})")
+
+                        # JavaScript从output根目录读取原分辨率的预览图片，包含路径哈希避免同名目录冲突
+                        input_path_hash = hashlib.sha256(input_path.encode('utf-8')).hexdigest()[:8]
+                        preview_filename = f"video_preview_{input_folder}_{input_path_hash}.jpg"
+                        preview_path_root = os.path.join(output_dir, preview_filename)
+
+                        try:
+                            if os.path.exists(preview_path_root) and os.path.samefile(frame_path, preview_path_root):
+                                print(f"🎯 使用缓存的预览图片: {preview_path_root}")
                             else:
-                                print(f"📸 使用缓存帧: {frame_path} ({width}×{height})")
-
-                            # 额外生成JavaScript期望的预览图片文件，包含路径哈希避免同名目录冲突
-                            input_folder_full_path = EnhancedVideoCropNode.get_input_path(input_folder)
-                            input_path_hash = hashlib.sha256(input_folder_full_path.encode('utf-8')).hexdigest()[:8]
-                            preview_filename = f"video_preview_{input_folder}_{input_path_hash}.jpg"
-                            preview_path_subdir = os.path.join(cache_dir, preview_filename)
-                            preview_path_root = os.path.join(output_dir, preview_filename)
-
-                            try:
-                                # 检查预览图片是否需要更新
-                                import shutil
-                                need_update = True
-
-                                if os.path.exists(preview_path_root):
-                                    frame_mtime = os.path.getmtime(frame_path)
-                                    preview_mtime = os.path.getmtime(preview_path_root)
-                                    need_update = frame_mtime > preview_mtime
-
-                                if need_update:
-                                    # 复制帧文件到预览位置（在video_previews子目录）
-                                    shutil.copy2(frame_path, preview_path_subdir)
-                                    print(f"📸 预览图片已生成: {preview_path_subdir}")
-
-                                    # 同时在output根目录也生成一份供JavaScript访问
-                                    shutil.copy2(frame_path, preview_path_root)
-                                    print(f"📸 JavaScript预览图片已生成: {preview_path_root}")
-                                else:
-                                    print(f"🎯 使用缓存的预览图片: {preview_path_root}")
-                            except Exception as e:
-                                print(f"⚠️ 生成预览图片失败: {e}")
-
-                            return frame_path, width, height
-
-                    except Exception as e:
-                        print(f"⚠️ 无法提取视频帧 {filename}: {e}")
-                        continue
+                                # 硬链接到缓存中的帧文件，不额外占用空间
+                                thumbnail_store.publish(frame_path, preview_path_root)
+                                print(f"📸 JavaScript预览图片已生成: {preview_path_root}")
+                        except Exception as e:
+                            print(f"⚠️ 生成预览图片失败: {e}")
+
+                        return frame_path, width, height
+
+                except Exception as e:
+                    print(f"⚠️ 无法提取视频帧 {filename}: {e}")
+                    continue
 
             return None, None, None
         except Exception as e:
             print(f"⚠️ 提取视频帧失败: {e}")
             return None, None, None
 
+    # 预览视频的编码参数：只用于确认裁切位置，优先速度
+    PREVIEW_ENCODE_OPTIONS = {'vcodec': 'libx264', 'preset': 'ultrafast', 'crf': 28, 'pix_fmt': 'yuv420p'}
 
+    @classmethod
+    def build_preview_stream(cls, video, crop_coords, video_size, preview_height=480):
+        """
+        在视频流上叠加裁切框、遮罩和信息文本，得到预览画面
+
+        Args:
+            video: 原视频的视频流
+            crop_coords: 裁切坐标 (x1, y1, x2, y2)
+            video_size: 原视频尺寸 (宽, 高)
+            preview_height: 预览视频高度，0表示保持原分辨率（不会放大）
+        """
+        crop_x1, crop_y1, crop_x2, crop_y2 = crop_coords
+        crop_width = crop_x2 - crop_x1
+        crop_height = crop_y2 - crop_y1
+        orig_width, orig_height = video_size
+
+        # 先缩小再绘制，后续滤镜都在低分辨率画面上进行
+        target_height = min(preview_height, orig_height) if preview_height > 0 else orig_height
+        target_height -= target_height % 2
+        scale = target_height / orig_height
+        target_width = orig_width if target_height == orig_height else int(round(orig_width * scale / 2)) * 2
+
+        def scaled(value):
+            return int(round(value * scale))
+
+        box_x1, box_y1 = scaled(crop_x1), scaled(crop_y1)
+        box_x2, box_y2 = scaled(crop_x2), scaled(crop_y2)
+
+        preview = video
+        if target_height != orig_height:
+            preview = preview.filter('scale', target_width, target_height)
+
+        # 1. 裁切区域外的半透明遮罩（上、下、左、右四块）
+        # drawbox中w/h为0表示整幅画面，空白区域需要跳过
+        mask_regions = [
+            (0, 0, target_width, box_y1),
+            (0, box_y2, target_width, target_height - box_y2),
+            (0, box_y1, box_x1, box_y2 - box_y1),
+            (box_x2, box_y1, target_width - box_x2, box_y2 - box_y1),
+        ]
+        for x, y, w, h in mask_regions:
+            if w <= 0 or h <= 0:
+                continue
+            preview = preview.filter('drawbox', x=x, y=y, w=w, h=h, color='black@0.5', thickness='fill')
+
+        # 2. 添加红色边框
+        preview = preview.filter('drawbox',
+                                 x=box_x1, y=box_y1,
+                                 w=box_x2 - box_x1, h=box_y2 - box_y1,
+                                 color='red',
+                                 thickness=max(2, scaled(3)))
+
+        # 3. 添加信息文本（显示原始分辨率下的数值）
+        preview = preview.filter('drawtext',
+                                 text=f'原尺寸: {orig_width}x{orig_height}\\n裁切: {crop_width}x{crop_height}\\n坐标: ({crop_x1},{crop_y1})',
+                                 x=10, y=10,
+                                 fontsize=max(12, scaled(20)),
+                                 fontcolor='white',
+                                 box=1,
+                                 boxcolor='black@0.8',
+                                 boxborderw=5)
+        return preview
 
     @classmethod
-    def generate_preview_video(cls, video_path, crop_coords, output_path, duration_limit=10):
+    def generate_preview_video(cls, video_path, crop_coords, output_path, duration_limit=10, preview_height=480, video_size=None):
         """
         生成带有裁切框和遮罩的预览视频
 
@@ -422,72 +526,29 @@ class EnhancedVideoCropNode:
             crop_coords: 裁切坐标 (x1, y1, x2, y2)
             output_path: 预览视频保存路径
             duration_limit: 预览视频时长限制（秒）
+            preview_height: 预览视频高度，0表示保持原分辨率（不会放大）
+            video_size: 原视频尺寸 (宽, 高)，已知时不再探测
         """
         try:
-            crop_x1, crop_y1, crop_x2, crop_y2 = crop_coords
-            crop_width = crop_x2 - crop_x1
-            crop_height = crop_y2 - crop_y1
+            # 获取原视频尺寸信息
+            if not video_size:
+                probe = media_cache.probe(video_path)
+                video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+                video_size = (int(video_stream['width']), int(video_stream['height']))
 
             # 使用ffmpeg创建预览视频
             input_stream = ffmpeg.input(video_path, t=duration_limit)  # 限制预览时长
-
-            # 创建带遮罩和边框的视频
-            # 1. 创建半透明遮罩层
-            mask_filter = (
-                input_stream
-                .video
-                .filter('drawbox',
-                       x=0, y=0,
-                       w='iw', h='ih',
-                       color='black@0.5',
-                       thickness='fill')
-                .filter('drawbox',
-                       x=crop_x1, y=crop_y1,
-                       w=crop_width, h=crop_height,
-                       color='black@0.0',
-                       thickness='fill')
-            )
-
-            # 2. 添加红色边框
-            preview_with_border = (
-                mask_filter
-                .filter('drawbox',
-                       x=crop_x1, y=crop_y1,
-                       w=crop_width, h=crop_height,
-                       color='red',
-                       thickness=3)
-            )
-
-            # 获取原视频尺寸信息
-            probe = ffmpeg.probe(video_path)
-            video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-            orig_width = int(video_stream['width'])
-            orig_height = int(video_stream['height'])
-
-            # 3. 添加信息文本
-            text_filter = (
-                preview_with_border
-                .filter('drawtext',
-                       text=f'原尺寸: {orig_width}x{orig_height}\\n裁切: {crop_width}x{crop_height}\\n坐标: ({crop_x1},{crop_y1})',
-                       x=10, y=10,
-                       fontsize=20,
-                       fontcolor='white',
-                       box=1,
-                       boxcolor='black@0.8',
-                       boxborderw=5)
-            )
-
-            # 输出预览视频
-            (
-                ffmpeg
-                .output(text_filter, output_path,
-                       vcodec='libx264',
-                       preset='fast',
-                       crf=23,
-                       an=None)  # 不包含音频
-                .overwrite_output()
-                .run(quiet=True)
-            )
+            preview = cls.build_preview_stream(input_stream.video, crop_coords, video_size, preview_height)
+
+            # 输出预览视频（先写临时文件，完成后原子重命名）
+            with manifest.atomic_output(output_path) as temp_output:
+                ffmpeg_progress.run(
+                    ffmpeg
+                    .output(preview, temp_output, an=None, **cls.PREVIEW_ENCODE_OPTIONS)  # 不包含音频
+                    .overwrite_output(),
+                    stage="预览视频",
+                    duration=min(duration_limit, ffmpeg_progress.media_duration(video_path) or duration_limit)
+                )
 
             return True
 
@@ -509,6 +570,20 @@ class EnhancedVideoCropNode:
                 "pos_y": ("INT", {"default": 0, "min": 0, "max": 4096, "tooltip": "裁切区域左上角Y坐标"}),
                 "crop_width": ("INT", {"default": 1920, "min": 1, "max": 4096, "tooltip": "裁切区域宽度"}),
                 "crop_height": ("INT", {"default": 1080, "min": 1, "max": 4096, "tooltip": "裁切区域高度"}),
+                "max_parallel_jobs": ("INT", {"default": 0, "min": 0, "max": 64, "tooltip": "并发处理的视频数量，0表示根据CPU核心数、负载、分辨率和内存上限自动选择"}),
+                "memory_limit_gb": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 4096.0, "step": 0.5, "tooltip": "所有ffmpeg进程的内存上限（GB），超过时新的编码等待其他任务结束；0表示物理内存的75%"}),
+                "segment_count": segment_encode.segment_count_input_type(),
+                **encoder_profiles.encoder_input_types(),
+                "skip_existing": ("BOOLEAN", {"default": True, "tooltip": "输入、参数和编码配置都未变化的输出直接跳过（根据输出文件夹中的清单判断）"}),
+                "multi_output": ("BOOLEAN", {"default": False, "tooltip": "每个源视频只解码一次，在同一个ffmpeg进程中同时生成预览、裁切结果和下面设置的额外输出（不分段编码）"}),
+                "extra_aspect_ratios": ("STRING", {"default": "", "multiline": False, "tooltip": "多输出模式下额外的居中裁切宽高比，用逗号分隔，如 9:16,1:1"}),
+                "renditions": ("STRING", {"default": "", "multiline": False, "tooltip": "多输出模式下每个裁切区域额外输出的高度，用逗号分隔，如 1080,720,480（只缩小不放大）"}),
+                "preview_mode": (["first_n", "all", "off"], {"default": "first_n", "tooltip": "first_n: 只为前N个视频生成预览, all: 全部生成, off: 不生成预览"}),
+                "preview_count": ("INT", {"default": 3, "min": 0, "max": 1000, "tooltip": "first_n模式下生成预览的视频数量"}),
+                "preview_height": ("INT", {"default": 480, "min": 0, "max": 2160, "step": 2, "tooltip": "预览视频高度（ultrafast编码），0表示原分辨率；源文件和裁切坐标未变化时复用已有预览"}),
+                "thumbnail_cache_mb": ("INT", {"default": thumbnail_store.DEFAULT_BUDGET_MB, "min": thumbnail_store.MIN_BUDGET_MB, "max": 65536, "tooltip": "预览帧缓存的磁盘预算（MB），超出时淘汰最久未使用的预览帧"}),
+                **work_queue.queue_input_types(),
+                **scratch.scratch_input_types(),
             }
         }
 
@@ -517,11 +592,372 @@ class EnhancedVideoCropNode:
     FUNCTION = "enhanced_crop_videos"
     CATEGORY = "video_editing"
 
+    def process_single_video(self, video_file, output_path, preview_path, video_width, video_height,
+                             pos_x, pos_y, crop_width, crop_height, keep_audio=True, preview_only=False, encoder=None,
+                             output_manifest=None, skip_existing=True, build_preview=True, preview_height=480, preview_manifest=None,
+                             segment_count=1):
+        """
+        处理单个视频：生成预览视频并执行裁切
+
+        Args:
+            output_manifest: 输出清单，提供时跳过已是最新的输出并记录新输出
+            build_preview: 是否为该视频生成预览
+            preview_height: 预览视频高度，0表示原分辨率
+            preview_manifest: 预览文件夹的清单，源文件和裁切坐标未变化时复用已有预览
+            segment_count: 按关键帧分段并行编码的段数，1表示不分段，0表示自动
+
+        Returns:
+            dict: {'preview': 是否生成了预览, 'processed': 是否完成了裁切}
+        """
+        result = {'preview': False, 'processed': False}
+        filename = Path(video_file).stem
+
+        # 获取视频信息
+        probe = media_cache.probe(video_file)
+        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+
+        if not video_stream:
+            print(f"无法获取视频流信息: {video_file}")
+            return result
+
+        actual_video_width = int(video_stream['width'])
+        actual_video_height = int(video_stream['height'])
+
+        # 验证实际视频分辨率
+        if actual_video_width != video_width or actual_video_height != video_height:
+            print(f"⚠️ 视频 {filename} 分辨率 {actual_video_width}×{actual_video_height} 与探测分辨率 {video_width}×{video_height} 不匹配，使用实际分辨率")
+
+        # 使用自定义坐标模式
+        final_x1, final_y1 = pos_x, pos_y
+        final_crop_width, final_crop_height = crop_width, crop_height
+        final_x2 = final_x1 + final_crop_width
+        final_y2 = final_y1 + final_crop_height
+
+        # 验证坐标有效性
+        if (final_x1 >= final_x2 or final_y1 >= final_y2 or
+            final_x2 > actual_video_width or final_y2 > actual_video_height or
+            final_x1 < 0 or final_y1 < 0):
+            print(f"无效的裁切坐标: {video_file}, 坐标: ({final_x1},{final_y1}) → ({final_x2},{final_y2}), 视频尺寸: {actual_video_width}×{actual_video_height}")
+            return result
+
+        # 生成10秒低分辨率预览视频（源文件和裁切坐标未变化时复用）
+        if build_preview:
+            preview_file = os.path.join(preview_path, f"{filename}_preview.mp4")
+            preview_params = {
+                'crop': [final_x1, final_y1, final_x2, final_y2],
+                'preview_height': preview_height,
+                'duration': 10,
+                'encode': self.PREVIEW_ENCODE_OPTIONS,
+            }
+            if preview_manifest is not None and skip_existing and preview_manifest.is_up_to_date(preview_file, [video_file], preview_params):
+                result['preview'] = True
+                print(f"🎯 使用缓存的预览视频: {preview_file}")
+            elif self.generate_preview_video(video_file, (final_x1, final_y1, final_x2, final_y2), preview_file, 10,
+                                             preview_height, (actual_video_width, actual_video_height)):
+                result['preview'] = True
+                if preview_manifest is not None:
+                    preview_manifest.record(preview_file, [video_file], preview_params)
+                print(f"预览视频已生成: {preview_file} (时长: 10秒)")
+
+        # 如果只是预览模式，跳过视频处理
+        if preview_only:
+            return result
+
+        # 处理视频裁切
+        output_file = os.path.join(output_path, f"{filename}_cropped.mp4")
+
+        # 检查音频流
+        has_audio = False
+        try:
+            audio_streams = [stream for stream in probe['streams'] if stream['codec_type'] == 'audio']
+            has_audio = len(audio_streams) > 0
+        except Exception:
+            has_audio = False
+
+        # 输入、裁切参数和编码配置都未变化时跳过
+        manifest_params = {
+            'node': 'EnhancedVideoCropNode',
+            'crop': [final_x1, final_y1, final_crop_width, final_crop_height],
+            'keep_audio': keep_audio,
+            # 分段会改变关键帧位置（与合并节点相同），段数不同时重新编码
+            'segment_count': segment_count,
+            'encoder': encoder,
+        }
+        if output_manifest is not None and skip_existing and output_manifest.is_up_to_date(output_file, [video_file], manifest_params):
+            print(f"⏭️ 输出已是最新，跳过: {output_file}")
+            result['processed'] = True
+            return result
+
+        # 长视频按关键帧分段并行编码（只有一段时直接编码整条视频）
+        source_duration = float(probe.get('format', {}).get('duration') or 0)
+        ranges = segment_encode.plan_ranges(video_file, source_duration, segment_count, final_crop_width, final_crop_height)
+
+        # 执行裁切（先写临时文件，完成后原子重命名）
+        with manifest.atomic_output(output_file) as temp_output:
+            if len(ranges) > 1:
+                segment_encode.encode_segmented(
+                    lambda start, length: (
+                        ffmpeg.input(video_file, ss=start, t=length)
+                        .video.filter('crop', final_crop_width, final_crop_height, final_x1, final_y1)
+                    ),
+                    ranges, temp_output, encoder,
+                    ffmpeg.input(video_file).audio if keep_audio and has_audio else None, stage="裁切"
+                )
+            elif keep_audio and has_audio:
+                input_stream = ffmpeg.input(video_file)
+                video_stream = input_stream.video.filter('crop', final_crop_width, final_crop_height, final_x1, final_y1)
+                audio_stream = input_stream.audio
+
+                ffmpeg_progress.run(
+                    ffmpeg
+                    .output(video_stream, audio_stream, temp_output,
+                           **encoder_profiles.output_kwargs(encoder, with_audio=True))
+                    .overwrite_output(),
+                    stage="裁切", source=video_file
+                )
+            else:
+                ffmpeg_progress.run(
+                    ffmpeg
+                    .input(video_file)
+                    .video
+                    .filter('crop', final_crop_width, final_crop_height, final_x1, final_y1)
+                    .output(temp_output, **encoder_profiles.output_kwargs(encoder, with_audio=False))
+                    .overwrite_output(),
+                    stage="裁切", source=video_file
+                )
+
+        # 校验阶段：输出完整才记入清单，不完整的输出下次运行重新编码
+        problem = manifest.verify_output(output_file, source_duration)
+        if problem:
+            raise RuntimeError(f"输出校验失败: {problem}")
+
+        if output_manifest is not None:
+            output_manifest.record(output_file, [video_file], manifest_params)
+
+        result['processed'] = True
+        audio_status = "保留音效" if (keep_audio and has_audio) else "无音效"
+        crop_info = f"裁切尺寸: {final_crop_width}×{final_crop_height}"
+        print(f"已处理: {filename} -> {crop_info} ({audio_status})")
+        return result
+
+    @classmethod
+    def parse_extra_aspect_ratios(cls, text):
+        """解析 "9:16,1:1" 形式的额外裁切宽高比列表（去重，忽略未知的宽高比）"""
+        aspect_ratios = cls.get_aspect_ratios()
+        keys = []
+        for part in (text or "").replace('，', ',').split(','):
+            key = part.strip()
+            if not key:
+                continue
+            if aspect_ratios.get(key) is None:
+                print(f"⚠️ 忽略未知的宽高比: {key}")
+                continue
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+    @staticmethod
+    def parse_renditions(text):
+        """解析 "1080,720,480" 形式的缩小输出高度列表（取偶数，去重，从大到小）"""
+        heights = set()
+        for part in (text or "").replace('，', ',').split(','):
+            part = part.strip().lower().rstrip('p')
+            if not part:
+                continue
+            try:
+                height = int(part)
+            except ValueError:
+                print(f"⚠️ 忽略无效的输出高度: {part}")
+                continue
+            if height >= 2:
+                heights.add(height - height % 2)
+        return sorted(heights, reverse=True)
+
+    def process_multi_output(self, video_file, output_path, preview_path, pos_x, pos_y, crop_width, crop_height,
+                             extra_aspect_ratios=(), renditions=(), keep_audio=True, encoder=None,
+                             output_manifest=None, skip_existing=True, build_preview=True, preview_height=480, preview_manifest=None):
+        """
+        多输出模式：源视频只解码一次，用split滤镜在同一个ffmpeg进程中生成预览、各裁切区域和缩小的输出
+
+        Args:
+            extra_aspect_ratios: 额外的居中裁切宽高比（get_aspect_ratios中的键），输出为 {文件名}_cropped_9x16.mp4
+            renditions: 每个裁切区域额外输出的高度列表（只缩小不放大），输出为 {区域文件名}_720p.mp4
+            其余参数与 process_single_video 相同
+
+        Returns:
+            dict: {'preview': 是否生成了预览, 'processed': 是否完成了裁切, 'outputs': 本次写出的输出文件数}
+        """
+        result = {'preview': False, 'processed': False, 'outputs': 0}
+        filename = Path(video_file).stem
+
+        probe = media_cache.probe(video_file)
+        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
+        if not video_stream:
+            print(f"无法获取视频流信息: {video_file}")
+            return result
+
+        video_width = int(video_stream['width'])
+        video_height = int(video_stream['height'])
+        has_audio = any(stream['codec_type'] == 'audio' for stream in probe['streams'])
+        source_duration = float(probe.get('format', {}).get('duration') or 0)
+
+        # 裁切区域：主区域使用节点设置的坐标（输出文件和清单参数与单输出模式相同，切换模式不会重新编码），
+        # 额外区域按宽高比在画面中居中
+        regions = []
+        main_valid = (pos_x >= 0 and pos_y >= 0 and crop_width > 0 and crop_height > 0 and
+                      pos_x + crop_width <= video_width and pos_y + crop_height <= video_height)
+        if main_valid:
+            regions.append((f"{filename}_cropped", (pos_x, pos_y, crop_width, crop_height), {}))
+        else:
+            print(f"无效的裁切坐标: {video_file}, 坐标: ({pos_x},{pos_y}) → ({pos_x + crop_width},{pos_y + crop_height}), 视频尺寸: {video_width}×{video_height}")
+        for key in extra_aspect_ratios:
+            x1, y1, _, _, w, h = self.calculate_crop_coordinates(video_width, video_height, key)
+            regions.append((f"{filename}_cropped_{key.replace(':', 'x')}", (x1, y1, w, h), {'aspect_ratio': key}))
+
+        # 每个区域一个原尺寸输出，加上各个比区域更矮的缩小输出
+        outputs = []
+        for base_name, crop, extra_params in regions:
+            params = dict({
+                'node': 'EnhancedVideoCropNode',
+                'crop': list(crop),
+                'keep_audio': keep_audio,
+                # 多输出模式不分段，与单输出的分段结果区分
+                'segment_count': 1,
+                'encoder': encoder,
+            }, **extra_params)
+            outputs.append((os.path.join(output_path, f"{base_name}.mp4"), crop, None, params))
+            for target_height in renditions:
+                if target_height >= crop[3]:
+                    continue
+                target_width = max(2, int(round(crop[2] * target_height / crop[3] / 2)) * 2)
+                outputs.append((os.path.join(output_path, f"{base_name}_{target_height}p.mp4"), crop,
+                                (target_width, target_height), dict(params, rendition=[target_width, target_height])))
+
+        # 输入、裁切参数和编码配置都未变化的输出跳过，只为剩下的输出解码
+        pending = []
+        for output in outputs:
+            if output_manifest is not None and skip_existing and output_manifest.is_up_to_date(output[0], [video_file], output[3]):
+                print(f"⏭️ 输出已是最新，跳过: {output[0]}")
+            else:
+                pending.append(output)
+
+        preview_crop = (pos_x, pos_y, pos_x + crop_width, pos_y + crop_height)
+        preview_file = os.path.join(preview_path, f"{filename}_preview.mp4")
+        preview_params = {
+            'crop': list(preview_crop),
+            'preview_height': preview_height,
+            'duration': 10,
+            'encode': self.PREVIEW_ENCODE_OPTIONS,
+        }
+        need_preview = False
+        if build_preview and main_valid:
+            if preview_manifest is not None and skip_existing and preview_manifest.is_up_to_date(preview_file, [video_file], preview_params):
+                result['preview'] = True
+                print(f"🎯 使用缓存的预览视频: {preview_file}")
+            elif pending:
+                need_preview = True
+            elif self.generate_preview_video(video_file, preview_crop, preview_file, 10, preview_height, (video_width, video_height)):
+                # 所有输出都是最新时只需要解码前10秒
+                result['preview'] = True
+                if preview_manifest is not None:
+                    preview_manifest.record(preview_file, [video_file], preview_params)
+                print(f"预览视频已生成: {preview_file} (时长: 10秒)")
+
+        if not pending:
+            result['processed'] = bool(outputs)
+            return result
+
+        if encoder is None:
+            encoder = encoder_profiles.default_encoder()
+        # 本任务分到的线程平分给同一进程中的各个编码器
+        allocation = scheduler.current()
+        threads = encoder['threads'] or (allocation.threads if allocation is not None else scheduler.available_cores())
+        output_encoder = dict(encoder, threads=max(1, threads // len(pending)))
+        with_audio = keep_audio and has_audio
+
+        print(f"🔀 单次解码多输出: {filename} -> {len(pending)} 个输出{'+预览' if need_preview else ''}")
+        source = ffmpeg.input(video_file)
+        branch_count = len(pending) + (1 if need_preview else 0)
+        branches = source.video.filter_multi_output('split', branch_count) if branch_count > 1 else None
+
+        def branch(index):
+            return branches[index] if branches is not None else source.video
+
+        # 所有输出先写临时文件，进程成功结束后一起原子重命名，出错时全部删除
+        with contextlib.ExitStack() as stack:
+            streams = []
+            for index, (output_file, (x, y, w, h), size, _) in enumerate(pending):
+                video = branch(index).filter('crop', w, h, x, y)
+                if size:
+                    video = video.filter('scale', size[0], size[1])
+                temp_output = stack.enter_context(manifest.atomic_output(output_file))
+                if with_audio:
+                    streams.append(ffmpeg.output(video, source.audio, temp_output,
+                                                 **encoder_profiles.output_kwargs(output_encoder, with_audio=True)))
+                else:
+                    streams.append(ffmpeg.output(video, temp_output,
+                                                 **encoder_profiles.output_kwargs(output_encoder, with_audio=False)))
+            if need_preview:
+                # 预览分支在10秒处结束，split继续向其余分支输出
+                preview = self.build_preview_stream(
+                    branch(len(pending)).filter('trim', duration=10).filter('setpts', 'PTS-STARTPTS'),
+                    preview_crop, (video_width, video_height), preview_height
+                )
+                temp_preview = stack.enter_context(manifest.atomic_output(preview_file))
+                streams.append(ffmpeg.output(preview, temp_preview, an=None, **self.PREVIEW_ENCODE_OPTIONS))
+
+            ffmpeg_progress.run(
+                ffmpeg.merge_outputs(*streams).overwrite_output(),
+                stage="多输出裁切", source=video_file
+            )
+
+        # 校验阶段：每个输出完整才记入清单，不完整的输出下次运行重新编码
+        problems = []
+        for output_file, _, _, params in pending:
+            problem = manifest.verify_output(output_file, source_duration)
+            if problem:
+                problems.append(f"{os.path.basename(output_file)}: {problem}")
+            elif output_manifest is not None:
+                output_manifest.record(output_file, [video_file], params)
+        if need_preview:
+            result['preview'] = True
+            if preview_manifest is not None:
+                preview_manifest.record(preview_file, [video_file], preview_params)
+            print(f"预览视频已生成: {preview_file} (时长: 10秒)")
+        if problems:
+            raise RuntimeError(f"输出校验失败: {'; '.join(problems)}")
+
+        result['processed'] = True
+        result['outputs'] = len(pending)
+        audio_status = "保留音效" if with_audio else "无音效"
+        print(f"已处理: {filename} -> {len(pending)} 个输出 ({audio_status})")
+        return result
+
     def enhanced_crop_videos(self, input_folder, output_folder_name, aspect_ratio,
-                           pos_x=0, pos_y=0, crop_width=1920, crop_height=1080):
+                           pos_x=0, pos_y=0, crop_width=1920, crop_height=1080, max_parallel_jobs=0,
+                           encoder_profile="balanced", video_codec="libx264", crf=-1, video_bitrate="", encoder_threads=0, tune="none",
+                           skip_existing=True, preview_mode="first_n", preview_count=3, preview_height=480,
+                           thumbnail_cache_mb=thumbnail_store.DEFAULT_BUDGET_MB, queue_mode="off", queue_path="", memory_limit_gb=0.0,
+                           segment_count=1, scratch_dir="", scratch_budget_gb=0.0,
+                           multi_output=False, extra_aspect_ratios="", renditions=""):
         """
         增强版视频裁切功能
         默认启用预览模式和保留音频
+
+        Args:
+            preview_mode: 预览范围（first_n只为前preview_count个视频生成/all全部/off不生成）
+            preview_count: first_n模式下生成预览的视频数量
+            preview_height: 预览视频高度，0表示原分辨率
+            thumbnail_cache_mb: 预览帧缓存的磁盘预算（MB）
+            queue_mode: off单独处理/shared多个实例通过共享队列分摊文件
+            queue_path: 共享队列数据库路径，留空时使用输出文件夹中的队列文件
+            memory_limit_gb: ffmpeg进程的内存上限（GB），0表示物理内存的75%
+            segment_count: 单个长视频按关键帧分段并行编码的段数，1表示不分段，0表示自动
+            scratch_dir: 分段编码中间文件的临时目录，留空时使用系统临时目录
+            scratch_budget_gb: 临时目录的空间预算（GB），0表示磁盘可用空间的80%
+            multi_output: 每个源视频只解码一次，同时生成预览、裁切结果和额外输出
+            extra_aspect_ratios: 多输出模式下额外的居中裁切宽高比，逗号分隔
+            renditions: 多输出模式下每个裁切区域额外输出的高度，逗号分隔
         """
         try:
             # 直接设置为生产模式，不只是预览
@@ -532,7 +968,7 @@ class EnhancedVideoCropNode:
             print(f"🔍 自动探测视频分辨率: {video_width}×{video_height}")
 
             # 自动生成预览帧用于前端显示
-            frame_path, frame_width, frame_height = self.extract_video_frame(input_folder)
+            frame_path, frame_width, frame_height = self.extract_video_frame(input_folder, thumbnail_cache_mb=thumbnail_cache_mb)
             if frame_path:
                 print(f"📸 视频预览帧已生成: {frame_path}")
             else:
@@ -550,102 +986,92 @@ class EnhancedVideoCropNode:
             preview_path = os.path.join(output_path, "previews")
             os.makedirs(preview_path, exist_ok=True)
 
-            # 支持的视频格式
-            video_extensions = ['*.mp4', '*.avi', '*.mov', '*.mkv', '*.wmv', '*.flv', '*.webm']
-
+            # 收集所有视频文件（共享索引，按文件名排序保证输出顺序确定，扩展名不区分大小写）
+            video_files = folder_index.list_videos(input_folder_path)
+
+            encoder = encoder_profiles.resolve_encoder(encoder_profile, video_codec, crf, video_bitrate, encoder_threads, tune)
+            print(f"🎞️ 编码配置: {encoder_profiles.describe(encoder)}")
+
+            # 按核心数、负载和源视频分辨率分配并发数和每个ffmpeg的线程数
+            workers = scheduler.activate(scheduler.plan(max_parallel_jobs, len(video_files), video_width, video_height,
+                                                        encoder['threads'], memory_limit_gb)).workers
+            if multi_output:
+                extra_keys = self.parse_extra_aspect_ratios(extra_aspect_ratios)
+                rendition_heights = self.parse_renditions(renditions)
+                print(f"🔀 多输出模式: 额外宽高比 {extra_keys or '无'}，缩小输出 {rendition_heights or '无'}")
+                if segment_count != 1:
+                    print("⚠️ 多输出模式不分段编码，segment_count 被忽略")
+                    segment_count = 1
+            elif extra_aspect_ratios.strip() or renditions.strip():
+                print("⚠️ extra_aspect_ratios 和 renditions 只在多输出模式（multi_output）下生效")
+            if segment_count != 1:
+                # 分段编码的中间文件写在临时目录中（清理之前运行遗留的目录）
+                scratch.configure(scratch_dir, scratch_budget_gb)
+            if workers > 1:
+                print(f"🚀 并发处理 {len(video_files)} 个视频，并发数: {workers}")
+
+            # 预览只为选中的视频生成，调整裁切位置时不需要整批编码
+            if preview_mode == "all":
+                preview_files = set(video_files)
+            elif preview_mode == "first_n":
+                preview_files = set(video_files[:max(preview_count, 0)])
+            else:
+                preview_files = set()
+            if preview_files:
+                print(f"🖼️ 为 {len(preview_files)}/{len(video_files)} 个视频生成预览 (高度: {preview_height or '原分辨率'})")
+
+            output_manifest = manifest.OutputManifest(output_path)
+            preview_manifest = manifest.OutputManifest(preview_path)
+            # 共享队列模式下只处理本实例领取到的文件
+            queue_params = {
+                'node': 'EnhancedVideoCropNode',
+                'crop': [pos_x, pos_y, crop_width, crop_height],
+                'keep_audio': keep_audio,
+                'segment_count': segment_count,
+                'encoder': encoder,
+            }
+            if multi_output:
+                queue_params['outputs'] = {'aspect_ratios': extra_keys, 'renditions': rendition_heights}
+            work = work_queue.open_queue(queue_mode, queue_path, output_path, queue_params)
             processed_count = 0
             preview_count = 0
-
-            for ext in video_extensions:
-                pattern = os.path.join(input_folder_path, ext)
-                video_files = glob.glob(pattern)
-
-                for video_file in video_files:
-                    try:
-                        filename = Path(video_file).stem
-
-                        # 获取视频信息
-                        probe = ffmpeg.probe(video_file)
-                        video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-
-                        if not video_stream:
-                            print(f"无法获取视频流信息: {video_file}")
-                            continue
-
-                        actual_video_width = int(video_stream['width'])
-                        actual_video_height = int(video_stream['height'])
-
-                        # 验证实际视频分辨率
-                        if actual_video_width != video_width or actual_video_height != video_height:
-                            print(f"⚠️ 视频 {filename} 分辨率 {actual_video_width}×{actual_video_height} 与探测分辨率 {video_width}×{video_height} 不匹配，使用实际分辨率")
-
-                        # 使用自定义坐标模式
-                        final_x1, final_y1 = pos_x, pos_y
-                        final_crop_width, final_crop_height = crop_width, crop_height
-                        final_x2 = final_x1 + final_crop_width
-                        final_y2 = final_y1 + final_crop_height
-
-                        # 验证坐标有效性
-                        if (final_x1 >= final_x2 or final_y1 >= final_y2 or
-                            final_x2 > actual_video_width or final_y2 > actual_video_height or
-                            final_x1 < 0 or final_y1 < 0):
-                            print(f"无效的裁切坐标: {video_file}, 坐标: ({final_x1},{final_y1}) → ({final_x2},{final_y2}), 视频尺寸: {actual_video_width}×{actual_video_height}")
-                            continue
-
-                        # 生成10秒预览视频
-                        preview_file = os.path.join(preview_path, f"{filename}_preview.mp4")
-                        if self.generate_preview_video(video_file, (final_x1, final_y1, final_x2, final_y2), preview_file, 10):
-                            preview_count += 1
-                            print(f"预览视频已生成: {preview_file} (时长: 10秒)")
-
-                        # 如果只是预览模式，跳过视频处理
-                        if preview_only:
-                            continue
-
-                        # 处理视频裁切
-                        output_file = os.path.join(output_path, f"{filename}_cropped.mp4")
-
-                        # 检查音频流
-                        has_audio = False
-                        try:
-                            audio_streams = [stream for stream in probe['streams'] if stream['codec_type'] == 'audio']
-                            has_audio = len(audio_streams) > 0
-                        except Exception:
-                            has_audio = False
-
-                        # 执行裁切
-                        if keep_audio and has_audio:
-                            input_stream = ffmpeg.input(video_file)
-                            video_stream = input_stream.video.filter('crop', final_crop_width, final_crop_height, final_x1, final_y1)
-                            audio_stream = input_stream.audio
-
-                            (
-                                ffmpeg
-                                .output(video_stream, audio_stream, output_file,
-                                       vcodec='libx264', acodec='aac',
-                                       audio_bitrate='128k', preset='medium')
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-                        else:
-                            (
-                                ffmpeg
-                                .input(video_file)
-                                .video
-                                .filter('crop', final_crop_width, final_crop_height, final_x1, final_y1)
-                                .output(output_file, vcodec='libx264', an=None)
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-
-                        processed_count += 1
-                        audio_status = "保留音效" if (keep_audio and has_audio) else "无音效"
-                        crop_info = f"裁切尺寸: {final_crop_width}×{final_crop_height}"
-                        print(f"已处理: {filename} -> {crop_info} ({audio_status})")
-
-                    except Exception as e:
-                        print(f"处理视频文件 {video_file} 时出错: {str(e)}")
+            output_count = 0
+
+            def process(video_file):
+                if multi_output:
+                    return self.process_multi_output(
+                        video_file, output_path, preview_path, pos_x, pos_y, crop_width, crop_height,
+                        extra_keys, rendition_heights, keep_audio, encoder,
+                        output_manifest, skip_existing, video_file in preview_files, preview_height, preview_manifest
+                    )
+                return self.process_single_video(
+                    video_file, output_path, preview_path, video_width, video_height,
+                    pos_x, pos_y, crop_width, crop_height, keep_audio, preview_only, encoder,
+                    output_manifest, skip_existing, video_file in preview_files, preview_height, preview_manifest,
+                    segment_count
+                )
+
+            with work_queue.session(work):
+                # 流水线：探测（后台线程预先探测）→ 预览和裁切编码 → 校验，阶段之间用有界缓冲连接，
+                # 第一个文件探测完成后就开始编码
+                results = job_pool.iter_jobs(
+                    process,
+                    work_queue.claimed_items(work, job_pool.prefetch(job_pool.probe_ahead(video_files, media_cache.probe)),
+                                             lambda video_file: [video_file]),
+                    workers,
+                    ffmpeg_progress.BatchProgress(len(video_files), "批量视频裁切"),
+                    on_done=work_queue.finish_callback(work, lambda video_file: [video_file])
+                )
+
+                for video_file, result, error in results:
+                    if error is not None:
+                        print(f"处理视频文件 {video_file} 时出错: {str(error)}")
                         continue
+                    if result['preview']:
+                        preview_count += 1
+                    if result['processed']:
+                        processed_count += 1
+                    output_count += result.get('outputs', 0)
 
             # 生成结果报告
             result_parts = []
@@ -654,6 +1080,8 @@ class EnhancedVideoCropNode:
                 result_parts.append(f"生成预览视频: {preview_count} 个")
             if processed_count > 0:
                 result_parts.append(f"裁切视频: {processed_count} 个")
+            if output_count > 0:
+                result_parts.append(f"多输出写出文件: {output_count} 个")
 
             # 打印处理结果
             if result_parts:
@@ -0,0 +1,180 @@
+"""
+编码配置
+命名的编码档位（速度/体积取舍）+ 可选的CPU编码器（libx264/libx265/SVT-AV1），
+所有节点通过 output_kwargs 生成 ffmpeg.output 的编码参数
+"""
+
+import subprocess
+
+from . import scheduler
+
+# 编码档位：每个编码器各自的preset和默认CRF
+ENCODER_PROFILES = {
+    "draft": {
+        "description": "草稿/极速",
+        "audio_bitrate": "96k",
+        "libx264": {"preset": "ultrafast", "crf": 28},
+        "libx265": {"preset": "ultrafast", "crf": 32},
+        "libsvtav1": {"preset": 12, "crf": 40},
+    },
+    "balanced": {
+        "description": "均衡",
+        "audio_bitrate": "128k",
+        "libx264": {"preset": "medium", "crf": 23},
+        "libx265": {"preset": "medium", "crf": 28},
+        "libsvtav1": {"preset": 8, "crf": 32},
+    },
+    "archive": {
+        "description": "存档/高质量",
+        "audio_bitrate": "192k",
+        "libx264": {"preset": "slow", "crf": 18},
+        "libx265": {"preset": "slow", "crf": 22},
+        "libsvtav1": {"preset": 4, "crf": 24},
+    },
+}
+
+DEFAULT_PROFILE = "balanced"
+DEFAULT_CODEC = "libx264"
+VIDEO_CODECS = ["libx264", "libx265", "libsvtav1"]
+TUNES = ["none", "film", "animation", "grain", "stillimage", "fastdecode", "zerolatency"]
+
+# 各编码器支持的tune参数（x265没有film/stillimage，SVT-AV1不支持tune参数）
+CODEC_TUNES = {
+    "libx264": ["film", "animation", "grain", "stillimage", "fastdecode", "zerolatency"],
+    "libx265": ["animation", "grain", "fastdecode", "zerolatency"],
+}
+# 各编码器接受的CRF上限（x264/x265超过51时ffmpeg直接报错）
+MAX_CRF = {"libx264": 51, "libx265": 51, "libsvtav1": 63}
+
+_available_encoders = None
+
+
+def available_encoders():
+    """返回当前ffmpeg支持的编码器名称集合（结果缓存）"""
+    global _available_encoders
+    if _available_encoders is None:
+        try:
+            output = subprocess.run(
+                ['ffmpeg', '-hide_banner', '-encoders'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+            ).stdout.decode('utf-8', errors='replace')
+            encoders = set()
+            for line in output.splitlines():
+                parts = line.split()
+                # 编码器行格式: " V..... libx264   描述"
+                if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] in "VAS":
+                    encoders.add(parts[1])
+            _available_encoders = encoders
+        except Exception as e:
+            print(f"⚠️ 无法获取ffmpeg编码器列表: {e}")
+            _available_encoders = {DEFAULT_CODEC}
+    return _available_encoders
+
+
+def resolve_encoder(profile=DEFAULT_PROFILE, video_codec=DEFAULT_CODEC, crf=-1, video_bitrate="", threads=0, tune="none"):
+    """
+    解析编码配置
+
+    Args:
+        profile: 编码档位（draft/balanced/archive）
+        video_codec: 视频编码器，ffmpeg不支持时回退到libx264
+        crf: 质量参数，-1表示使用档位默认值
+        video_bitrate: 目标码率（如"4M"），非空时使用码率模式代替CRF
+        threads: 编码线程数，0表示由编码器自动决定
+        tune: x264/x265的tune参数，"none"表示不设置，编码器不支持的tune不设置
+    Returns:
+        dict: 编码配置
+    """
+    if profile not in ENCODER_PROFILES:
+        print(f"⚠️ 未知的编码档位 {profile}，使用 {DEFAULT_PROFILE}")
+        profile = DEFAULT_PROFILE
+    if video_codec not in VIDEO_CODECS:
+        print(f"⚠️ 未知的视频编码器 {video_codec}，使用 {DEFAULT_CODEC}")
+        video_codec = DEFAULT_CODEC
+    if video_codec != DEFAULT_CODEC and video_codec not in available_encoders():
+        print(f"⚠️ 当前ffmpeg不支持 {video_codec}，回退到 {DEFAULT_CODEC}")
+        video_codec = DEFAULT_CODEC
+
+    profile_settings = ENCODER_PROFILES[profile]
+    codec_settings = profile_settings[video_codec]
+    video_bitrate = (video_bitrate or "").strip()
+    if crf is not None and crf > MAX_CRF[video_codec]:
+        print(f"⚠️ {video_codec} 的CRF范围是0-{MAX_CRF[video_codec]}，CRF {crf} 超出范围，改用 {MAX_CRF[video_codec]}")
+        crf = MAX_CRF[video_codec]
+    if not tune or tune == "none":
+        tune = None
+    elif tune not in CODEC_TUNES.get(video_codec, []):
+        print(f"⚠️ {video_codec} 不支持tune {tune}，不设置tune")
+        tune = None
+
+    return {
+        'profile': profile,
+        'vcodec': video_codec,
+        'preset': codec_settings['preset'],
+        'crf': None if video_bitrate else (crf if crf is not None and crf >= 0 else codec_settings['crf']),
+        'video_bitrate': video_bitrate or None,
+        'threads': threads if threads and threads > 0 else 0,
+        'tune': tune,
+        'audio_bitrate': profile_settings['audio_bitrate'],
+    }
+
+
+def default_encoder():
+    """与之前写死的参数等价的默认编码配置（libx264 medium）"""
+    return resolve_encoder(DEFAULT_PROFILE, DEFAULT_CODEC)
+
+
+def output_kwargs(encoder=None, with_audio=True):
+    """
+    生成 ffmpeg.output 的编码参数
+
+    Args:
+        encoder: resolve_encoder返回的配置，None时使用默认配置
+        with_audio: 是否编码音频，False时添加an参数
+    """
+    if encoder is None:
+        encoder = default_encoder()
+
+    kwargs = {
+        'vcodec': encoder['vcodec'],
+        'preset': encoder['preset'],
+        'pix_fmt': 'yuv420p',
+    }
+    if encoder['video_bitrate']:
+        kwargs['video_bitrate'] = encoder['video_bitrate']
+    else:
+        kwargs['crf'] = encoder['crf']
+    # 线程数未指定时使用当前批处理的资源分配（不写入encoder，避免改变输出清单中的参数）
+    allocation = scheduler.current()
+    threads = encoder['threads'] or (allocation.threads if allocation is not None else 0)
+    if threads:
+        kwargs['threads'] = threads
+    if encoder['tune']:
+        kwargs['tune'] = encoder['tune']
+    if encoder['vcodec'] == 'libx265':
+        kwargs['tag:v'] = 'hvc1'  # 兼容QuickTime等播放器
+
+    if with_audio:
+        kwargs['acodec'] = 'aac'
+        kwargs['audio_bitrate'] = encoder['audio_bitrate']
+    else:
+        kwargs['an'] = None
+    return kwargs
+
+
+def describe(encoder):
+    """返回编码配置的简短描述，用于日志"""
+    quality = f"码率 {encoder['video_bitrate']}" if encoder['video_bitrate'] else f"CRF {encoder['crf']}"
+    return f"{encoder['vcodec']} {encoder['profile']} (preset {encoder['preset']}, {quality})"
+
+
+def encoder_input_types():
+    """各节点共用的编码参数输入定义"""
+    return {
+        "encoder_profile": (list(ENCODER_PROFILES.keys()), {"default": DEFAULT_PROFILE, "tooltip": "编码档位: draft极速/balanced均衡/archive高质量"}),
+        "video_codec": (VIDEO_CODECS, {"default": DEFAULT_CODEC, "tooltip": "视频编码器，ffmpeg不支持时自动回退到libx264"}),
+        "crf": ("INT", {"default": -1, "min": -1, "max": 63, "tooltip": "质量参数，-1表示使用档位默认值；libx264/libx265最大51，libsvtav1最大63，超出时按上限编码"}),
+        "video_bitrate": ("STRING", {"default": "", "multiline": False, "tooltip": "目标码率（如4M），填写后使用码率模式代替CRF"}),
+        "encoder_threads": ("INT", {"default": 0, "min": 0, "max": 128, "tooltip": "每个编码进程的线程数，0表示自动"}),
+        "tune": (TUNES, {"default": "none", "tooltip": "x264/x265的tune参数（x265不支持film/stillimage，SVT-AV1不支持tune），编码器不支持时忽略"}),
+    }
@@ -0,0 +1,384 @@
+"""
+ffmpeg进度
+以 -progress pipe:1 运行ffmpeg，流式解析 frame/fps/speed/out_time，
+换算成百分比、编码速度（x实时）和预计剩余时间，汇报到控制台、ComfyUI进度条和注册的回调
+"""
+
+import os
+import time
+import threading
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+
+import ffmpeg
+
+from . import media_cache
+from . import scheduler
+
+try:
+    from comfy.utils import ProgressBar
+except ImportError:
+    ProgressBar = None  # 不在ComfyUI中运行时只输出到控制台
+
+# 同一阶段两次控制台输出的最小间隔（秒）
+PRINT_INTERVAL_SECONDS = 5.0
+# 保留的stderr行数，出错时作为错误信息
+STDERR_TAIL_LINES = 200
+# 失败时打印的stderr行数
+ERROR_PRINT_LINES = 10
+# ComfyUI进度条的刻度数
+PROGRESS_BAR_STEPS = 1000
+
+_listeners = []
+_listeners_lock = threading.Lock()
+_local = threading.local()
+
+
+def add_listener(callback):
+    """
+    注册进度回调 callback(event)
+
+    event为dict: job/stage/frame/fps/speed/out_time/duration/percent/eta/elapsed/done
+    """
+    with _listeners_lock:
+        if callback not in _listeners:
+            _listeners.append(callback)
+
+
+def remove_listener(callback):
+    """注销进度回调"""
+    with _listeners_lock:
+        if callback in _listeners:
+            _listeners.remove(callback)
+
+
+def _emit(event):
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for callback in listeners:
+        try:
+            callback(event)
+        except Exception as e:
+            print(f"⚠️ 进度回调出错: {e}")
+
+
+class BatchProgress:
+    """
+    批处理整体进度
+    汇总各任务当前阶段的完成比例，更新ComfyUI节点进度条
+    """
+
+    def __init__(self, total_jobs, label=""):
+        self.total_jobs = max(total_jobs, 1)
+        self.label = label
+        self._fractions = {}
+        self._lock = threading.Lock()
+        self._bar = None
+        if ProgressBar is not None:
+            try:
+                self._bar = ProgressBar(PROGRESS_BAR_STEPS)
+            except Exception:
+                self._bar = None  # 不在节点执行上下文中
+
+    @property
+    def fraction(self):
+        with self._lock:
+            return min(sum(self._fractions.values()) / self.total_jobs, 1.0)
+
+    def set_total(self, total_jobs):
+        """更新任务总数（流式处理时，规划结束后才知道实际需要编码的任务数）"""
+        with self._lock:
+            self.total_jobs = max(total_jobs, 1)
+        self._refresh()
+
+    def update(self, job_key, fraction):
+        """更新单个任务的完成比例（0~1）"""
+        with self._lock:
+            self._fractions[job_key] = max(0.0, min(fraction, 1.0))
+        self._refresh()
+
+    def finish_job(self, job_key):
+        """标记任务完成（无论成功与否）"""
+        self.update(job_key, 1.0)
+
+    def _refresh(self):
+        if self._bar is None:
+            return
+        try:
+            self._bar.update_absolute(int(self.fraction * PROGRESS_BAR_STEPS), PROGRESS_BAR_STEPS)
+        except Exception:
+            pass
+
+
+def _current_scope():
+    return getattr(_local, 'scope', None) or {'name': '', 'key': None, 'batch': None}
+
+
+@contextmanager
+def job_scope(name, batch=None, key=None):
+    """
+    设置当前线程的任务上下文，其中的ffmpeg调用按该任务汇报进度
+
+    Args:
+        name: 任务名称（用于日志）
+        batch: BatchProgress，为None时沿用外层上下文的批处理进度
+        key: 任务在批处理中的标识，默认与name相同
+    """
+    parent = getattr(_local, 'scope', None)
+    scope = dict(parent) if parent else {'name': '', 'key': None, 'batch': None}
+    scope['name'] = name
+    if batch is not None:
+        scope['batch'] = batch
+        scope['key'] = key if key is not None else name
+    _local.scope = scope
+    try:
+        yield scope
+    finally:
+        _local.scope = parent
+        if batch is not None:
+            batch.finish_job(scope['key'])
+
+
+def media_duration(path):
+    """从缓存的ffprobe结果读取媒体时长（秒），无法获取时返回None"""
+    try:
+        return float(media_cache.probe(path)['format']['duration'])
+    except Exception:
+        return None
+
+
+def _parse_time(value):
+    """解析 HH:MM:SS.micro 格式的时间"""
+    try:
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (ValueError, AttributeError):
+        return None
+
+
+def _parse_speed(value):
+    """解析 1.23x 格式的速度，N/A时返回None"""
+    try:
+        return float(value.strip().rstrip('x'))
+    except (ValueError, AttributeError):
+        return None
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    return f"{seconds // 60:02d}:{seconds % 60:02d}" if seconds < 3600 else f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class _ProgressState:
+    """单次ffmpeg调用的进度状态"""
+
+    def __init__(self, stage, duration, scope):
+        self.stage = stage
+        self.duration = duration if duration and duration > 0 else None
+        self.scope = scope
+        self.values = {}
+        self.started = time.time()
+        self.last_print = 0.0
+
+    def event(self, done=False):
+        out_time = None
+        if 'out_time_us' in self.values:
+            try:
+                out_time = int(self.values['out_time_us']) / 1000000.0
+            except ValueError:
+                out_time = None
+        if out_time is None:
+            out_time = _parse_time(self.values.get('out_time'))
+
+        try:
+            frame = int(self.values.get('frame', 0))
+        except ValueError:
+            frame = 0
+        try:
+            fps = float(self.values.get('fps', 0))
+        except ValueError:
+            fps = 0.0
+        speed = _parse_speed(self.values.get('speed'))
+
+        percent = None
+        eta = None
+        if self.duration and out_time is not None:
+            percent = 100.0 if done else max(0.0, min(out_time / self.duration * 100.0, 100.0))
+            if speed and speed > 0:
+                eta = 0.0 if done else max(self.duration - out_time, 0.0) / speed
+
+        return {
+            'job': self.scope['name'],
+            'stage': self.stage,
+            'frame': frame,
+            'fps': fps,
+            'speed': speed,
+            'out_time': out_time,
+            'duration': self.duration,
+            'percent': percent,
+            'eta': eta,
+            'elapsed': time.time() - self.started,
+            'done': done,
+        }
+
+    def report(self, done=False):
+        event = self.event(done)
+        _emit(event)
+
+        batch = self.scope['batch']
+        if batch is not None and event['percent'] is not None and not done:
+            # 任务完成由job_scope统一标记，阶段结束时不提前记为1
+            batch.update(self.scope['key'], min(event['percent'] / 100.0, 0.99))
+
+        now = time.time()
+        if done or now - self.last_print >= PRINT_INTERVAL_SECONDS:
+            self.last_print = now
+            print(self.describe(event))
+
+    def describe(self, event):
+        name = f" {event['job']}" if event['job'] else ""
+        speed = f"{event['speed']:.2f}x" if event['speed'] is not None else "N/A"
+        if event['done']:
+            return f"  ✅ {event['stage']}{name}: 用时 {event['elapsed']:.1f}秒, {event['frame']} 帧, 速度 {speed}"
+        percent = f"{event['percent']:.0f}%" if event['percent'] is not None else _format_seconds(event['out_time'])
+        return (f"  ⏳ {event['stage']}{name}: {percent} | {event['fps']:.1f} fps | {speed} | "
+                f"剩余 {_format_seconds(event['eta'])}")
+
+
+def run(stream, stage="ffmpeg", duration=None, source=None, pass_fds=(), admit=True):
+    """
+    运行ffmpeg-python构建的输出流，并实时汇报进度（替代 stream.run(quiet=True)）
+
+    Args:
+        stream: ffmpeg.output(...)构建的输出流
+        stage: 阶段名称（用于日志和回调）
+        duration: 输出的预期时长（秒），用于计算百分比和剩余时间
+        source: duration未提供时，从该文件的ffprobe结果读取时长
+        pass_fds: 传给ffmpeg的文件描述符（pipe:N），ffmpeg启动后（或启动失败时）在本进程中关闭
+        admit: 是否在启动前等待内存占用回落（管道两端的进程由run_pipeline统一等待，不单独等待）
+    Returns:
+        tuple: (stdout, stderr)，与ffmpeg-python的run一致
+    Raises:
+        ffmpeg.Error: ffmpeg返回非0时抛出，stderr包含错误输出
+    """
+    if duration is None and source:
+        duration = media_duration(source)
+
+    global_args = ['-progress', 'pipe:1', '-nostats']
+    allocation = scheduler.current()
+    if allocation is not None:
+        filter_threads = str(allocation.filter_threads)
+        global_args += ['-filter_threads', filter_threads, '-filter_complex_threads', filter_threads]
+    state = _ProgressState(stage, duration, _current_scope())
+
+    try:
+        args = stream.global_args(*global_args).compile()
+        # 内存占用超过上限时等待其他ffmpeg进程结束
+        if admit:
+            scheduler.admit()
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   pass_fds=pass_fds)
+    finally:
+        # 管道的一端只由ffmpeg持有，对端进程退出时才能收到EOF/EPIPE
+        for fd in pass_fds:
+            os.close(fd)
+
+    # 单独线程读取stderr，避免管道写满阻塞ffmpeg
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+
+    def _drain_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line)
+
+    stderr_thread = threading.Thread(target=_drain_stderr, daemon=True)
+    stderr_thread.start()
+
+    try:
+        for raw_line in process.stdout:
+            line = raw_line.decode('utf-8', errors='replace').strip()
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            state.values[key] = value
+            # 每组进度以progress=continue/end结束
+            if key == 'progress' and value == 'continue':
+                state.report()
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.wait()
+        stderr_thread.join()
+
+    stderr = b''.join(stderr_tail)
+    if process.returncode != 0:
+        # 失败时输出ffmpeg最后几行错误信息，便于定位问题
+        error_lines = stderr.decode('utf-8', errors='replace').strip().splitlines()[-ERROR_PRINT_LINES:]
+        print(f"  ❌ {stage} 失败 (ffmpeg返回 {process.returncode}):")
+        for line in error_lines:
+            print(f"    {line}")
+        raise ffmpeg.Error('ffmpeg', b'', stderr)
+
+    state.report(done=True)
+    return b'', stderr
+
+
+def run_pipeline(producer, consumer, producer_stage, consumer_stage, duration=None):
+    """
+    用匿名管道连接两个ffmpeg进程并同时运行，中间结果不写入磁盘
+
+    Args:
+        producer: 构建上游输出流的函数 producer(fd)，输出写入 pipe:fd
+        consumer: 构建下游输出流的函数 consumer(fd)，从 pipe:fd 读取输入
+            （两个输出流都在启动进程之前构建，构建失败时关闭管道）
+        producer_stage, consumer_stage: 两个进程的阶段名称
+        duration: 预期时长（秒）
+    Returns:
+        tuple: 下游进程的 (stdout, stderr)
+    Raises:
+        ffmpeg.Error: 任一进程失败时抛出（下游成功而上游只是因为下游提前结束读取而断开管道时不算失败）
+    """
+    read_fd, write_fd = os.pipe()
+    try:
+        producer_stream = producer(write_fd)
+        consumer_stream = consumer(read_fd)
+    except BaseException:
+        os.close(read_fd)
+        os.close(write_fd)
+        raise
+    scope = _current_scope()
+    errors = []
+    # 启动任一进程之前为两个进程一起等待一次：上游在线程中单独等待时，已启动的下游在等上游的输入，
+    # 它的内存占用计入已用内存，上游可能一直等不到内存回落
+    try:
+        scheduler.admit()
+    except BaseException:
+        os.close(read_fd)
+        os.close(write_fd)
+        raise
+
+    def _produce():
+        # 上游只输出到控制台，批处理进度按下游汇报
+        _local.scope = dict(scope, batch=None)
+        try:
+            run(producer_stream, stage=producer_stage, duration=duration, pass_fds=(write_fd,), admit=False)
+        except BaseException as e:
+            errors.append(e)
+
+    producer_thread = threading.Thread(target=_produce, name="ffmpeg-pipe-producer", daemon=True)
+    producer_thread.start()
+    try:
+        result = run(consumer_stream, stage=consumer_stage, duration=duration, pass_fds=(read_fd,), admit=False)
+    finally:
+        producer_thread.join()
+
+    if errors:
+        error = errors[0]
+        if isinstance(error, ffmpeg.Error) and b'Broken pipe' in (error.stderr or b''):
+            print(f"  ℹ️ {consumer_stage} 已读取所需的全部画面，{producer_stage} 提前结束")
+        else:
+            raise error
+    return result
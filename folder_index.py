@@ -0,0 +1,119 @@
+"""
+输入文件夹索引
+用 os.scandir 一次扫描目录，扩展名不区分大小写，按目录修改时间增量刷新，
+所有节点共用（下拉框的子文件夹列表和每次运行的视频文件列表）
+"""
+
+import os
+import time
+import threading
+
+# 支持的视频格式（小写，匹配时不区分大小写）
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm')
+
+# 修改时间距扫描时刻太近时，同一时间粒度内可能还有变化（网络文件系统的mtime精度较粗），下次访问重新扫描
+MTIME_SETTLE_SECONDS = 2.0
+
+
+class _DirectorySnapshot:
+    """一次扫描得到的目录内容"""
+
+    def __init__(self, mtime_ns, subdirs, files, scanned_at):
+        self.mtime_ns = mtime_ns
+        self.subdirs = subdirs
+        self.files = files
+        self.scanned_at = scanned_at
+
+    def is_fresh(self, mtime_ns):
+        if mtime_ns != self.mtime_ns:
+            return False
+        return self.scanned_at - mtime_ns / 1e9 > MTIME_SETTLE_SECONDS
+
+
+class FolderIndex:
+    """
+    目录内容索引
+
+    目录的修改时间只在增删、重命名条目时变化，未变化时直接使用上次扫描的结果
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self.scans = 0
+
+    def _snapshot(self, path):
+        path = os.path.abspath(path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            snapshot = self._snapshots.get(path)
+        if snapshot is not None and snapshot.is_fresh(mtime_ns):
+            return snapshot
+
+        scanned_at = time.time()
+        subdirs = []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        files.append(entry.name)
+                except OSError:
+                    continue
+        snapshot = _DirectorySnapshot(mtime_ns, sorted(subdirs), sorted(files), scanned_at)
+        with self._lock:
+            self._snapshots[path] = snapshot
+            self.scans += 1
+        return snapshot
+
+    def subfolders(self, path):
+        """子文件夹名称列表（已排序）"""
+        return list(self._snapshot(path).subdirs)
+
+    def files(self, path, extensions=None):
+        """
+        文件路径列表（按文件名排序）
+
+        Args:
+            extensions: 扩展名元组（小写），None表示所有文件
+        """
+        names = self._snapshot(path).files
+        if extensions is not None:
+            names = [name for name in names if os.path.splitext(name)[1].lower() in extensions]
+        return [os.path.join(path, name) for name in names]
+
+    def video_files(self, path):
+        """视频文件路径列表（按文件名排序，扩展名不区分大小写）"""
+        return self.files(path, VIDEO_EXTENSIONS)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """获取共享的索引实例"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = FolderIndex()
+        return _index
+
+
+def list_input_folders(input_dir):
+    """
+    下拉框使用的文件夹列表："input"表示根目录，其余为子文件夹
+    """
+    try:
+        if not os.path.isdir(input_dir):
+            return ["input"]
+        return sorted(["input"] + get_index().subfolders(input_dir))
+    except Exception:
+        return ["input"]
+
+
+def list_videos(folder):
+    """文件夹中的视频文件（按文件名排序）"""
+    return get_index().video_files(folder)
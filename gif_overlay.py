@@ -0,0 +1,71 @@
+"""
+GIF叠加层预处理
+GIF按 (内容指纹, 目标尺寸) 只缩放渲染一次，保存为带透明通道的无损QuickTime RLE文件并缓存；
+合并时用 -stream_loop -1 循环读取，不再用loop滤镜把整段GIF的解码帧缓存在内存中，也不再为每个游戏视频重新缩放
+"""
+
+import os
+import threading
+
+import ffmpeg
+
+from . import disk_cache
+from . import ffmpeg_progress
+from . import media_cache
+from . import scratch
+
+OVERLAY_CACHE_NAME = "overlays"
+OVERLAY_CACHE_BYTES = 2 * 1024 ** 3
+# QuickTime RLE：无损、支持透明通道，对GIF这类色块画面压缩率高，解码开销很小
+OVERLAY_EXT = ".mov"
+OVERLAY_CODEC = 'qtrle'
+OVERLAY_PIX_FMT = 'argb'
+# 渲染方式变化时修改版本号，使旧的缓存条目失效
+OVERLAY_FORMAT_VERSION = 1
+
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+
+
+def _key_lock(key):
+    with _key_locks_guard:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def prepare(gif_path, gif_info, width, height):
+    """
+    获取缩放到 width×height 的循环叠加层，缓存中没有时先渲染
+
+    Args:
+        gif_path: GIF文件路径
+        gif_info: GIF的视频信息（duration用于进度）
+        width, height: 叠加层尺寸
+    Returns:
+        str: 叠加层文件路径；渲染失败时返回None（调用方回退到loop滤镜）
+    """
+    try:
+        cache = disk_cache.DiskCache(OVERLAY_CACHE_NAME, OVERLAY_CACHE_BYTES)
+        key = disk_cache.make_key('gif_overlay', OVERLAY_FORMAT_VERSION, media_cache.content_fingerprint(gif_path), width, height)
+        # 同一进程中的并发任务只渲染一次
+        with _key_lock(key):
+            cached_path = cache.lookup(key, OVERLAY_EXT)
+            if cached_path:
+                return cached_path
+
+            # 耗时由调用方记入 gif_overlay 阶段
+            print(f"  🎞️ 预渲染GIF叠加层: {os.path.basename(gif_path)} -> {width}x{height}")
+            with scratch.job_dir("gif_overlay") as temp_dir:
+                temp_path = os.path.join(temp_dir, f"overlay{OVERLAY_EXT}")
+                ffmpeg_progress.run(
+                    ffmpeg
+                    .input(gif_path)
+                    .video
+                    .filter('scale', width, height)
+                    .output(temp_path, vcodec=OVERLAY_CODEC, pix_fmt=OVERLAY_PIX_FMT)
+                    .overwrite_output(),
+                    stage="预渲染GIF", duration=gif_info.get('duration')
+                )
+                return cache.store(key, temp_path, OVERLAY_EXT)
+    except Exception as e:
+        print(f"  ⚠️ 预渲染GIF叠加层失败，改为直接循环GIF: {e}")
+        return None
@@ -0,0 +1,233 @@
+"""
+批量任务执行池
+把逐个文件执行的ffmpeg任务分发到线程池或进程池，单个任务出错不影响其他任务，结果保持输入顺序；
+任务可以从生成器中流式取出，探测、规划、编码等阶段之间用有界缓冲连接
+"""
+
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from . import ffmpeg_progress
+
+# 流水线相邻阶段之间的缓冲深度（上游最多提前这么多项）
+PIPELINE_DEPTH = 8
+# 探测阶段的并发线程数（ffprobe主要在等待读取文件头）
+PROBE_WORKERS = 4
+
+
+def job_name(item, index):
+    """任务在日志中的名称：文件路径取文件名，其他任务用序号"""
+    if isinstance(item, str):
+        return os.path.basename(item)
+    return f"任务{index + 1}"
+
+
+def _call_in_scope(func, item, index, progress):
+    try:
+        with ffmpeg_progress.job_scope(job_name(item, index), progress, index):
+            return item, func(item), None
+    except Exception as e:
+        return item, None, e
+
+
+def _notify(on_done, entry):
+    if on_done is None:
+        return
+    try:
+        on_done(*entry)
+    except Exception as e:
+        print(f"⚠️ 任务完成回调出错: {e}")
+
+
+def _call_and_notify(func, item, index, progress, on_done):
+    entry = _call_in_scope(func, item, index, progress)
+    _notify(on_done, entry)
+    return entry
+
+
+def _collect(entry, in_scope):
+    item, future, notified = entry
+    if in_scope:
+        return future.result()
+    try:
+        result = item, future.result(), None
+    except Exception as e:
+        result = item, None, e
+    # 完成回调在进程池的结果线程中执行，等它结束后再产出
+    if notified is not None:
+        notified.wait()
+    return result
+
+
+def iter_jobs(func, items, max_workers=1, progress=None, executor=None, lookahead=None, on_done=None):
+    """
+    流式执行任务
+
+    items可以是生成器，只在有空位时才取出下一项；结果按输入顺序逐个产出，
+    前面的任务完成后下游就可以开始处理，不需要等整批结束
+
+    Args:
+        func: 处理单个任务的函数 func(item)
+        items: 任务（列表或生成器）
+        max_workers: 最大并发数
+        progress: ffmpeg_progress.BatchProgress
+        executor: process_pool() 创建的进程池，为None时在线程中执行
+        lookahead: 已提交但还未被取走的任务数上限，默认为并发数的2倍
+        on_done: 每个任务结束时立即调用的回调 on_done(item, result, error)，早于按顺序产出；
+                 在执行任务的线程（进程池时为结果线程）中调用。按顺序产出可能要等前面的任务或下一个输入，
+                 共享队列的完成标记等不能等待的收尾要放在这里
+    Yields:
+        tuple: (item, result, error)，出错时result为None
+    """
+    if executor is None and max_workers <= 1:
+        for index, item in enumerate(items):
+            yield _call_and_notify(func, item, index, progress, on_done)
+        return
+
+    lookahead = max(lookahead or max_workers * 2, max_workers)
+    in_scope = executor is None
+    if in_scope:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    window = deque()
+    try:
+        for index, item in enumerate(items):
+            notified = None
+            if in_scope:
+                future = executor.submit(_call_and_notify, func, item, index, progress, on_done)
+            else:
+                # 子进程中的ffmpeg进度只输出到子进程控制台，批处理进度在每个任务结束时更新
+                future = executor.submit(func, item)
+                if progress is not None:
+                    future.add_done_callback(lambda _, index=index: progress.finish_job(index))
+                if on_done is not None:
+                    notified = threading.Event()
+
+                    def _done(done_future, item=item, notified=notified):
+                        try:
+                            # 下游提前停止时取消的任务没有执行，不回调
+                            if not done_future.cancelled():
+                                _notify(on_done, _collect((item, done_future, None), False))
+                        finally:
+                            notified.set()
+                    future.add_done_callback(_done)
+            window.append((item, future, notified))
+            while len(window) >= lookahead:
+                yield _collect(window.popleft(), in_scope)
+        while window:
+            yield _collect(window.popleft(), in_scope)
+    finally:
+        # 下游提前停止时取消还未开始的任务
+        for _, future, _ in window:
+            future.cancel()
+        if in_scope:
+            executor.shutdown(wait=True)
+
+
+def process_pool(max_workers):
+    """
+    创建fork上下文的进程池，并预先启动全部子进程
+
+    ComfyUI的自定义节点不在sys.path中，子进程只能通过fork继承已加载的模块；
+    fork时其他线程持有的锁在子进程中永远不会释放，所以要在启动流水线的后台线程之前fork
+    """
+    context = multiprocessing.get_context("fork")
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+    # 提交时没有空闲子进程就会新建，同时占住所有子进程即可全部启动
+    for future in [executor.submit(time.sleep, 0.05) for _ in range(max_workers)]:
+        future.result()
+    return executor
+
+
+_END = object()
+
+
+def prefetch(iterable, depth=PIPELINE_DEPTH):
+    """
+    在后台线程中运行上游阶段（通常是生成器），结果放入有界队列
+
+    上游最多提前depth项，下游取走后才继续；上游的异常在下游取到该位置时抛出
+    """
+    buffer = queue.Queue(maxsize=max(depth, 1))
+    stopped = threading.Event()
+
+    def _put(entry):
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        try:
+            for item in iterable:
+                if not _put((item, None)):
+                    return
+            _put((_END, None))
+        except BaseException as e:
+            _put((_END, e))
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=_produce, name="pipeline-prefetch", daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def probe_ahead(paths, probe, max_workers=PROBE_WORKERS):
+    """
+    探测阶段：在线程池中按顺序预先探测文件（结果进入探测缓存），按原顺序产出路径
+
+    探测失败的文件照常产出，由下游阶段处理和报告错误
+    """
+    for path, _, _ in iter_jobs(probe, paths, max_workers):
+        yield path
+
+
+def run_jobs(func, items, max_workers=1, progress=None):
+    """
+    并发执行任务
+
+    Args:
+        func: 处理单个任务的函数 func(item)
+        items: 任务列表
+        max_workers: 最大并发数
+        progress: ffmpeg_progress.BatchProgress，任务中的ffmpeg调用会汇报到该批处理进度
+    Returns:
+        list: 与items同序的 (item, result, error) 列表，出错时result为None
+    """
+    return list(iter_jobs(func, items, max_workers, progress))
+
+
+def run_process_jobs(func, items, max_workers=1, progress=None):
+    """
+    进程池版本的run_jobs
+
+    子进程中的ffmpeg进度只输出到子进程控制台，批处理进度在每个任务结束时更新
+
+    Args:
+        func: 模块级函数（需要能被子进程调用）
+        items: 任务列表，每项会被pickle后传给子进程
+        max_workers: 最大并发进程数
+        progress: ffmpeg_progress.BatchProgress
+    Returns:
+        list: 与items同序的 (item, result, error) 列表
+    """
+    with process_pool(max_workers) as executor:
+        return list(iter_jobs(func, items, max_workers, progress, executor=executor))
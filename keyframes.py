@@ -0,0 +1,51 @@
+"""
+关键帧查询
+通过ffprobe读取视频包的关键帧标记（只解复用不解码），用于流复制截取和按关键帧切分
+"""
+
+import subprocess
+
+
+def keyframe_times(video_path, start=None, end=None):
+    """
+    获取视频流的关键帧时间点
+
+    Args:
+        video_path: 视频文件路径
+        start: 查询起点（秒），None表示从头开始
+        end: 查询终点（秒），None表示到文件结束
+    Returns:
+        list: 升序排列的关键帧时间（秒）
+    """
+    args = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0']
+    if start is not None or end is not None:
+        interval_start = f'{start:.3f}' if start is not None else ''
+        interval_end = f'{end:.3f}' if end is not None else ''
+        args += ['-read_intervals', f'{interval_start}%{interval_end}']
+    args.append(video_path)
+
+    output = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    times = []
+    for line in output.decode('utf-8', errors='replace').splitlines():
+        parts = line.strip().split(',')
+        if len(parts) < 2 or 'K' not in parts[1]:
+            continue
+        try:
+            times.append(float(parts[0]))
+        except ValueError:
+            continue
+    return sorted(times)
+
+
+def next_keyframe(video_path, position, search_window=30.0):
+    """
+    查找位于 position 之后（含）的第一个关键帧
+
+    Returns:
+        float: 关键帧时间，窗口内没有关键帧时返回None
+    """
+    for t in keyframe_times(video_path, position, position + search_window):
+        if t >= position:
+            return t
+    return None
@@ -0,0 +1,169 @@
+"""
+输出清单
+每个输出文件夹记录 输入指纹 + 节点参数 + 编码配置 → 输出文件，
+重新运行时跳过已经是最新的输出；编码先写临时文件再原子重命名，中断的批处理可以续跑
+"""
+
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from . import media_cache
+
+MANIFEST_FILENAME = ".video_editing_manifest.json"
+MANIFEST_VERSION = 1
+# 输出时长比预期短超过该比例（且超过1秒）时视为不完整
+VERIFY_DURATION_TOLERANCE = 0.05
+
+
+def params_digest(params):
+    """节点参数和编码配置的摘要（参数需可JSON序列化）"""
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def input_fingerprints(paths):
+    """
+    输入文件指纹列表（文件名, 大小, 修改时间ns）
+
+    不使用绝对路径和inode：共享队列模式下其他主机以不同路径挂载同一存储，或重新挂载后，
+    已由其他实例完成的输出仍然判断为最新（与共享队列的任务标识一致）
+    """
+    fingerprints = []
+    for path in paths:
+        st = os.stat(path)
+        fingerprints.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+    return fingerprints
+
+
+def partial_path(output_file):
+    """编码过程中使用的临时文件名（保留扩展名，ffmpeg据此选择封装格式）"""
+    root, ext = os.path.splitext(output_file)
+    return f"{root}.partial{ext}"
+
+
+@contextmanager
+def atomic_output(output_file):
+    """
+    原子写出输出文件
+
+    在with块中向yield出的临时路径写入，成功后重命名为最终文件；
+    出错时删除临时文件，已有的旧输出保持不变
+    """
+    temp_file = partial_path(output_file)
+    try:
+        yield temp_file
+        os.replace(temp_file, output_file)
+    except BaseException:
+        try:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        except OSError:
+            pass
+        raise
+
+
+def verify_output(output_file, expected_duration=None):
+    """
+    校验阶段：输出文件非空、能探测到视频流，给出预期时长时检查时长是否足够
+
+    Returns:
+        str或None: 问题描述，校验通过时为None
+    """
+    try:
+        if os.path.getsize(output_file) <= 0:
+            return "输出文件为空"
+        # 输出只校验一次，不写入共享的probe缓存
+        probe = media_cache.probe(output_file, cached=False)
+    except Exception as e:
+        return f"无法探测输出文件: {e}"
+    if not media_cache.first_stream(probe, 'video'):
+        return "输出文件没有视频流"
+    if expected_duration:
+        duration = float(probe.get('format', {}).get('duration') or 0)
+        if duration < expected_duration - max(1.0, expected_duration * VERIFY_DURATION_TOLERANCE):
+            return f"输出时长 {duration:.2f}秒 短于预期 {expected_duration:.2f}秒"
+    return None
+
+
+class OutputManifest:
+    """
+    输出文件夹的清单文件
+    """
+
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                return data.get('outputs', {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ 读取输出清单失败，将重新生成: {e}")
+        return {}
+
+    def _save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'outputs': self._entries}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def is_up_to_date(self, output_file, inputs, params):
+        """
+        判断输出是否已经是最新
+
+        Args:
+            output_file: 输出文件路径
+            inputs: 影响该输出的输入文件路径列表
+            params: 节点参数和编码配置（dict）
+        """
+        entry = self._entries.get(os.path.basename(output_file))
+        if not entry or not os.path.exists(output_file):
+            return False
+        try:
+            if entry['params'] != params_digest(params):
+                return False
+            if entry['inputs'] != input_fingerprints(inputs):
+                return False
+            return entry['output_size'] == os.path.getsize(output_file)
+        except (OSError, KeyError):
+            return False
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程的清单文件锁（多个实例共用输出文件夹时，写回前合并其他实例记录的条目）"""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def record(self, output_file, inputs, params):
+        """记录一个已完成的输出并立即写回清单（每完成一个文件写一次，保证可续跑）"""
+        entry = {
+            'inputs': input_fingerprints(inputs),
+            'params': params_digest(params),
+            'output_size': os.path.getsize(output_file),
+        }
+        with self._lock, self._file_lock():
+            self._entries.update(self._load())
+            self._entries[os.path.basename(output_file)] = entry
+            self._save()
@@ -1,10 +1,28 @@
 import os
-import glob
-import tempfile
+import json
+import time
+import contextlib
 from pathlib import Path
 import ffmpeg
 import folder_paths
-import shutil
+
+from . import audio_detect
+from . import disk_cache
+from . import encoder_profiles
+from . import ffmpeg_progress
+from . import folder_index
+from . import gif_overlay
+from . import job_pool
+from . import keyframes
+from . import manifest
+from . import media_cache
+from . import merge_graph
+from . import merge_plan
+from . import scheduler
+from . import scratch
+from . import segment_encode
+from . import stage_timing
+from . import work_queue
 
 class VideoMergeNode:
     """
@@ -16,20 +34,7 @@ class VideoMergeNode:
     @classmethod
     def get_input_folders(cls):
         """获取输入目录下的所有子文件夹"""
-        try:
-            input_dir = folder_paths.get_input_directory()
-            if not os.path.exists(input_dir):
-                return ["input"]
-            
-            folders = ["input"]  # 默认包含根目录
-            for item in os.listdir(input_dir):
-                item_path = os.path.join(input_dir, item)
-                if os.path.isdir(item_path):
-                    folders.append(item)
-            
-            return sorted(folders)
-        except Exception:
-            return ["input"]
+        return folder_index.list_input_folders(folder_paths.get_input_directory())
     
     @classmethod
     def INPUT_TYPES(cls):
@@ -47,6 +52,18 @@ class VideoMergeNode:
                 "material_path": ("STRING", {"default": "", "multiline": False, "tooltip": "直接输入素材文件夹的完整路径，优先级高于下拉框选择"}),
                 "game_path": ("STRING", {"default": "", "multiline": False, "tooltip": "直接输入游戏文件夹的完整路径，优先级高于下拉框选择"}),
                 "gif_path": ("STRING", {"default": "", "multiline": False, "tooltip": "GIF动态图路径，如果存在则在素材和游戏视频结合处叠加显示"}),
+                "max_parallel_jobs": ("INT", {"default": 0, "min": 0, "max": 64, "tooltip": "并发处理的游戏视频数量，0表示根据CPU核心数、负载、分辨率和内存上限自动选择"}),
+                "memory_limit_gb": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 4096.0, "step": 0.5, "tooltip": "所有ffmpeg进程的内存上限（GB），超过时新的编码等待其他任务结束；0表示物理内存的75%"}),
+                "segment_count": segment_encode.segment_count_input_type(),
+                "audio_detect_mode": (["sampled", "full"], {"default": "sampled", "tooltip": "sampled: 只分析分布在文件中的若干短窗口判断是否有声音, full: 分析整条音轨"}),
+                "merge_engine": (["single_pass", "classic", "pipe"], {"default": "single_pass", "tooltip": "single_pass: 单个ffmpeg滤镜图一次编码完成合并, classic: 逐步缩放/拼接/截取后再合并, pipe: 素材轨道和最终合并两个ffmpeg进程通过管道同时运行，不写临时文件"}),
+                "skip_existing": ("BOOLEAN", {"default": True, "tooltip": "输入、参数和编码配置都未变化的输出直接跳过（根据输出文件夹中的清单判断）"}),
+                "material_cache_gb": ("FLOAT", {"default": 20.0, "min": 0.0, "max": 10000.0, "step": 1.0, "tooltip": "classic引擎缩放素材缓存的磁盘预算（GB），超出时淘汰最久未使用的文件，0表示不缓存"}),
+                "allow_stream_copy": ("BOOLEAN", {"default": True, "tooltip": "classic引擎中素材宽度、像素格式和编码已匹配时使用流复制（-c copy），截取按关键帧对齐"}),
+                **encoder_profiles.encoder_input_types(),
+                **work_queue.queue_input_types(),
+                **scratch.scratch_input_types(),
+                "dry_run": ("BOOLEAN", {"default": False, "tooltip": "只生成合并规划（素材分配、截取点、编码耗时和磁盘占用估算），以JSON返回并写入输出文件夹，不编码"}),
             }
         }
     
@@ -55,10 +72,21 @@ class VideoMergeNode:
     FUNCTION = "merge_videos"
     CATEGORY = "video_editing"
     
-    def get_video_info(self, video_path, threshold_db=-60.0):
-        """获取视频信息"""
+    # 音量检测模式：sampled只分析若干短窗口，full分析整条音轨
+    audio_detect_mode = "sampled"
+    
+    def get_video_info(self, video_path, threshold_db=-60.0, audio_detect_mode=None, cached=True):
+        """
+        获取视频信息
+
+        Args:
+            cached: False时不读写probe缓存（用于只存在于一次任务中的中间文件）
+        """
+        if audio_detect_mode is None:
+            audio_detect_mode = self.audio_detect_mode
         try:
-            probe = ffmpeg.probe(video_path)
+            with stage_timing.stage("probe"):
+                probe = media_cache.probe(video_path, cached)
             video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
             audio_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'audio'), None)
             
@@ -80,49 +108,17 @@ class VideoMergeNode:
             # 第二步：如果有音轨，检测音量
             has_audio = False
             if has_audio_track:
-                print(f"  第二步 - 音量检测:")
+                print(f"  第二步 - 音量检测 ({'采样' if audio_detect_mode == 'sampled' else '全量'}):")
                 try:
-                    # 使用ffmpeg-python分析音量
-                    input_stream = ffmpeg.input(video_path)
-                    audio_stream_test = input_stream.audio
-                    
-                    # 创建音量检测流
-                    volume_stream = audio_stream_test.filter('volumedetect')
-                    
-                    # 输出到null设备进行分析
-                    output_stream = ffmpeg.output(volume_stream, 'pipe:', format='null')
-                    
-                    # 运行分析
-                    process = ffmpeg.run(output_stream, capture_stdout=True, capture_stderr=True, quiet=True)
-                    
-                    # 解析stderr中的音量信息
-                    stderr_output = process[1].decode('utf-8') if process[1] else ''
-                    
-                    if 'mean_volume:' in stderr_output:
-                        # 提取音量信息
-                        lines = stderr_output.split('\n')
-                        for line in lines:
-                            if 'mean_volume:' in line:
-                                volume_str = line.split('mean_volume:')[1].strip()
-                                try:
-                                    volume_db = float(volume_str.split()[0])
-                                    print(f"    平均音量: {volume_db} dB")
-                                    
-                                    # 如果音量大于阈值，认为有声音
-                                    has_audio = volume_db > threshold_db
-                                    print(f"    音量判断: {'有声音' if has_audio else '静音'} (阈值: {threshold_db} dB)")
-                                    break
-                                except Exception as parse_e:
-                                    print(f"    音量解析失败: {parse_e}")
-                                    has_audio = True  # 解析失败时默认认为有声音
-                                    print(f"    音量判断: 有声音（解析失败）")
-                                    break
-                        else:
-                            has_audio = True
-                            print(f"    音量判断: 有声音（未找到音量信息）")
-                    else:
-                        has_audio = True
+                    with stage_timing.stage("audio_analysis"):
+                        has_audio, volume_db, analyzed = audio_detect.detect_audio(
+                            video_path, float(probe['format']['duration']), threshold_db, audio_detect_mode
+                        )
+                    if volume_db is None:
                         print(f"    音量判断: 有声音（无音量信息）")
+                    else:
+                        print(f"    平均音量: {volume_db} dB (分析窗口: {analyzed})")
+                        print(f"    音量判断: {'有声音' if has_audio else '静音'} (阈值: {threshold_db} dB)")
                         
                 except Exception as volume_e:
                     print(f"    音量检测异常: {volume_e}")
@@ -139,18 +135,122 @@ class VideoMergeNode:
                 'height': int(video_stream['height']),
                 'duration': float(probe['format']['duration']),
                 'fps': eval(video_stream['r_frame_rate']),
-                'has_audio': has_audio
+                'has_audio': has_audio,
+                'has_audio_track': has_audio_track
             }
         except Exception as e:
             print(f"获取视频信息失败 {video_path}: {str(e)}")
             return None
     
-    def resize_video_to_width(self, input_path, target_width, output_path):
-        """将视频缩放到指定宽度，保持宽高比"""
+    def lookup_video_info(self, video_path, media_ctx=None):
+        """通过运行上下文获取视频信息，没有上下文时直接分析"""
+        if media_ctx is not None:
+            return media_ctx.get(video_path)
+        return self.get_video_info(video_path)
+    
+    # 编码器与ffprobe中codec_name的对应关系，用于判断能否流复制
+    ENCODER_CODEC_NAMES = {'libx264': 'h264', 'libx265': 'hevc', 'libsvtav1': 'av1'}
+    
+    def get_stream_signature(self, video_path, cached=True):
+        """
+        获取流复制和无损拼接时必须一致的流参数（只用ffprobe，不做音量检测）
+
+        Args:
+            cached: False时不读写probe缓存（用于临时目录中的中间文件）
+        """
+        with stage_timing.stage("probe"):
+            probe = media_cache.probe(video_path, cached)
+        video_stream = media_cache.first_stream(probe, 'video')
+        audio_stream = media_cache.first_stream(probe, 'audio')
+        if not video_stream:
+            return None
+        return {
+            'width': int(video_stream['width']),
+            'height': int(video_stream['height']),
+            'codec_name': video_stream.get('codec_name'),
+            'profile': video_stream.get('profile'),
+            'pix_fmt': video_stream.get('pix_fmt'),
+            'time_base': video_stream.get('time_base'),
+            'r_frame_rate': video_stream.get('r_frame_rate'),
+            'audio': (
+                audio_stream.get('codec_name'),
+                audio_stream.get('sample_rate'),
+                audio_stream.get('channels'),
+                audio_stream.get('channel_layout'),
+            ) if audio_stream else None,
+        }
+    
+    # 流复制的片段拼接在一起时必须一致的时间参数和音频参数（不一致时拼接结果的时间戳错乱）
+    STREAM_TIMING_FIELDS = ('r_frame_rate', 'time_base', 'audio')
+
+    def can_stream_copy(self, signature, target_width, encoder=None, reference=None):
+        """
+        素材已经是目标宽度、像素格式和编码器时可以直接流复制
+
+        Args:
+            reference: 要拼接在一起的目标流参数（get_stream_signature的结果），
+                       提供时帧率、时间基和音频参数也必须一致
+        """
+        if not signature:
+            return False
+        if reference is not None and any(signature[field] != reference[field] for field in self.STREAM_TIMING_FIELDS):
+            return False
+        target_codec = self.ENCODER_CODEC_NAMES.get((encoder or encoder_profiles.default_encoder())['vcodec'])
+        return (
+            signature['width'] == target_width
+            and signature['height'] % 2 == 0
+            and signature['codec_name'] == target_codec
+            and signature['pix_fmt'] == 'yuv420p'
+        )
+    
+    def remux_video(self, input_path, output_path, duration=None, cached=True):
+        """
+        流复制（-c copy）到新文件
+        
+        Args:
+            duration: 需要截取的时长，截取点对齐到其后的第一个关键帧，保证GOP完整
+            cached: 输入是中间文件时为False，探测结果不写入probe缓存
+        """
+        signature = self.get_stream_signature(input_path, cached)
+        input_stream = ffmpeg.input(input_path)
+        streams = [input_stream.video]
+        if signature and signature['audio']:
+            streams.append(input_stream.audio)
+        
+        output_options = {'c': 'copy'}
+        if duration is not None:
+            cut_point = keyframes.next_keyframe(input_path, duration)
+            if cut_point is not None:
+                output_options['t'] = cut_point
+                print(f"  关键帧对齐截取: {duration:.2f}秒 -> {cut_point:.2f}秒")
+        
+        ffmpeg_progress.run(
+            ffmpeg
+            .output(*streams, output_path, **output_options)
+            .overwrite_output(),
+            stage="流复制", duration=duration, source=input_path
+        )
+    
+    def resize_video_to_width(self, input_path, target_width, output_path, media_ctx=None, encoder=None, allow_stream_copy=False, reference=None):
+        """
+        将视频缩放到指定宽度，保持宽高比
+
+        Args:
+            reference: 拼接目标的流参数，流复制时帧率、时间基和音频参数必须与之一致
+        """
         try:
-            video_info = self.get_video_info(input_path)
+            video_info = self.lookup_video_info(input_path, media_ctx)
             if not video_info:
                 return False
+            
+            # 已经是目标宽度和编码格式时直接流复制
+            if allow_stream_copy and self.can_stream_copy(self.get_stream_signature(input_path), target_width, encoder, reference):
+                try:
+                    print(f"流复制素材（尺寸和编码已匹配）: {os.path.basename(input_path)} -> {os.path.basename(output_path)}")
+                    self.remux_video(input_path, output_path)
+                    return True
+                except Exception as copy_e:
+                    print(f"  流复制失败，改为重新编码: {copy_e}")
                 
             original_width = video_info['width']
             original_height = video_info['height']
@@ -173,32 +273,29 @@ class VideoMergeNode:
             if video_info['has_audio']:
                 # 有音频的情况
                 print("  使用音频输出模式")
-                (
+                ffmpeg_progress.run(
                     ffmpeg
                     .output(
                         input_stream.video.filter('scale', target_width, new_height),
                         input_stream.audio,  # 保留音频
                         output_path, 
-                        vcodec='libx264', 
-                        acodec='aac', 
-                        preset='medium'
+                        **encoder_profiles.output_kwargs(encoder, with_audio=True)
                     )
-                    .overwrite_output()
-                    .run(quiet=False)  # 显示详细信息
+                    .overwrite_output(),
+                    stage="缩放素材", duration=video_info['duration']
                 )
             else:
                 # 没有音频的情况
                 print("  使用无音频输出模式")
-                (
+                ffmpeg_progress.run(
                     ffmpeg
                     .output(
                         input_stream.video.filter('scale', target_width, new_height),
                         output_path, 
-                        vcodec='libx264', 
-                        preset='medium'
+                        **encoder_profiles.output_kwargs(encoder, with_audio=False)
                     )
-                    .overwrite_output()
-                    .run(quiet=False)  # 显示详细信息
+                    .overwrite_output(),
+                    stage="缩放素材", duration=video_info['duration']
                 )
             
             return True
@@ -206,259 +303,121 @@ class VideoMergeNode:
             print(f"视频缩放失败 {input_path}: {str(e)}")
             return False
     
-    def merge_videos_vertically(self, material_path, game_path, output_path, position="up", audio_mode="game_only", material_audio_volume=0.5, game_audio_volume=0.5, gif_path=""):
-        """垂直合并视频"""
+    def merge_videos_vertically(self, material_path, game_path, output_path, position="up", audio_mode="game_only", material_audio_volume=0.5, game_audio_volume=0.5, gif_path="", media_ctx=None, encoder=None, segment_count=1):
+        """垂直合并视频（segment_count不为1时按游戏视频关键帧分段并行编码）"""
         try:
-            # 获取视频信息用于调试
-            material_info = self.get_video_info(material_path)
-            game_info = self.get_video_info(game_path)
+            # 获取视频信息（同时用于调试输出和混音判断）
+            # 素材是classic引擎在临时目录中生成的中间文件，直接探测，不写入probe缓存和运行上下文
+            material_info = self.get_video_info(material_path, cached=False)
+            game_info = self.lookup_video_info(game_path, media_ctx)
             
             print(f"垂直合并视频:")
             print(f"  素材: {os.path.basename(material_path)} (有音频: {material_info['has_audio'] if material_info else '未知'})")
             print(f"  游戏: {os.path.basename(game_path)} (有音频: {game_info['has_audio'] if game_info else '未知'})")
             print(f"  位置: {position}, 音频模式: {audio_mode}")
             
-            # 根据位置确定视频顺序并合并
-            if position == "up":
-                # 素材在上，游戏在下
-                material_input = ffmpeg.input(material_path)
-                game_input = ffmpeg.input(game_path)
-                
-                # 使用vstack filter合并视频
-                video_output = ffmpeg.filter([material_input.video, game_input.video], 'vstack', inputs=2)
-                
-                # 检查是否需要叠加GIF
-                if gif_path and gif_path.strip() and os.path.exists(gif_path.strip()):
-                    print(f"  检测到GIF文件: {os.path.basename(gif_path)}")
-                    
-                    # 获取GIF信息
-                    gif_info = self.get_video_info(gif_path.strip())
-                    if not gif_info:
-                        print(f"  警告: 无法获取GIF信息，跳过GIF叠加")
-                    else:
-                        # 获取合并后视频的尺寸和时长
-                        material_height = material_info['height']
-                        game_height = game_info['height']
-                        video_width = material_info['width']  # 两个视频宽度相同
-                        total_height = material_height + game_height
-                        
-                        # 计算合并后视频的总时长（使用游戏视频时长）
-                        material_duration = material_info['duration']
-                        game_duration = game_info['duration']
-                        total_duration = game_duration  # 使用游戏视频时长作为目标时长
-                        
-                        print(f"  游戏视频时长: {game_duration:.2f}秒")
-                        print(f"  素材视频时长: {material_duration:.2f}秒")
-                        print(f"  目标合并时长: {total_duration:.2f}秒")
-                        print(f"  GIF原始时长: {gif_info['duration']:.2f}秒")
-                        
-                        # 计算GIF缩放后的高度（等比缩放）
-                        gif_original_width = gif_info['width']
-                        gif_original_height = gif_info['height']
-                        gif_new_height = int((video_width * gif_original_height) / gif_original_width)
-                        
-                        # 确保高度是偶数（视频编码要求）
-                        if gif_new_height % 2 != 0:
-                            gif_new_height += 1
-                        
-                        print(f"  GIF原始尺寸: {gif_original_width}x{gif_original_height}")
-                        print(f"  GIF缩放尺寸: {video_width}x{gif_new_height}")
-                        
-                        # 创建GIF输入
-                        gif_input = ffmpeg.input(gif_path.strip())
-                        
-                        # 使用loop filter实现真正的循环播放
-                        gif_looped = gif_input.video.filter('loop', loop=-1, size=32767, start=0)
-                        
-                        # 缩放GIF到与游戏视频相同的宽度
-                        gif_scaled = gif_looped.filter('scale', video_width, gif_new_height)
-                        
-                        # 计算GIF位置：在结合处居中显示
-                        # GIF的中心位置应该在结合处（material_height位置）
-                        gif_center_y = material_height
-                        
-                        # 叠加缩放后的GIF到视频上，使用shortest=1确保输出时长由游戏视频决定
-                        video_output = ffmpeg.filter([video_output, gif_scaled], 'overlay', 
-                                                   x='(W-w)/2',  # 水平居中
-                                                   y=f'{gif_center_y}-h/2',  # 垂直居中在结合处
-                                                   shortest=1)  # 输出时长由最短的输入决定（游戏视频）
-                        print(f"  GIF循环播放设置: 使用loop filter实现无限循环，输出时长由游戏视频决定")
-                        print(f"  GIF叠加位置: 水平居中，垂直位置在结合处 (y={gif_center_y})")
+            # 关键帧对齐截取的素材可能略长于游戏视频，读取时限制到游戏视频时长
+            material_limit = {'t': game_info['duration']} if game_info else {}
+            material_input = ffmpeg.input(material_path, **material_limit)
+            game_input = ffmpeg.input(game_path)
+            
+            # 检查是否需要叠加GIF
+            gif_info = None
+            if gif_path and gif_path.strip() and os.path.exists(gif_path.strip()):
+                print(f"  检测到GIF文件: {os.path.basename(gif_path)}")
                 
-                # 根据音频模式处理音频
-                if audio_mode == "mix":
-                    # 混音模式：先检查音频状态
-                    print(f"  混音模式 - 素材音量: {material_audio_volume}, 游戏音量: {game_audio_volume}")
-                    
-                    # 检查素材和游戏视频的音频状态
-                    material_info = self.get_video_info(material_path)
-                    game_info = self.get_video_info(game_path)
-                    
-                    if not material_info or not game_info:
-                        print("  无法获取视频信息，使用游戏音频")
-                        audio_output = game_input.audio
-                    elif not material_info['has_audio'] and not game_info['has_audio']:
-                        # 两个视频都没有音频
-                        print("  错误：素材视频和游戏视频都没有音频，无法进行混音处理")
-                        raise ValueError("素材视频和游戏视频都没有音频，无法进行混音处理")
-                    elif not material_info['has_audio']:
-                        # 只有游戏视频有音频
-                        print("  素材视频没有音频，使用游戏音频")
-                        audio_output = game_input.audio
-                    elif not game_info['has_audio']:
-                        # 只有素材视频有音频
-                        print("  游戏视频没有音频，使用素材音频")
-                        audio_output = material_input.audio
-                    else:
-                        # 两个视频都有音频，进行混音
-                        print("  两个视频都有音频，进行混音处理")
-                        # 对素材音频应用音量调整
-                        material_audio_adjusted = material_input.audio.filter('volume', material_audio_volume)
-                        # 对游戏音频应用音量调整
-                        game_audio_adjusted = game_input.audio.filter('volume', game_audio_volume)
-                        
-                        # 使用amix filter混合音频
-                        audio_output = ffmpeg.filter([material_audio_adjusted, game_audio_adjusted], 'amix', inputs=2, duration='longest')
-                        print("  混音模式：成功创建混音")
+                # 获取GIF信息
+                gif_info = self.lookup_video_info(gif_path.strip(), media_ctx)
+                if not gif_info:
+                    print(f"  警告: 无法获取GIF信息，跳过GIF叠加")
                 else:
-                    # 只使用游戏音频
-                    print("  使用游戏音频")
-                    audio_output = game_input.audio
-                
-                # 输出合并后的视频
-                (
-                    ffmpeg
-                    .output(
-                        video_output,
-                        audio_output,
-                        output_path,
-                        vcodec='libx264',
-                        acodec='aac',
-                        audio_bitrate='128k',
-                        preset='medium'
+                    print(f"  游戏视频时长: {game_info['duration']:.2f}秒")
+                    print(f"  素材视频时长: {material_info['duration']:.2f}秒")
+            
+            def build_video(material_stream, game_stream, start_time=0.0):
+                # 根据位置确定视频顺序，使用vstack filter合并视频
+                if position == "up":
+                    # 素材在上，游戏在下
+                    video_output = ffmpeg.filter([material_stream, game_stream], 'vstack', inputs=2)
+                    upper_info = material_info
+                else:
+                    # 游戏在上，素材在下
+                    video_output = ffmpeg.filter([game_stream, material_stream], 'vstack', inputs=2)
+                    upper_info = game_info
+                if gif_info:
+                    # GIF的中心位置应该在结合处（上方视频的底边）
+                    video_output = merge_graph.build_gif_overlay(
+                        video_output, gif_path.strip(), gif_info,
+                        upper_info['width'], upper_info['height'], start_time
                     )
-                    .overwrite_output()
-                    .run(quiet=False)  # 显示详细错误信息
-                )
-            else:
-                # 游戏在上，素材在下
-                game_input = ffmpeg.input(game_path)
-                material_input = ffmpeg.input(material_path)
-                
-                # 使用vstack filter合并视频
-                video_output = ffmpeg.filter([game_input.video, material_input.video], 'vstack', inputs=2)
-                
-                # 检查是否需要叠加GIF
-                if gif_path and gif_path.strip() and os.path.exists(gif_path.strip()):
-                    print(f"  检测到GIF文件: {os.path.basename(gif_path)}")
-                    
-                    # 获取GIF信息
-                    gif_info = self.get_video_info(gif_path.strip())
-                    if not gif_info:
-                        print(f"  警告: 无法获取GIF信息，跳过GIF叠加")
-                    else:
-                        # 获取合并后视频的尺寸和时长
-                        material_height = material_info['height']
-                        game_height = game_info['height']
-                        video_width = game_info['width']  # 两个视频宽度相同
-                        
-                        # 计算合并后视频的总时长（使用游戏视频时长）
-                        material_duration = material_info['duration']
-                        game_duration = game_info['duration']
-                        total_duration = game_duration  # 使用游戏视频时长作为目标时长
-                        
-                        print(f"  游戏视频时长: {game_duration:.2f}秒")
-                        print(f"  素材视频时长: {material_duration:.2f}秒")
-                        print(f"  目标合并时长: {total_duration:.2f}秒")
-                        print(f"  GIF原始时长: {gif_info['duration']:.2f}秒")
-                        
-                        # 计算GIF缩放后的高度（等比缩放）
-                        gif_original_width = gif_info['width']
-                        gif_original_height = gif_info['height']
-                        gif_new_height = int((video_width * gif_original_height) / gif_original_width)
-                        
-                        # 确保高度是偶数（视频编码要求）
-                        if gif_new_height % 2 != 0:
-                            gif_new_height += 1
-                        
-                        print(f"  GIF原始尺寸: {gif_original_width}x{gif_original_height}")
-                        print(f"  GIF缩放尺寸: {video_width}x{gif_new_height}")
-                        
-                        # 创建GIF输入
-                        gif_input = ffmpeg.input(gif_path.strip())
-                        
-                        # 使用loop filter实现真正的循环播放
-                        gif_looped = gif_input.video.filter('loop', loop=-1, size=32767, start=0)
-                        
-                        # 缩放GIF到与游戏视频相同的宽度
-                        gif_scaled = gif_looped.filter('scale', video_width, gif_new_height)
-                        
-                        # 计算GIF位置：在结合处居中显示
-                        # GIF的中心位置应该在结合处（game_height位置）
-                        gif_center_y = game_height
-                        
-                        # 叠加缩放后的GIF到视频上，使用shortest=1确保输出时长由游戏视频决定
-                        video_output = ffmpeg.filter([video_output, gif_scaled], 'overlay', 
-                                                   x='(W-w)/2',  # 水平居中
-                                                   y=f'{gif_center_y}-h/2',  # 垂直居中在结合处
-                                                   shortest=1)  # 输出时长由最短的输入决定（游戏视频）
-                        print(f"  GIF循环播放设置: 使用loop filter实现无限循环，输出时长由游戏视频决定")
-                        print(f"  GIF叠加位置: 水平居中，垂直位置在结合处 (y={gif_center_y})")
+                return video_output
+            
+            # 根据音频模式处理音频
+            if audio_mode == "mix":
+                # 混音模式：先检查音频状态
+                print(f"  混音模式 - 素材音量: {material_audio_volume}, 游戏音量: {game_audio_volume}")
                 
-                # 根据音频模式处理音频
-                if audio_mode == "mix":
-                    # 混音模式：先检查音频状态
-                    print(f"  混音模式 - 素材音量: {material_audio_volume}, 游戏音量: {game_audio_volume}")
-                    
-                    # 检查素材和游戏视频的音频状态
-                    material_info = self.get_video_info(material_path)
-                    game_info = self.get_video_info(game_path)
-                    
-                    if not material_info or not game_info:
-                        print("  无法获取视频信息，使用游戏音频")
-                        audio_output = game_input.audio
-                    elif not material_info['has_audio'] and not game_info['has_audio']:
-                        # 两个视频都没有音频
-                        print("  错误：素材视频和游戏视频都没有音频，无法进行混音处理")
-                        raise ValueError("素材视频和游戏视频都没有音频，无法进行混音处理")
-                    elif not material_info['has_audio']:
-                        # 只有游戏视频有音频
-                        print("  素材视频没有音频，使用游戏音频")
-                        audio_output = game_input.audio
-                    elif not game_info['has_audio']:
-                        # 只有素材视频有音频
-                        print("  游戏视频没有音频，使用素材音频")
-                        audio_output = material_input.audio
-                    else:
-                        # 两个视频都有音频，进行混音
-                        print("  两个视频都有音频，进行混音处理")
-                        # 对素材音频应用音量调整
-                        material_audio_adjusted = material_input.audio.filter('volume', material_audio_volume)
-                        # 对游戏音频应用音量调整
-                        game_audio_adjusted = game_input.audio.filter('volume', game_audio_volume)
-                        
-                        # 使用amix filter混合音频
-                        audio_output = ffmpeg.filter([material_audio_adjusted, game_audio_adjusted], 'amix', inputs=2, duration='longest')
-                        print("  混音模式：成功创建混音")
-                else:
-                    # 只使用游戏音频
-                    print("  使用游戏音频")
+                # 检查素材和游戏视频的音频状态（复用上面获取的信息）
+                if not material_info or not game_info:
+                    print("  无法获取视频信息，使用游戏音频")
                     audio_output = game_input.audio
-                
+                elif not material_info['has_audio'] and not game_info['has_audio']:
+                    # 两个视频都没有音频
+                    print("  错误：素材视频和游戏视频都没有音频，无法进行混音处理")
+                    raise ValueError("素材视频和游戏视频都没有音频，无法进行混音处理")
+                elif not material_info['has_audio']:
+                    # 只有游戏视频有音频
+                    print("  素材视频没有音频，使用游戏音频")
+                    audio_output = game_input.audio
+                elif not game_info['has_audio']:
+                    # 只有素材视频有音频
+                    print("  游戏视频没有音频，使用素材音频")
+                    audio_output = material_input.audio
+                else:
+                    # 两个视频都有音频，进行混音
+                    print("  两个视频都有音频，进行混音处理")
+                    # 对素材音频应用音量调整
+                    material_audio_adjusted = material_input.audio.filter('volume', material_audio_volume)
+                    # 对游戏音频应用音量调整
+                    game_audio_adjusted = game_input.audio.filter('volume', game_audio_volume)
+                    
+                    # 使用amix filter混合音频
+                    audio_output = ffmpeg.filter([material_audio_adjusted, game_audio_adjusted], 'amix', inputs=2, duration='longest')
+                    print("  混音模式：成功创建混音")
+            else:
+                # 只使用游戏音频
+                print("  使用游戏音频")
+                audio_output = game_input.audio
+            
+            ranges = []
+            if game_info and material_info and segment_count != 1:
+                ranges = segment_encode.plan_ranges(
+                    game_path, game_info['duration'], segment_count, game_info['width'],
+                    game_info['height'] + material_info['height']
+                )
+            
+            if len(ranges) > 1:
+                # 分段并行编码：每段画面中素材和游戏视频都定位到段起点，音频对整条时间轴编码一次
+                segment_encode.encode_segmented(
+                    lambda start, length: build_video(
+                        ffmpeg.input(material_path, ss=start, t=length).video,
+                        ffmpeg.input(game_path, ss=start, t=length).video,
+                        start
+                    ),
+                    ranges, output_path, encoder, audio_output, stage="最终合并"
+                )
+            else:
                 # 输出合并后的视频
-                (
+                ffmpeg_progress.run(
                     ffmpeg
                     .output(
-                        video_output,
+                        build_video(material_input.video, game_input.video),
                         audio_output,
                         output_path,
-                        vcodec='libx264',
-                        acodec='aac',
-                        audio_bitrate='128k',
-                        preset='medium'
+                        **encoder_profiles.output_kwargs(encoder, with_audio=True)
                     )
-                    .overwrite_output()
-                    .run(quiet=False)  # 显示详细错误信息
+                    .overwrite_output(),
+                    stage="最终合并", duration=game_info['duration'] if game_info else None
                 )
             
             return True
@@ -467,7 +426,448 @@ class VideoMergeNode:
             print(f"视频合并失败: {str(e)}")
             return False
     
-    def merge_videos(self, material_folder, game_folder, position, audio_mode, material_audio_volume, game_audio_volume, output_folder_name, material_path="", game_path="", gif_path=""):
+    def iter_merge_jobs(self, game_videos, material_videos, audio_mode, media_ctx=None, probe_workers=1):
+        """
+        规划阶段（流式）：按顺序为每个游戏视频分配素材，每规划好一个任务就立即产出
+
+        游戏视频和素材在线程池中按顺序预先探测，规划只等待当前需要的那一个文件
+
+        Yields:
+            dict: 任务，包含 game_video, game_info, used_materials, timer（规划阶段的计时）
+        """
+        def timed_lookup(video_path):
+            # 探测线程中的耗时记录到单独的计时器，规划时并入所属游戏视频的计时
+            probe_timer = stage_timing.StageTimer()
+            with stage_timing.use_timer(probe_timer), probe_timer.measure_wall():
+                return self.lookup_video_info(video_path, media_ctx), probe_timer
+
+        games = job_pool.iter_jobs(timed_lookup, game_videos, probe_workers)
+        materials = job_pool.iter_jobs(timed_lookup, material_videos, probe_workers)
+        materials_exhausted = False
+        try:
+            for game_video, game_result, game_error in games:
+                try:
+                    # 规划阶段的探测和音量分析计入该游戏视频的计时
+                    timer = stage_timing.StageTimer()
+
+                    # 获取游戏视频信息
+                    if game_error is not None:
+                        raise game_error
+                    game_info, probe_timer = game_result
+                    timer.merge(probe_timer)
+                    if not game_info:
+                        continue
+
+                    # 检查游戏视频音频情况
+                    game_filename = Path(game_video).stem
+                    if audio_mode == "mix" and not game_info['has_audio']:
+                        print(f"警告: 游戏视频 {game_filename} 没有音频，在mix模式下可能影响混音效果")
+
+                    game_duration = game_info['duration']
+                    used_materials = []
+                    current_duration = 0
+
+                    # 为当前游戏视频收集足够的素材
+                    while current_duration < game_duration:
+                        entry = next(materials, None)
+                        if entry is None:
+                            materials_exhausted = True  # 素材用完则结束
+                            break
+                        material_video, material_result, material_error = entry
+                        if material_error is not None:
+                            print(f"获取素材视频 {material_video} 信息时出错: {str(material_error)}")
+                            continue
+                        material_info, probe_timer = material_result
+                        timer.merge(probe_timer)
+
+                        if not material_info:
+                            continue
+
+                        # 检查素材视频音频情况
+                        material_filename = Path(material_video).stem
+                        if audio_mode == "mix" and not material_info['has_audio']:
+                            print(f"警告: 素材视频 {material_filename} 没有音频，在mix模式下可能影响混音效果")
+
+                        used_materials.append({
+                            'path': material_video,
+                            'duration': material_info['duration'],
+                            'info': material_info
+                        })
+
+                        current_duration += material_info['duration']
+
+                    if used_materials:
+                        yield {
+                            'game_video': game_video,
+                            'game_info': game_info,
+                            'used_materials': used_materials,
+                            'timer': timer
+                        }
+
+                except Exception as e:
+                    print(f"规划游戏视频 {game_video} 时出错: {str(e)}")
+
+                if materials_exhausted:
+                    break
+        finally:
+            games.close()
+            materials.close()
+
+    def plan_merge_jobs(self, game_videos, material_videos, audio_mode, media_ctx=None):
+        """
+        规划阶段：按顺序为每个游戏视频分配素材
+
+        Returns:
+            list: 任务列表，每项包含 game_video, game_info, used_materials, timer（规划阶段的计时）
+        """
+        return list(self.iter_merge_jobs(game_videos, material_videos, audio_mode, media_ctx))
+
+    def render_merge_job(self, job, output_path, position, audio_mode, material_audio_volume, game_audio_volume, gif_path="", merge_engine="single_pass", audio_detect_mode="sampled", media_ctx=None, encoder=None, material_cache_gb=0, segment_count=1):
+        """
+        执行阶段：为单个游戏视频执行缩放/拼接/截取/垂直合并
+
+        Args:
+            media_ctx: 运行上下文，为None时（例如在子进程中）用任务里已分析的信息新建
+            material_cache_gb: 缩放素材缓存的磁盘预算（GB），0表示不缓存
+            segment_count: 单个游戏视频的分段并行编码段数，1表示不分段
+
+        Returns:
+            tuple: (输出文件路径或None, 各阶段计时)
+        """
+        self.audio_detect_mode = audio_detect_mode
+        game_video = job['game_video']
+        used_materials = job['used_materials']
+
+        own_ctx = media_ctx is None
+        if own_ctx:
+            media_ctx = media_cache.MediaInfoContext(self.get_video_info)
+            media_ctx.seed(game_video, job['game_info'])
+            for material in used_materials:
+                media_ctx.seed(material['path'], material['info'])
+
+        # 先写入临时文件，成功后原子重命名，中断时不会留下不完整的输出
+        output_file = job.get('output_file') or self.get_output_file(output_path, game_video)
+        temp_output = manifest.partial_path(output_file)
+        timer = job.get('timer') or stage_timing.StageTimer()
+        try:
+            # 任务中各阶段的ffmpeg进度按游戏视频名汇报，耗时记录到任务的计时器
+            with ffmpeg_progress.job_scope(os.path.basename(game_video)), stage_timing.use_timer(timer), timer.measure_wall():
+                merged = self._render_merge_job(job, temp_output, position, audio_mode, material_audio_volume,
+                                                game_audio_volume, gif_path, merge_engine, media_ctx, encoder, material_cache_gb, segment_count)
+            if not merged:
+                return None, timer.to_dict()
+            os.replace(temp_output, output_file)
+            print(f"成功合并: {Path(game_video).stem} -> {output_file}")
+            return output_file, timer.to_dict()
+        finally:
+            if os.path.exists(temp_output):
+                try:
+                    os.remove(temp_output)
+                except OSError:
+                    pass
+            if own_ctx:
+                print(f"  {Path(game_video).stem} {media_ctx.summary()}")
+
+    def get_output_file(self, output_path, game_video):
+        """游戏视频对应的合并输出文件路径"""
+        return os.path.join(output_path, f"{Path(game_video).stem}_merged.mp4")
+
+    def _render_merge_job(self, job, output_file, position, audio_mode, material_audio_volume, game_audio_volume, gif_path, merge_engine, media_ctx, encoder, material_cache_gb=0, segment_count=1):
+        """
+        render_merge_job的具体实现
+
+        Returns:
+            bool: 是否成功写出output_file
+        """
+        game_video = job['game_video']
+        used_materials = job['used_materials']
+        game_filename = Path(game_video).stem
+        
+        # 获取游戏视频信息（宽度等）
+        game_info = self.lookup_video_info(game_video, media_ctx)
+        
+        # 在mix模式下进行最终的音频检查
+        if audio_mode == "mix":
+            # 检查所有使用的素材是否有音频
+            materials_with_audio = [m for m in used_materials if m['info']['has_audio']]
+            materials_without_audio = [m for m in used_materials if not m['info']['has_audio']]
+            
+            if not game_info['has_audio'] and not materials_with_audio:
+                print(f"错误: 游戏视频 {game_filename} 和所有素材视频都没有音频，无法进行混音处理")
+                return None
+            elif not game_info['has_audio']:
+                print(f"警告: 游戏视频 {game_filename} 没有音频，将只使用素材音频")
+            elif not materials_with_audio:
+                print(f"警告: 所有素材视频都没有音频，将只使用游戏音频")
+            elif materials_without_audio:
+                print(f"警告: {len(materials_without_audio)} 个素材视频没有音频，可能影响混音效果")
+        
+        # 管道需要向ffmpeg传递文件描述符（仅POSIX），其他平台改用单次滤镜图
+        if merge_engine == "pipe" and os.name != "posix":
+            print(f"  当前平台不支持管道引擎，改用single_pass")
+            merge_engine = "single_pass"
+        
+        # 素材不足时所有引擎都跳过（single_pass和pipe的vstack在素材轨道结束后会一直重复最后一帧），
+        # 与dry_run规划中的判断相同
+        if merge_plan.material_shortfall(job) > 0:
+            material_seconds = sum(m['duration'] for m in used_materials)
+            print(f"  警告: 素材总时长 ({material_seconds:.2f}秒) 不足以支持游戏视频时长 ({job['game_info']['duration']:.2f}秒)，跳过游戏视频: {game_filename}")
+            return None
+        
+        # 单次滤镜图引擎：一次编码直接写出最终文件；管道引擎：素材轨道通过管道直接送入最终合并
+        if merge_engine in ("single_pass", "pipe"):
+            gif_info = None
+            if gif_path and gif_path.strip() and os.path.exists(gif_path.strip()):
+                gif_info = self.lookup_video_info(gif_path.strip(), media_ctx)
+                if not gif_info:
+                    print(f"  警告: 无法获取GIF信息，跳过GIF叠加")
+            try:
+                with stage_timing.stage("final_merge"):
+                    if merge_engine == "pipe":
+                        merge_graph.render_piped(
+                            used_materials, game_video, game_info, output_file, position, audio_mode,
+                            material_audio_volume, game_audio_volume, gif_path.strip(), gif_info, encoder
+                        )
+                    else:
+                        merge_graph.render_single_pass(
+                            used_materials, game_video, game_info, output_file, position, audio_mode,
+                            material_audio_volume, game_audio_volume, gif_path.strip(), gif_info, encoder,
+                            segment_count
+                        )
+            except Exception as e:
+                print(f"视频合并失败: {str(e)}")
+                return False
+            return True
+        
+        # 规划阶段允许时，参数一致的步骤使用流复制代替重新编码
+        allow_stream_copy = job.get('allow_stream_copy', False)
+        
+        # 中间文件写在受预算管理的临时目录中，任何返回路径和异常都会清理；
+        # 任务用到的缓存素材在任务结束前保持固定，不会被其他任务的淘汰删除
+        temp_bytes = merge_plan.estimate_job(job, encoder or encoder_profiles.default_encoder(), "classic", allow_stream_copy)['temp_bytes']
+        with scratch.job_dir(f"merge_{game_filename}", temp_bytes) as temp_dir, contextlib.ExitStack() as cache_pins:
+            return self._render_classic(job, temp_dir, output_file, game_info, position, audio_mode, material_audio_volume,
+                                        game_audio_volume, gif_path, media_ctx, encoder, material_cache_gb, segment_count, cache_pins)
+    
+    def _render_classic(self, job, temp_dir, output_file, game_info, position, audio_mode, material_audio_volume, game_audio_volume, gif_path, media_ctx, encoder, material_cache_gb=0, segment_count=1, cache_pins=None):
+        """
+        classic引擎：逐步缩放/拼接/截取素材后再垂直合并，中间文件写在temp_dir中（由调用方清理）
+
+        Args:
+            cache_pins: 任务范围的ExitStack，使用的缓存素材在其退出前保持固定
+
+        Returns:
+            bool: 是否成功写出output_file
+        """
+        game_video = job['game_video']
+        game_duration = job['game_info']['duration']
+        used_materials = job['used_materials']
+        game_filename = Path(game_video).stem
+        game_width = game_info['width']
+        allow_stream_copy = job.get('allow_stream_copy', False)
+        
+        # 创建临时合并的素材视频
+        temp_material_path = os.path.join(temp_dir, f"temp_material_{game_filename}.mp4")
+        
+        # 如果只有一个素材且长度足够，直接使用
+        single_material_copied = False
+        if (allow_stream_copy and len(used_materials) == 1 and used_materials[0]['duration'] >= game_duration
+                and self.can_stream_copy(self.get_stream_signature(used_materials[0]['path']), game_width, encoder)):
+            try:
+                print(f"  素材尺寸和编码已匹配，流复制截取: {os.path.basename(used_materials[0]['path'])}")
+                with stage_timing.stage("trim"):
+                    self.remux_video(used_materials[0]['path'], temp_material_path, game_duration)
+                single_material_copied = True
+            except Exception as copy_e:
+                print(f"  流复制失败，改为重新编码: {copy_e}")
+        
+        if single_material_copied:
+            pass
+        elif len(used_materials) == 1 and used_materials[0]['duration'] >= game_duration:
+            # 先将素材宽度对齐到游戏宽度，然后截取到游戏长度，兼容音频情况
+            input_stream = ffmpeg.input(used_materials[0]['path'], t=game_duration)
+            material_info = used_materials[0]['info']
+            
+            with stage_timing.stage("resize"):
+                if material_info['has_audio']:
+                    # 有音频的情况
+                    ffmpeg_progress.run(
+                        ffmpeg
+                        .output(
+                            input_stream.video.filter('scale', game_width, -1),  # 宽度对齐，高度自动计算
+                            input_stream.audio,  # 保留音频
+                            temp_material_path, 
+                            **encoder_profiles.output_kwargs(encoder, with_audio=True)
+                        )
+                        .overwrite_output(),
+                        stage="缩放截取素材", duration=game_duration
+                    )
+                else:
+                    # 没有音频的情况
+                    ffmpeg_progress.run(
+                        ffmpeg
+                        .output(
+                            input_stream.video.filter('scale', game_width, -1),  # 宽度对齐，高度自动计算
+                            temp_material_path, 
+                            **encoder_profiles.output_kwargs(encoder, with_audio=False)
+                        )
+                        .overwrite_output(),
+                        stage="缩放截取素材", duration=game_duration
+                    )
+        else:
+            # 多个素材需要拼接
+            # 先将每个素材宽度对齐到游戏宽度
+            # 已缩放过的素材从内容寻址缓存中直接取用（按素材内容、目标宽度和编码配置）
+            material_cache = disk_cache.DiskCache("materials", int(material_cache_gb * 1024 ** 3))
+            resized_materials = []
+            # 流复制的素材要与轨道中的第一个素材拼接，帧率、时间基和音频参数必须一致
+            track_reference = self.get_stream_signature(used_materials[0]['path']) if allow_stream_copy else None
+            with stage_timing.stage("resize"):
+                for i, material in enumerate(used_materials):
+                    cache_key = None
+                    if material_cache.enabled:
+                        cache_key = disk_cache.make_key(
+                            media_cache.content_fingerprint(material['path']), game_width, encoder, allow_stream_copy
+                        )
+                        cached_path = material_cache.lookup(cache_key, ".mp4")
+                        # 固定之前被其他任务淘汰时按未命中处理
+                        if cached_path and (cache_pins is None or cache_pins.enter_context(material_cache.pinned(cached_path))):
+                            print(f"  使用缓存的缩放素材: {os.path.basename(material['path'])}")
+                            resized_materials.append(cached_path)
+                            continue
+                
+                    resized_path = os.path.join(temp_dir, f"resized_material_{i}.mp4")
+                    if self.resize_video_to_width(material['path'], game_width, resized_path, media_ctx, encoder, allow_stream_copy, track_reference):
+                        if cache_key:
+                            resized_path = material_cache.store(cache_key, resized_path, ".mp4")
+                            if cache_pins is not None:
+                                cache_pins.enter_context(material_cache.pinned(resized_path))
+                        resized_materials.append(resized_path)
+            
+            if not resized_materials:
+                return None
+            
+            # 创建concat文件列表
+            concat_file = os.path.join(temp_dir, f"concat_list_{game_filename}.txt")
+            with open(concat_file, 'w') as f:
+                for resized_material in resized_materials:
+                    f.write(f"file '{resized_material}'\n")
+            
+            # 使用concat demuxer拼接视频，兼容音频情况
+            # 检查是否有任何素材有音频
+            has_any_audio = any(m['info']['has_audio'] for m in used_materials)
+            concat_duration = sum(m['duration'] for m in used_materials)
+            
+            with stage_timing.stage("concat"):
+                # 所有片段流参数一致时无损拼接
+                concat_copied = False
+                if allow_stream_copy:
+                    # 临时目录中的缩放结果只探测不缓存，素材缓存中的文件可以缓存
+                    signatures = [self.get_stream_signature(path, cached=not path.startswith(temp_dir)) for path in resized_materials]
+                    if signatures[0] and all(sig == signatures[0] for sig in signatures):
+                        try:
+                            print(f"  {len(resized_materials)} 个片段参数一致，流复制拼接")
+                            ffmpeg_progress.run(
+                                ffmpeg
+                                .input(concat_file, format='concat', safe=0)
+                                .output(temp_material_path, c='copy')
+                                .overwrite_output(),
+                                stage="流复制拼接", duration=concat_duration
+                            )
+                            concat_copied = True
+                        except Exception as copy_e:
+                            print(f"  流复制拼接失败，改为重新编码: {copy_e}")
+            
+                if concat_copied:
+                    pass
+                elif has_any_audio:
+                    # 有音频的情况
+                    ffmpeg_progress.run(
+                        ffmpeg
+                        .input(concat_file, format='concat', safe=0)
+                        .output(temp_material_path, **encoder_profiles.output_kwargs(encoder, with_audio=True))
+                        .overwrite_output(),
+                        stage="拼接素材", duration=concat_duration
+                    )
+                else:
+                    # 没有音频的情况
+                    ffmpeg_progress.run(
+                        ffmpeg
+                        .input(concat_file, format='concat', safe=0)
+                        .output(temp_material_path, **encoder_profiles.output_kwargs(encoder, with_audio=False))
+                        .overwrite_output(),
+                        stage="拼接素材", duration=concat_duration
+                    )
+            
+            # 及早删除concat文件和临时缩放文件，释放临时目录的预算（缓存中的文件保留）
+            with stage_timing.stage("cleanup"):
+                try:
+                    os.remove(concat_file)
+                    for resized_material in resized_materials:
+                        if resized_material.startswith(temp_dir):
+                            os.remove(resized_material)
+                except:
+                    pass
+            
+            # 检查合并后的素材时长是否足够支持游戏视频时长
+            temp_material_info = self.get_video_info(temp_material_path, cached=False)
+            if not temp_material_info:
+                print(f"  警告: 无法获取合并后素材视频信息，跳过游戏视频: {game_filename}")
+                return None
+            
+            temp_material_duration = temp_material_info['duration']
+            if temp_material_duration < game_duration:
+                print(f"  警告: 合并后素材时长 ({temp_material_duration:.2f}秒) 不足以支持游戏视频时长 ({game_duration:.2f}秒)，跳过游戏视频: {game_filename}")
+                return None
+            
+            print(f"  合并后素材时长: {temp_material_duration:.2f}秒，游戏视频时长: {game_duration:.2f}秒")
+            
+            # 截取到游戏长度，兼容音频情况
+            temp_material_cropped = os.path.join(temp_dir, f"temp_material_cropped_{game_filename}.mp4")
+            
+            with stage_timing.stage("trim"):
+                # 截取从0秒开始，按关键帧对齐结束点即可用流复制完成
+                trim_copied = False
+                if allow_stream_copy:
+                    try:
+                        self.remux_video(temp_material_path, temp_material_cropped, game_duration, cached=False)
+                        trim_copied = True
+                    except Exception as copy_e:
+                        print(f"  流复制截取失败，改为重新编码: {copy_e}")
+            
+                if trim_copied:
+                    pass
+                elif temp_material_info and temp_material_info['has_audio']:
+                    # 有音频的情况
+                    ffmpeg_progress.run(
+                        ffmpeg
+                        .input(temp_material_path, t=game_duration)
+                        .output(temp_material_cropped, **encoder_profiles.output_kwargs(encoder, with_audio=True))
+                        .overwrite_output(),
+                        stage="截取素材", duration=game_duration
+                    )
+                else:
+                    # 没有音频的情况
+                    ffmpeg_progress.run(
+                        ffmpeg
+                        .input(temp_material_path, t=game_duration)
+                        .output(temp_material_cropped, **encoder_profiles.output_kwargs(encoder, with_audio=False))
+                        .overwrite_output(),
+                        stage="截取素材", duration=game_duration
+                    )
+            
+            # 替换临时文件
+            os.remove(temp_material_path)
+            temp_material_path = temp_material_cropped
+        
+        # 合并素材和游戏视频
+        with stage_timing.stage("final_merge"):
+            return self.merge_videos_vertically(temp_material_path, game_video, output_file, position, audio_mode, material_audio_volume, game_audio_volume, gif_path, media_ctx, encoder, segment_count)
+
+    def merge_videos(self, material_folder, game_folder, position, audio_mode, material_audio_volume, game_audio_volume, output_folder_name, material_path="", game_path="", gif_path="", max_parallel_jobs=0, merge_engine="single_pass", audio_detect_mode="sampled",
+                     encoder_profile="balanced", video_codec="libx264", crf=-1, video_bitrate="", encoder_threads=0, tune="none", allow_stream_copy=True, skip_existing=True, material_cache_gb=20.0,
+                     queue_mode="off", queue_path="", dry_run=False, memory_limit_gb=0.0, segment_count=1,
+                     scratch_dir="", scratch_budget_gb=0.0):
         """
         合并视频文件
         
@@ -482,6 +882,20 @@ class VideoMergeNode:
             material_path: 直接输入的素材文件夹路径（可选，优先级高于下拉框）
             game_path: 直接输入的游戏文件夹路径（可选，优先级高于下拉框）
             gif_path: GIF动态图路径（可选，如果存在则在结合处叠加显示）
+            max_parallel_jobs: 并发处理的游戏视频数量，0表示根据CPU核心数自动选择
+            merge_engine: 合并引擎（single_pass单次滤镜图/classic逐步编码/pipe管道连接的两个进程）
+            audio_detect_mode: 音量检测模式（sampled采样/full全量）
+            encoder_profile, video_codec, crf, video_bitrate, encoder_threads, tune: 编码参数
+            allow_stream_copy: classic引擎中参数一致的步骤是否允许流复制
+            skip_existing: 是否跳过已是最新的输出
+            material_cache_gb: 缩放素材缓存的磁盘预算（GB），0表示不缓存
+            queue_mode: off单独处理/shared多个实例通过共享队列分摊游戏视频（各实例的规划结果相同，只领取编码任务）
+            queue_path: 共享队列数据库路径，留空时使用输出文件夹中的队列文件
+            dry_run: 只生成合并规划并以JSON返回，不编码
+            memory_limit_gb: ffmpeg进程的内存上限（GB），0表示物理内存的75%
+            segment_count: 单个游戏视频按关键帧分段并行编码的段数，1表示不分段，0表示自动
+            scratch_dir: 中间文件的临时目录，留空时使用系统临时目录
+            scratch_budget_gb: 临时目录的空间预算（GB），0表示磁盘可用空间的80%
         """
         try:
             # 使用ComfyUI的默认输入和输出路径
@@ -519,241 +933,195 @@ class VideoMergeNode:
             output_path = os.path.join(output_folder, output_folder_name)
             os.makedirs(output_path, exist_ok=True)
             
-            # 支持的视频格式
-            video_extensions = ['*.mp4', '*.avi', '*.mov', '*.mkv', '*.wmv', '*.flv', '*.webm']
-            
-            # 获取所有游戏视频文件
-            game_videos = []
-            for ext in video_extensions:
-                pattern = os.path.join(game_input_path, ext)
-                game_videos.extend(glob.glob(pattern))
-            
-            # 获取所有素材视频文件
-            material_videos = []
-            for ext in video_extensions:
-                pattern = os.path.join(material_input_path, ext)
-                material_videos.extend(glob.glob(pattern))
+            # 获取所有游戏视频和素材视频文件（共享索引，按文件名排序，扩展名不区分大小写，只读取文件名）
+            game_videos = folder_index.list_videos(game_input_path)
+            material_videos = folder_index.list_videos(material_input_path)
             
             if not game_videos:
                 return (f"未找到游戏视频文件",)
             if not material_videos:
                 return (f"未找到素材视频文件",)
             
-            # 处理每个游戏视频
-            processed_count = 0
-            material_index = 0
-            output_paths = []
+            self.audio_detect_mode = audio_detect_mode
+            encoder = encoder_profiles.resolve_encoder(encoder_profile, video_codec, crf, video_bitrate, encoder_threads, tune)
+            print(f"🎞️ 编码配置: {encoder_profiles.describe(encoder)}")
             
-            for game_video in game_videos:
-                if material_index >= len(material_videos):
-                    break  # 素材用完则结束
-                
-                try:
-                    # 获取游戏视频信息
-                    game_info = self.get_video_info(game_video)
-                    if not game_info:
-                        continue
-                    
-                    # 检查游戏视频音频情况
-                    game_filename = Path(game_video).stem
-                    if audio_mode == "mix" and not game_info['has_audio']:
-                        print(f"警告: 游戏视频 {game_filename} 没有音频，在mix模式下可能影响混音效果")
-                    
-                    game_duration = game_info['duration']
-                    used_materials = []
-                    current_duration = 0
-                    
-                    # 为当前游戏视频收集足够的素材
-                    while current_duration < game_duration and material_index < len(material_videos):
-                        material_video = material_videos[material_index]
-                        material_info = self.get_video_info(material_video)
-                        
-                        if not material_info:
-                            material_index += 1
-                            continue
-                        
-                        # 检查素材视频音频情况
-                        material_filename = Path(material_video).stem
-                        if audio_mode == "mix" and not material_info['has_audio']:
-                            print(f"警告: 素材视频 {material_filename} 没有音频，在mix模式下可能影响混音效果")
-                        
-                        used_materials.append({
-                            'path': material_video,
-                            'duration': material_info['duration'],
-                            'info': material_info
-                        })
-                        
-                        current_duration += material_info['duration']
-                        material_index += 1
-                    
-                    if not used_materials:
+            # 运行上下文：本次运行中每个文件只探测和分析一次
+            media_ctx = media_cache.MediaInfoContext(self.get_video_info)
+            
+            # 输出清单：输入指纹、节点参数和编码配置都未变化的输出直接跳过
+            output_manifest = manifest.OutputManifest(output_path)
+            manifest_params = {
+                'node': 'VideoMergeNode',
+                'position': position,
+                'audio_mode': audio_mode,
+                'material_audio_volume': material_audio_volume,
+                'game_audio_volume': game_audio_volume,
+                'gif_path': gif_path.strip(),
+                'merge_engine': merge_engine,
+                'allow_stream_copy': allow_stream_copy,
+                # 检测模式决定素材是否按有声音混音，分段会改变关键帧位置，两者都会改变输出
+                'audio_detect_mode': audio_detect_mode,
+                'segment_count': segment_count,
+                'encoder': encoder,
+            }
+            render_options = {
+                'output_path': output_path,
+                'position': position,
+                'audio_mode': audio_mode,
+                'material_audio_volume': material_audio_volume,
+                'game_audio_volume': game_audio_volume,
+                'gif_path': gif_path,
+                'merge_engine': merge_engine,
+                'audio_detect_mode': audio_detect_mode,
+                'encoder': encoder,
+                'material_cache_gb': material_cache_gb,
+                'segment_count': segment_count,
+            }
+
+            run_started = time.perf_counter()
+            # 按核心数、负载和合并后的画面尺寸（素材缩放到游戏宽度，按同等高度估算）分配并发数和线程数
+            game_width, game_height = scheduler.source_size(game_videos)
+            workers = scheduler.activate(scheduler.plan(max_parallel_jobs, len(game_videos), game_width, game_height * 2,
+                                                        encoder['threads'], memory_limit_gb)).workers
+
+            if dry_run:
+                # 只规划：并发探测全部输入，返回完整的分配、截取点和估算
+                gif_inputs = [gif_path.strip()] if gif_path.strip() and os.path.exists(gif_path.strip()) else []
+                plan = merge_plan.build_plan(
+                    self, game_videos, material_videos, audio_mode, media_ctx, encoder, merge_engine, allow_stream_copy, workers,
+                    lambda job: skip_existing and output_manifest.is_up_to_date(
+                        self.get_output_file(output_path, job['game_video']),
+                        [job['game_video']] + [m['path'] for m in job['used_materials']] + gif_inputs, manifest_params)
+                )
+                merge_plan.print_summary(plan)
+                print(f"📋 规划文件: {merge_plan.write_plan(output_path, plan)}")
+                print(media_ctx.summary())
+                return (json.dumps(plan, ensure_ascii=False, indent=2),)
+
+            # 中间文件的临时目录（清理之前运行遗留的目录），进程池中的任务继承这里的设置
+            scratch.configure(scratch_dir, scratch_budget_gb)
+
+            # 任务总数在规划结束后才确定，先按游戏视频数显示进度
+            progress = ffmpeg_progress.BatchProgress(len(game_videos), "视频合并")
+            plan_state = {'planned': 0, 'pending': 0, 'seconds': 0.0}
+            # (规划顺序, 游戏视频, 输出文件或None, 计时记录)
+            outcomes = []
+            work = work_queue.open_queue(queue_mode, queue_path, output_path, manifest_params)
+
+            def job_media(job):
+                """任务的游戏视频和素材（GIF每个任务都会用到，不包括在内）"""
+                return [job['game_video']] + [m['path'] for m in job['used_materials']]
+
+            # GIF叠加层预渲染阶段：每种目标宽度在规划线程中只渲染一次，编码任务（包括进程池中的任务）直接使用缓存
+            gif_info = None
+            if gif_path.strip() and os.path.exists(gif_path.strip()):
+                gif_info = self.lookup_video_info(gif_path.strip(), media_ctx)
+
+            def pending_jobs():
+                """规划阶段的输出：已是最新的输出直接跳过，其余任务送入编码阶段"""
+                for plan_index, job in enumerate(self.iter_merge_jobs(game_videos, material_videos, audio_mode, media_ctx,
+                                                                      job_pool.PROBE_WORKERS)):
+                    plan_state['planned'] += 1
+                    job['plan_index'] = plan_index
+                    job['allow_stream_copy'] = allow_stream_copy
+                    job['output_file'] = self.get_output_file(output_path, job['game_video'])
+                    job['inputs'] = job_media(job)
+                    if gif_path.strip() and os.path.exists(gif_path.strip()):
+                        job['inputs'].append(gif_path.strip())
+                    if skip_existing and output_manifest.is_up_to_date(job['output_file'], job['inputs'], manifest_params):
+                        print(f"⏭️ 输出已是最新，跳过: {job['output_file']}")
+                        outcomes.append((plan_index, job['game_video'], job['output_file'], dict(job['timer'].to_dict(), status='skipped')))
+                        media_ctx.forget(job_media(job))
                         continue
-                    
-                    # 生成输出文件名
-                    game_filename = Path(game_video).stem
-                    output_file = os.path.join(output_path, f"{game_filename}_merged.mp4")
-                    
-                    # 创建临时合并的素材视频
-                    temp_dir = tempfile.mkdtemp()
-                    temp_material_path = os.path.join(temp_dir, f"temp_material_{game_filename}.mp4")
-                    
-                    # 获取游戏视频的宽度
-                    game_info = self.get_video_info(game_video)
-                    game_width = game_info['width']
-                    
-                    # 在mix模式下进行最终的音频检查
-                    if audio_mode == "mix":
-                        # 检查所有使用的素材是否有音频
-                        materials_with_audio = [m for m in used_materials if m['info']['has_audio']]
-                        materials_without_audio = [m for m in used_materials if not m['info']['has_audio']]
-                        
-                        if not game_info['has_audio'] and not materials_with_audio:
-                            print(f"错误: 游戏视频 {game_filename} 和所有素材视频都没有音频，无法进行混音处理")
-                            continue
-                        elif not game_info['has_audio']:
-                            print(f"警告: 游戏视频 {game_filename} 没有音频，将只使用素材音频")
-                        elif not materials_with_audio:
-                            print(f"警告: 所有素材视频都没有音频，将只使用游戏音频")
-                        elif materials_without_audio:
-                            print(f"警告: {len(materials_without_audio)} 个素材视频没有音频，可能影响混音效果")
-                    
-                    # 如果只有一个素材且长度足够，直接使用
-                    if len(used_materials) == 1 and used_materials[0]['duration'] >= game_duration:
-                        # 先将素材宽度对齐到游戏宽度，然后截取到游戏长度，兼容音频情况
-                        input_stream = ffmpeg.input(used_materials[0]['path'], t=game_duration)
-                        material_info = used_materials[0]['info']
-                        
-                        if material_info['has_audio']:
-                            # 有音频的情况
-                            (
-                                ffmpeg
-                                .output(
-                                    input_stream.video.filter('scale', game_width, -1),  # 宽度对齐，高度自动计算
-                                    input_stream.audio,  # 保留音频
-                                    temp_material_path, 
-                                    vcodec='libx264', 
-                                    acodec='aac', 
-                                    preset='medium'
-                                )
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-                        else:
-                            # 没有音频的情况
-                            (
-                                ffmpeg
-                                .output(
-                                    input_stream.video.filter('scale', game_width, -1),  # 宽度对齐，高度自动计算
-                                    temp_material_path, 
-                                    vcodec='libx264', 
-                                    preset='medium'
-                                )
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
+                    if gif_info:
+                        # 在规划线程中预渲染，耗时记入触发预渲染的任务的计时（与规划阶段的探测相同）
+                        overlay_width = job['game_info']['width']
+                        with stage_timing.use_timer(job['timer']), job['timer'].measure_wall(), stage_timing.stage("gif_overlay"):
+                            gif_overlay.prepare(gif_path.strip(), gif_info, overlay_width,
+                                                merge_graph.even_height(overlay_width, gif_info['width'], gif_info['height']))
+                    plan_state['pending'] += 1
+                    yield job
+                plan_state['seconds'] = time.perf_counter() - run_started
+                progress.set_total(plan_state['pending'])
+                if plan_state['planned'] < len(game_videos):
+                    print(f"⚠️ {len(game_videos) - plan_state['planned']} 个游戏视频未分配素材（素材用完或文件无法读取），"
+                          f"可以先用dry_run查看完整规划")
+
+            # 流水线：规划（后台线程，预先探测游戏视频和素材）→ 编码 → 校验，阶段之间用有界缓冲连接，
+            # 第一个游戏视频规划完成后就开始编码，内存占用不随文件数增长
+            # 进程池要在启动后台线程之前创建
+            executor = job_pool.process_pool(workers) if workers > 1 else None
+            try:
+                if work is not None:
+                    work.start()
+                # 共享队列模式下只编码本实例领取到的游戏视频
+                planned_jobs = work_queue.claimed_items(work, job_pool.prefetch(pending_jobs()), job_media,
+                                                        lambda job: os.path.basename(job['game_video']))
+
+                def job_done(item, result, error):
+                    # 校验阶段：任务一结束就校验、记入清单并标记队列完成，不等按顺序汇总
+                    # （等待其他实例的任务时汇总不会推进，提前标记才不会互相等待）
+                    job = item[0] if isinstance(item, tuple) else item
+                    output_file = result[0] if error is None else None
+                    # 输出完整才记入清单，不完整的输出下次运行重新编码
+                    problem = manifest.verify_output(output_file, job['game_info']['duration']) if output_file else None
+                    if problem:
+                        job['verify_problem'] = problem
+                    elif output_file:
+                        output_manifest.record(output_file, job['inputs'], manifest_params)
+                    work_queue.finish(work, job_media(job), bool(output_file) and not problem)
+
+                if executor is not None:
+                    print(f"🚀 并发处理 {len(game_videos)} 个游戏视频，并发数: {workers}")
+                    encoded = job_pool.iter_jobs(_render_merge_job, ((job, render_options) for job in planned_jobs), workers, progress,
+                                                 executor=executor, on_done=job_done)
+                else:
+                    encoded = job_pool.iter_jobs(lambda job: self.render_merge_job(job, media_ctx=media_ctx, **render_options), planned_jobs,
+                                                 progress=progress, on_done=job_done)
+
+                for item, result, error in encoded:
+                    job = item[0] if isinstance(item, tuple) else item
+                    if error is not None:
+                        print(f"处理游戏视频 {job['game_video']} 时出错: {str(error)}")
+                        timing = dict(job['timer'].to_dict(), status='error', error=str(error))
+                        output_file = None
                     else:
-                        # 多个素材需要拼接
-                        # 先将每个素材宽度对齐到游戏宽度
-                        resized_materials = []
-                        for i, material in enumerate(used_materials):
-                            resized_path = os.path.join(temp_dir, f"resized_material_{i}.mp4")
-                            if self.resize_video_to_width(material['path'], game_width, resized_path):
-                                resized_materials.append(resized_path)
-                        
-                        if not resized_materials:
-                            continue
-                        
-                        # 创建concat文件列表
-                        concat_file = os.path.join(temp_dir, f"concat_list_{game_filename}.txt")
-                        with open(concat_file, 'w') as f:
-                            for resized_material in resized_materials:
-                                f.write(f"file '{resized_material}'\n")
-                        
-                        # 使用concat demuxer拼接视频，兼容音频情况
-                        # 检查是否有任何素材有音频
-                        has_any_audio = any(m['info']['has_audio'] for m in used_materials)
-                        
-                        if has_any_audio:
-                            # 有音频的情况
-                            (
-                                ffmpeg
-                                .input(concat_file, format='concat', safe=0)
-                                .output(temp_material_path, vcodec='libx264', acodec='aac', preset='medium')
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-                        else:
-                            # 没有音频的情况
-                            (
-                                ffmpeg
-                                .input(concat_file, format='concat', safe=0)
-                                .output(temp_material_path, vcodec='libx264', preset='medium')
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-                        
-                        # 清理concat文件和临时缩放文件
-                        try:
-                            os.remove(concat_file)
-                            for resized_material in resized_materials:
-                                os.remove(resized_material)
-                        except:
-                            pass
-                        
-                        # 检查合并后的素材时长是否足够支持游戏视频时长
-                        temp_material_info = self.get_video_info(temp_material_path)
-                        if not temp_material_info:
-                            print(f"  警告: 无法获取合并后素材视频信息，跳过游戏视频: {game_filename}")
-                            continue
-                        
-                        temp_material_duration = temp_material_info['duration']
-                        if temp_material_duration < game_duration:
-                            print(f"  警告: 合并后素材时长 ({temp_material_duration:.2f}秒) 不足以支持游戏视频时长 ({game_duration:.2f}秒)，跳过游戏视频: {game_filename}")
-                            continue
-                        
-                        print(f"  合并后素材时长: {temp_material_duration:.2f}秒，游戏视频时长: {game_duration:.2f}秒")
-                        
-                        # 截取到游戏长度，兼容音频情况
-                        temp_material_cropped = os.path.join(temp_dir, f"temp_material_cropped_{game_filename}.mp4")
-                        
-                        if temp_material_info and temp_material_info['has_audio']:
-                            # 有音频的情况
-                            (
-                                ffmpeg
-                                .input(temp_material_path, t=game_duration)
-                                .output(temp_material_cropped, vcodec='libx264', acodec='aac', preset='medium')
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-                        else:
-                            # 没有音频的情况
-                            (
-                                ffmpeg
-                                .input(temp_material_path, t=game_duration)
-                                .output(temp_material_cropped, vcodec='libx264', preset='medium')
-                                .overwrite_output()
-                                .run(quiet=True)
-                            )
-                        
-                        # 替换临时文件
-                        os.remove(temp_material_path)
-                        temp_material_path = temp_material_cropped
-                    
-                    # 合并素材和游戏视频
-                    if self.merge_videos_vertically(temp_material_path, game_video, output_file, position, audio_mode, material_audio_volume, game_audio_volume, gif_path):
-                        processed_count += 1
-                        output_paths.append(output_file)
-                        print(f"成功合并: {game_filename} -> {output_file}")
-                    
-                    # 清理临时文件和目录
-                    try:
-                        shutil.rmtree(temp_dir)
-                    except:
-                        pass
-                    
-                except Exception as e:
-                    print(f"处理游戏视频 {game_video} 时出错: {str(e)}")
-                    continue
+                        output_file, timings = result
+                        timing = dict(timings, status='merged' if output_file else 'failed')
+                        problem = job.get('verify_problem')
+                        if problem:
+                            print(f"⚠️ 输出校验失败 {output_file}: {problem}")
+                            timing = dict(timing, status='invalid', error=problem)
+                            output_file = None
+                    outcomes.append((job['plan_index'], job['game_video'], output_file, timing))
+                    media_ctx.forget(job_media(job))
+            finally:
+                if work is not None:
+                    work.close()
+                if executor is not None:
+                    executor.shutdown()
+            print(media_ctx.summary())
+
+            # 按规划顺序汇总（包括跳过的最新输出）
+            outcomes.sort(key=lambda outcome: outcome[0])
+            output_paths = [output_file for _, _, output_file, _ in outcomes if output_file]
+            processed_count = len(output_paths)
+            
+            # 各游戏视频的阶段耗时报告（跳过的最新输出只记录规划阶段）
+            timing_entries = [dict(timing, game_video=game_video, output_file=output_file)
+                              for _, game_video, output_file, timing in outcomes]
+            try:
+                stage_timing.write_report(output_path, {
+                    'merge_engine': merge_engine,
+                    'encoder': encoder,
+                    'audio_detect_mode': audio_detect_mode,
+                    'workers': workers,
+                    'plan_seconds': round(plan_state['seconds'], 3),
+                    'wall_seconds': round(time.perf_counter() - run_started, 3),
+                }, timing_entries)
+            except Exception as report_e:
+                print(f"⚠️ 写出计时报告失败: {report_e}")
             
             if processed_count == 0:
                 return ("",)  # 没有可保存的视频时返回空字符串
@@ -768,6 +1136,11 @@ class VideoMergeNode:
             print(f"处理过程中出错: {str(e)}")
             return ("",)  # 出错时也返回空字符串
 
+def _render_merge_job(args):
+    """进程池入口：在子进程中执行单个合并任务"""
+    job, render_options = args
+    return VideoMergeNode().render_merge_job(job, **render_options)
+
 # 节点映射
 NODE_CLASS_MAPPINGS = {
     "VideoMergeNode": VideoMergeNode
@@ -0,0 +1,295 @@
+"""
+媒体元数据缓存
+ffprobe结果按 (路径, 大小, 修改时间, inode) 持久化到SQLite，前面加一层内存LRU，
+所有节点共用，重复运行同一文件夹时每个文件只需要一次stat
+"""
+
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import ffmpeg
+import folder_paths
+
+# 缓存目录名（位于ComfyUI输出目录下）
+CACHE_DIR_NAME = ".video_editing_cache"
+
+
+def get_cache_root():
+    """获取缓存根目录（ComfyUI输出目录下的隐藏文件夹）"""
+    cache_root = os.path.join(folder_paths.get_output_directory(), CACHE_DIR_NAME)
+    os.makedirs(cache_root, exist_ok=True)
+    return cache_root
+
+
+def file_fingerprint(path):
+    """
+    获取文件指纹
+
+    Returns:
+        tuple: (绝对路径, 大小, 修改时间ns, inode)
+    """
+    abs_path = os.path.abspath(path)
+    st = os.stat(abs_path)
+    return abs_path, st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def first_stream(probe, codec_type):
+    """返回probe结果中第一个指定类型的流，不存在时返回None"""
+    return next((stream for stream in probe.get('streams', []) if stream.get('codec_type') == codec_type), None)
+
+
+class ProbeCache:
+    """
+    ffprobe元数据缓存
+    内存LRU在前，SQLite持久化在后；文件指纹变化的条目视为过期并被替换
+    """
+
+    def __init__(self, db_path, max_memory_entries=2048, max_db_entries=200000):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_db_entries = max_db_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作单独连接，线程池/进程池下都安全；退出时提交（出错时回滚）并关闭，
+        # 长时间运行的ComfyUI进程不会累积连接和文件描述符
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS probe_cache ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " inode INTEGER NOT NULL,"
+                " data TEXT NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_probe_accessed ON probe_cache(accessed)")
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key[0])
+            if entry is None or entry[0] != key:
+                return None
+            self._memory.move_to_end(key[0])
+            return entry[1]
+
+    def _memory_put(self, key, probe):
+        with self._lock:
+            self._memory[key[0]] = (key, probe)
+            self._memory.move_to_end(key[0])
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _db_get(self, key):
+        path, size, mtime_ns, inode = key
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT size, mtime_ns, inode, data FROM probe_cache WHERE path = ?", (path,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if (row[0], row[1], row[2]) != (size, mtime_ns, inode):
+                    # 文件已变化，删除过期条目
+                    conn.execute("DELETE FROM probe_cache WHERE path = ?", (path,))
+                    return None
+                conn.execute("UPDATE probe_cache SET accessed = ? WHERE path = ?", (time.time(), path))
+                return json.loads(row[3])
+        except Exception as e:
+            print(f"⚠️ 读取probe缓存失败: {e}")
+            return None
+
+    def _db_put(self, key, probe):
+        path, size, mtime_ns, inode = key
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO probe_cache (path, size, mtime_ns, inode, data, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, size, mtime_ns, inode, json.dumps(probe), time.time())
+                )
+        except Exception as e:
+            print(f"⚠️ 写入probe缓存失败: {e}")
+
+    def probe(self, path):
+        """
+        获取文件的ffprobe结果（优先使用缓存）
+
+        Args:
+            path: 媒体文件路径
+        Returns:
+            dict: 与 ffmpeg.probe 返回值相同
+        """
+        key = file_fingerprint(path)
+
+        probe = self._memory_get(key)
+        if probe is None:
+            probe = self._db_get(key)
+            if probe is not None:
+                self._memory_put(key, probe)
+
+        if probe is not None:
+            self.hits += 1
+            return probe
+
+        self.misses += 1
+        probe = ffmpeg.probe(key[0])
+        self._memory_put(key, probe)
+        self._db_put(key, probe)
+        return probe
+
+    def evict_stale(self):
+        """清理已删除或已变化文件的条目，并把数据库控制在最大条目数以内"""
+        removed = 0
+        try:
+            with self._connect() as conn:
+                rows = conn.execute("SELECT path, size, mtime_ns, inode FROM probe_cache").fetchall()
+                stale = []
+                for path, size, mtime_ns, inode in rows:
+                    try:
+                        st = os.stat(path)
+                        if (st.st_size, st.st_mtime_ns, st.st_ino) != (size, mtime_ns, inode):
+                            stale.append((path,))
+                    except OSError:
+                        stale.append((path,))
+                conn.executemany("DELETE FROM probe_cache WHERE path = ?", stale)
+                removed += len(stale)
+
+                overflow = len(rows) - len(stale) - self.max_db_entries
+                if overflow > 0:
+                    conn.execute(
+                        "DELETE FROM probe_cache WHERE path IN "
+                        "(SELECT path FROM probe_cache ORDER BY accessed ASC LIMIT ?)",
+                        (overflow,)
+                    )
+                    removed += overflow
+        except Exception as e:
+            print(f"⚠️ 清理probe缓存失败: {e}")
+        return removed
+
+
+_probe_cache = None
+_probe_cache_lock = threading.Lock()
+
+
+def get_probe_cache():
+    """获取全局共享的probe缓存（首次使用时创建并清理过期条目）"""
+    global _probe_cache
+    with _probe_cache_lock:
+        if _probe_cache is None:
+            db_path = os.path.join(get_cache_root(), "probe_cache.sqlite3")
+            _probe_cache = ProbeCache(db_path)
+            removed = _probe_cache.evict_stale()
+            if removed:
+                print(f"🧹 已清理 {removed} 条过期的probe缓存")
+        return _probe_cache
+
+
+def probe(path, cached=True):
+    """
+    带缓存的 ffmpeg.probe 替代函数
+
+    Args:
+        cached: False时直接探测，不读写缓存（用于刚写出、只探测一次的输出文件）
+    """
+    if not cached:
+        return ffmpeg.probe(path)
+    return get_probe_cache().probe(path)
+
+
+class MediaInfoContext:
+    """
+    单次运行内的媒体信息上下文
+    同一个文件在一次运行中只探测和分析（音量检测）一次，并统计命中/未命中次数
+    """
+
+    def __init__(self, loader):
+        """
+        Args:
+            loader: 实际获取媒体信息的函数 loader(path) -> dict或None
+        """
+        self._loader = loader
+        self._infos = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def seed(self, path, info):
+        """写入已知的媒体信息（例如规划阶段已经分析过的结果）"""
+        if info is not None:
+            with self._lock:
+                self._infos[os.path.abspath(path)] = info
+
+    def get(self, path):
+        """获取媒体信息，同一路径只调用一次loader"""
+        key = os.path.abspath(path)
+        with self._lock:
+            if key in self._infos:
+                self.hits += 1
+                return self._infos[key]
+            self.misses += 1
+        info = self._loader(path)
+        with self._lock:
+            self._infos[key] = info
+        return info
+
+    def forget(self, paths):
+        """丢弃已完成任务的媒体信息，长批处理中上下文的大小不随文件数增长"""
+        with self._lock:
+            for path in paths:
+                self._infos.pop(os.path.abspath(path), None)
+
+    def summary(self):
+        """返回命中统计的日志文本"""
+        return f"媒体信息缓存 - 命中: {self.hits}, 未命中: {self.misses}"
+
+
+# 内容指纹只读取文件头尾各1MiB，避免对大文件做全量哈希
+_CONTENT_SAMPLE_BYTES = 1024 * 1024
+_content_fingerprints = {}
+_content_fingerprints_lock = threading.Lock()
+
+
+def content_fingerprint(path):
+    """
+    基于文件内容的指纹（文件大小 + 头尾各1MiB的sha256）
+
+    同一份内容复制到不同路径时指纹相同；结果按文件指纹在进程内缓存
+    """
+    key = file_fingerprint(path)
+    with _content_fingerprints_lock:
+        cached = _content_fingerprints.get(key)
+    if cached:
+        return cached
+
+    size = key[1]
+    digest = hashlib.sha256(str(size).encode('utf-8'))
+    with open(key[0], 'rb') as f:
+        digest.update(f.read(_CONTENT_SAMPLE_BYTES))
+        if size > _CONTENT_SAMPLE_BYTES:
+            f.seek(max(_CONTENT_SAMPLE_BYTES, size - _CONTENT_SAMPLE_BYTES))
+            digest.update(f.read(_CONTENT_SAMPLE_BYTES))
+    fingerprint = digest.hexdigest()
+
+    with _content_fingerprints_lock:
+        _content_fingerprints[key] = fingerprint
+    return fingerprint
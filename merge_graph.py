@@ -0,0 +1,337 @@
+"""
+单次滤镜图合并引擎
+在一个ffmpeg进程中完成 缩放→拼接→截取→垂直合并(→GIF叠加)→混音，直接写出最终文件，
+不产生中间编码和临时文件；管道引擎把素材轨道和最终合并拆成两个通过管道连接、同时运行的ffmpeg进程
+"""
+
+import os
+import ffmpeg
+
+from . import encoder_profiles
+from . import ffmpeg_progress
+from . import gif_overlay
+from . import segment_encode
+from . import stage_timing
+
+# 拼接静音片段和统一音频格式时使用的参数
+AUDIO_SAMPLE_RATE = 48000
+AUDIO_CHANNEL_LAYOUT = 'stereo'
+# 管道中间格式：NUT封装的未压缩画面和PCM音频（编解码几乎没有开销）
+PIPE_FORMAT = 'nut'
+PIPE_VIDEO_CODEC = 'rawvideo'
+PIPE_AUDIO_CODEC = 'pcm_f32le'
+
+
+def even_height(target_width, width, height):
+    """按目标宽度等比计算高度，并向上取偶数（视频编码要求）"""
+    new_height = int((target_width * height) / width)
+    if new_height % 2 != 0:
+        new_height += 1
+    return new_height
+
+
+def _normalize_audio(audio_stream):
+    """统一采样率和声道布局，concat/amix要求各段格式一致"""
+    return (
+        audio_stream
+        .filter('aresample', AUDIO_SAMPLE_RATE)
+        .filter('aformat', sample_fmts='fltp', channel_layouts=AUDIO_CHANNEL_LAYOUT)
+    )
+
+
+def _silence(duration):
+    """生成指定时长的静音音频流"""
+    return ffmpeg.input(
+        f'anullsrc=channel_layout={AUDIO_CHANNEL_LAYOUT}:sample_rate={AUDIO_SAMPLE_RATE}',
+        f='lavfi', t=duration
+    ).audio
+
+
+def build_material_track(used_materials, target_width, duration, with_audio=False, start=0.0, with_video=True):
+    """
+    构建素材轨道：每个素材缩放到目标宽度，拼接后截取到指定时长
+
+    所有片段统一缩放到第一个素材的尺寸，与concat demuxer重新编码时的行为一致
+
+    Args:
+        used_materials: 规划阶段分配的素材列表（包含path/duration/info）
+        target_width: 目标宽度（游戏视频宽度）
+        duration: 截取时长（游戏视频时长）
+        with_audio: 是否同时构建素材音频轨道
+        start: 轨道中的起点（分段编码时只使用与 [start, start+duration) 重叠的素材，第一个素材定位到起点）
+        with_video: 是否构建视频轨道，False时只构建音频
+    Returns:
+        tuple: (视频流或None, 音频流或None, 素材高度)
+    """
+    first_info = used_materials[0]['info']
+    target_height = even_height(target_width, first_info['width'], first_info['height'])
+
+    segments = []
+    count = 0
+    offset = 0.0
+    for material in used_materials:
+        material_start, offset = offset, offset + material['duration']
+        if offset <= start:
+            continue
+        if material_start >= start + duration:
+            break
+        seek = max(start - material_start, 0.0)
+        material_input = ffmpeg.input(material['path'], **({'ss': seek} if seek else {}))
+        count += 1
+        if with_video:
+            segments.append(
+                material_input.video
+                .filter('scale', target_width, target_height)
+                .filter('setsar', 1)
+                .filter('format', 'yuv420p')
+            )
+        if with_audio:
+            if material['info'].get('has_audio_track', material['info']['has_audio']):
+                segments.append(_normalize_audio(material_input.audio))
+            else:
+                segments.append(_silence(material['duration'] - seek))
+
+    if count == 1:
+        video = segments[0] if with_video else None
+        audio = segments[-1] if with_audio else None
+    else:
+        joined = ffmpeg.concat(*segments, v=1 if with_video else 0, a=1 if with_audio else 0).node
+        video = joined[0] if with_video else None
+        audio = joined[1 if with_video else 0] if with_audio else None
+
+    if video is not None:
+        video = video.filter('trim', duration=duration).filter('setpts', 'PTS-STARTPTS')
+    if audio is not None:
+        audio = audio.filter('atrim', duration=duration).filter('asetpts', 'PTS-STARTPTS')
+
+    return video, audio, target_height
+
+
+def build_gif_overlay(video_output, gif_path, gif_info, video_width, seam_y, start_time=0.0):
+    """
+    在合并后视频的结合处叠加循环播放的GIF
+
+    Args:
+        video_output: 垂直合并后的视频流
+        gif_path: GIF文件路径
+        gif_info: GIF的视频信息（width/height/duration）
+        video_width: 合并后视频宽度
+        seam_y: 结合处的Y坐标
+        start_time: 该段画面在整条时间轴中的起点（分段编码时GIF从对应的循环位置开始，段之间动画连续）
+    """
+    # 计算GIF缩放后的高度（等比缩放）
+    gif_new_height = even_height(video_width, gif_info['width'], gif_info['height'])
+
+    print(f"  GIF原始时长: {gif_info['duration']:.2f}秒")
+    print(f"  GIF原始尺寸: {gif_info['width']}x{gif_info['height']}")
+    print(f"  GIF缩放尺寸: {video_width}x{gif_new_height}")
+
+    # 预渲染好的叠加层（已缩放到与游戏视频相同的宽度）用-stream_loop循环读取，内存占用与GIF长度无关；
+    # 预渲染失败时回退到loop filter，在内存中缓存解码帧循环播放后再缩放
+    with stage_timing.stage("gif_overlay"):
+        overlay_path = gif_overlay.prepare(gif_path, gif_info, video_width, gif_new_height)
+    if overlay_path:
+        gif_looped = ffmpeg.input(overlay_path, stream_loop=-1).video
+    else:
+        gif_looped = ffmpeg.input(gif_path).video.filter('loop', loop=-1, size=32767, start=0)
+    if start_time and gif_info['duration'] > 0:
+        gif_looped = (
+            gif_looped
+            .filter('trim', start=start_time % gif_info['duration'])
+            .filter('setpts', 'PTS-STARTPTS')
+        )
+    gif_scaled = gif_looped if overlay_path else gif_looped.filter('scale', video_width, gif_new_height)
+
+    # 叠加缩放后的GIF到视频上，使用shortest=1确保输出时长由游戏视频决定
+    video_output = ffmpeg.filter([video_output, gif_scaled], 'overlay',
+                                 x='(W-w)/2',  # 水平居中
+                                 y=f'{seam_y}-h/2',  # 垂直居中在结合处
+                                 shortest=1)
+    print(f"  GIF循环播放设置: {'循环读取预渲染叠加层' if overlay_path else '使用loop filter'}实现无限循环，输出时长由游戏视频决定")
+    print(f"  GIF叠加位置: 水平居中，垂直位置在结合处 (y={seam_y})")
+    return video_output
+
+
+def select_audio(audio_mode, material_audio, game_audio, material_has_audio, game_has_audio,
+                 material_audio_volume=0.5, game_audio_volume=0.5):
+    """
+    按音频模式选择输出音频流，与逐步合并时的判断逻辑一致
+
+    Returns:
+        音频流，没有可用音频时返回None
+    """
+    if audio_mode != "mix":
+        print("  使用游戏音频")
+        return game_audio
+
+    print(f"  混音模式 - 素材音量: {material_audio_volume}, 游戏音量: {game_audio_volume}")
+    if not material_has_audio and not game_has_audio:
+        raise ValueError("素材视频和游戏视频都没有音频，无法进行混音处理")
+    if not material_has_audio:
+        print("  素材视频没有音频，使用游戏音频")
+        return game_audio
+    if not game_has_audio:
+        print("  游戏视频没有音频，使用素材音频")
+        return material_audio
+
+    print("  两个视频都有音频，进行混音处理")
+    return ffmpeg.filter(
+        [material_audio.filter('volume', material_audio_volume),
+         _normalize_audio(game_audio).filter('volume', game_audio_volume)],
+        'amix', inputs=2, duration='longest'
+    )
+
+
+def _stack(material_video, material_height, game_stream, game_info, position, gif_path, gif_info, start_time=0.0):
+    """按素材位置垂直合并，并在结合处叠加GIF"""
+    # 根据位置确定视频顺序并合并
+    if position == "up":
+        video_output = ffmpeg.filter([material_video, game_stream], 'vstack', inputs=2)
+        seam_y = material_height
+    else:
+        video_output = ffmpeg.filter([game_stream, material_video], 'vstack', inputs=2)
+        seam_y = game_info['height']
+
+    if gif_info:
+        print(f"  检测到GIF文件: {os.path.basename(gif_path)}")
+        video_output = build_gif_overlay(video_output, gif_path, gif_info, game_info['width'], seam_y, start_time)
+    return video_output
+
+
+def _game_stream(game_input):
+    return game_input.video.filter('setsar', 1).filter('format', 'yuv420p')
+
+
+def render_single_pass(used_materials, game_video, game_info, output_file, position="up",
+                       audio_mode="game_only", material_audio_volume=0.5, game_audio_volume=0.5,
+                       gif_path="", gif_info=None, encoder=None, segment_count=1):
+    """
+    单次调用ffmpeg完成整个合并流程
+
+    Args:
+        used_materials: 规划阶段分配的素材列表
+        game_video: 游戏视频路径
+        game_info: 游戏视频信息
+        output_file: 最终输出文件
+        position: 素材位置（up/down）
+        audio_mode: 音频模式（game_only/mix）
+        gif_path: GIF路径，gif_info为None时不叠加
+        encoder: 编码配置，None时使用默认配置
+        segment_count: 按游戏视频关键帧分段并行编码的段数（见segment_encode），1表示不分段
+    """
+    game_width = game_info['width']
+    game_duration = game_info['duration']
+    material_has_audio = any(m['info']['has_audio'] for m in used_materials)
+    need_material_audio = audio_mode == "mix" and material_has_audio
+
+    print(f"单次滤镜图合并: {os.path.basename(game_video)} ({len(used_materials)} 个素材)")
+
+    # 素材不足的任务在调用前已经跳过（merge_plan.material_shortfall），每个分段都有素材画面
+    ranges = [(0.0, game_duration)]
+    if segment_count != 1:
+        first_info = used_materials[0]['info']
+        ranges = segment_encode.plan_ranges(
+            game_video, game_duration, segment_count, game_width,
+            game_info['height'] + even_height(game_width, first_info['width'], first_info['height'])
+        )
+
+    if len(ranges) > 1:
+        # 各段分别构建画面（素材和游戏视频都定位到段起点），音频对整条时间轴只构建一次
+        def build_video(start, length):
+            material_video, _, material_height = build_material_track(
+                used_materials, game_width, length, start=start
+            )
+            game_stream = _game_stream(ffmpeg.input(game_video, ss=start, t=length))
+            return _stack(material_video, material_height, game_stream, game_info, position, gif_path, gif_info, start)
+
+        material_audio = None
+        if need_material_audio:
+            _, material_audio, _ = build_material_track(
+                used_materials, game_width, game_duration, with_audio=True, with_video=False
+            )
+        game_input = ffmpeg.input(game_video)
+    else:
+        material_video, material_audio, material_height = build_material_track(
+            used_materials, game_width, game_duration, with_audio=need_material_audio
+        )
+        game_input = ffmpeg.input(game_video)
+        video_output = _stack(material_video, material_height, _game_stream(game_input), game_info,
+                              position, gif_path, gif_info)
+
+    game_has_track = game_info.get('has_audio_track', game_info['has_audio'])
+    audio_output = select_audio(
+        audio_mode,
+        material_audio,
+        game_input.audio if game_has_track else None,
+        need_material_audio,
+        game_info['has_audio'] if audio_mode == "mix" else game_has_track,
+        material_audio_volume,
+        game_audio_volume,
+    )
+
+    if len(ranges) > 1:
+        segment_encode.encode_segmented(build_video, ranges, output_file, encoder, audio_output, stage="单次合并")
+        return True
+
+    if audio_output is not None:
+        output = ffmpeg.output(video_output, audio_output, output_file,
+                               **encoder_profiles.output_kwargs(encoder, with_audio=True))
+    else:
+        output = ffmpeg.output(video_output, output_file, **encoder_profiles.output_kwargs(encoder, with_audio=False))
+
+    ffmpeg_progress.run(output.overwrite_output(), stage="单次合并", duration=game_duration)
+    return True
+
+
+def render_piped(used_materials, game_video, game_info, output_file, position="up",
+                 audio_mode="game_only", material_audio_volume=0.5, game_audio_volume=0.5,
+                 gif_path="", gif_info=None, encoder=None):
+    """
+    管道合并：上游进程构建素材轨道（缩放→拼接→截取），以NUT原始画面写入管道；
+    下游进程读取管道完成垂直合并、GIF叠加、混音和编码。两个进程同时运行，不写临时文件
+
+    参数与 render_single_pass 相同
+    """
+    game_width = game_info['width']
+    game_duration = game_info['duration']
+    material_has_audio = any(m['info']['has_audio'] for m in used_materials)
+    need_material_audio = audio_mode == "mix" and material_has_audio
+    first_info = used_materials[0]['info']
+    material_height = even_height(game_width, first_info['width'], first_info['height'])
+
+    print(f"管道合并: {os.path.basename(game_video)} ({len(used_materials)} 个素材)")
+
+    def produce(fd):
+        material_video, material_audio, _ = build_material_track(
+            used_materials, game_width, game_duration, with_audio=need_material_audio
+        )
+        if material_audio is not None:
+            return ffmpeg.output(material_video, material_audio, f'pipe:{fd}', format=PIPE_FORMAT,
+                                 vcodec=PIPE_VIDEO_CODEC, acodec=PIPE_AUDIO_CODEC)
+        return ffmpeg.output(material_video, f'pipe:{fd}', format=PIPE_FORMAT, vcodec=PIPE_VIDEO_CODEC)
+
+    def consume(fd):
+        material_input = ffmpeg.input(f'pipe:{fd}', format=PIPE_FORMAT)
+        game_input = ffmpeg.input(game_video)
+        video_output = _stack(material_input.video, material_height, _game_stream(game_input), game_info,
+                              position, gif_path, gif_info)
+
+        game_has_track = game_info.get('has_audio_track', game_info['has_audio'])
+        audio_output = select_audio(
+            audio_mode,
+            material_input.audio if need_material_audio else None,
+            game_input.audio if game_has_track else None,
+            need_material_audio,
+            game_info['has_audio'] if audio_mode == "mix" else game_has_track,
+            material_audio_volume,
+            game_audio_volume,
+        )
+        if audio_output is not None:
+            output = ffmpeg.output(video_output, audio_output, output_file,
+                                   **encoder_profiles.output_kwargs(encoder, with_audio=True))
+        else:
+            output = ffmpeg.output(video_output, output_file, **encoder_profiles.output_kwargs(encoder, with_audio=False))
+        return output.overwrite_output()
+
+    ffmpeg_progress.run_pipeline(produce, consume, "管道素材轨道", "管道合并", duration=game_duration)
+    return True
@@ -0,0 +1,246 @@
+"""
+合并规划
+编码之前并发探测所有输入，计算完整的 游戏视频→素材 分配和截取点，估算编码耗时和磁盘占用；
+dry_run模式只输出规划JSON，用于估算任务规模、提前发现素材不足
+"""
+
+import os
+import json
+import time
+
+from . import job_pool
+from . import keyframes
+from . import merge_graph
+
+PLAN_FILENAME = "merge_plan.json"
+
+# 单个编码进程的大致吞吐量（百万像素/秒，按8核左右的CPU估计），只用于估算，不同机器差异很大
+ENCODE_MPIXELS_PER_SECOND = {
+    'libx264': {'ultrafast': 260, 'superfast': 200, 'veryfast': 150, 'faster': 110, 'fast': 90,
+                'medium': 70, 'slow': 40, 'slower': 20, 'veryslow': 10},
+    'libx265': {'ultrafast': 90, 'superfast': 70, 'veryfast': 50, 'faster': 40, 'fast': 30,
+                'medium': 20, 'slow': 10, 'slower': 5, 'veryslow': 2},
+    'libsvtav1': {12: 200, 8: 50, 4: 8},
+}
+DEFAULT_MPIXELS_PER_SECOND = 50
+# CRF模式下的码率估算：基准CRF时每像素的比特数，CRF每增加6码率约减半
+BITS_PER_PIXEL_AT_CRF = {'libx264': (23, 0.08), 'libx265': (28, 0.05), 'libsvtav1': (32, 0.045)}
+
+
+def parse_bitrate(value):
+    """解析 "4M" / "800k" / "128000" 形式的码率，返回比特/秒"""
+    value = str(value).strip().lower()
+    multiplier = 1
+    if value.endswith('k'):
+        multiplier, value = 1000, value[:-1]
+    elif value.endswith('m'):
+        multiplier, value = 1000 * 1000, value[:-1]
+    return float(value) * multiplier
+
+
+def estimate_encode(encoder, width, height, fps, duration, with_audio=True):
+    """
+    估算一次编码的耗时和输出大小
+
+    Returns:
+        dict: {'seconds': 编码耗时估算, 'bytes': 输出大小估算}
+    """
+    pixels_per_second = width * height * (fps or 30)
+    rates = ENCODE_MPIXELS_PER_SECOND.get(encoder['vcodec'], {})
+    rate = rates.get(encoder['preset'], DEFAULT_MPIXELS_PER_SECOND) * 1e6
+
+    if encoder['video_bitrate']:
+        video_bps = parse_bitrate(encoder['video_bitrate'])
+    else:
+        base_crf, base_bpp = BITS_PER_PIXEL_AT_CRF.get(encoder['vcodec'], BITS_PER_PIXEL_AT_CRF['libx264'])
+        video_bps = pixels_per_second * base_bpp * 2 ** ((base_crf - encoder['crf']) / 6)
+    audio_bps = parse_bitrate(encoder['audio_bitrate']) if with_audio else 0
+
+    return {
+        'seconds': pixels_per_second * duration / rate,
+        'bytes': (video_bps + audio_bps) * duration / 8,
+    }
+
+
+def material_shortfall(job):
+    """
+    分配到的素材总时长比游戏视频短多少秒
+
+    Returns:
+        float: 不足的秒数，0表示素材足够；大于0时合并任务会被跳过
+    """
+    game_duration = job['game_info']['duration']
+    return max(game_duration - sum(m['duration'] for m in job['used_materials']), 0.0)
+
+
+def material_cuts(job, keyframe_aligned=False):
+    """
+    素材轨道的截取点：每个素材在轨道中的位置和使用的区间，最后一个素材截取到游戏视频时长
+
+    Args:
+        keyframe_aligned: 单个素材流复制截取时，结束点对齐到之后的第一个关键帧
+    """
+    game_duration = job['game_info']['duration']
+    cuts = []
+    offset = 0.0
+    for material in job['used_materials']:
+        use = min(material['duration'], max(game_duration - offset, 0.0))
+        cuts.append({
+            'material': material['path'],
+            'track_start': round(offset, 3),
+            'source_start': 0.0,
+            'source_end': round(use, 3),
+            'material_duration': round(material['duration'], 3),
+        })
+        offset += material['duration']
+
+    if keyframe_aligned and len(cuts) == 1 and cuts[0]['source_end'] < cuts[0]['material_duration']:
+        try:
+            keyframe = keyframes.next_keyframe(cuts[0]['material'], cuts[0]['source_end'])
+            if keyframe is not None:
+                cuts[0]['keyframe_end'] = round(keyframe, 3)
+        except Exception as e:
+            print(f"  ⚠️ 查询关键帧失败 {cuts[0]['material']}: {e}")
+    return cuts
+
+
+def estimate_job(job, encoder, merge_engine, allow_stream_copy):
+    """估算单个合并任务的输出尺寸、编码耗时、输出大小和classic引擎的临时文件占用"""
+    game_info = job['game_info']
+    game_width, game_duration = game_info['width'], game_info['duration']
+    fps = game_info.get('fps') or 30
+    first_material = job['used_materials'][0]['info']
+    material_height = merge_graph.even_height(game_width, first_material['width'], first_material['height'])
+    output_height = game_info['height'] + material_height
+
+    final = estimate_encode(encoder, game_width, output_height, fps, game_duration)
+    encode_seconds = final['seconds']
+    temp_bytes = 0
+    if merge_engine == "classic":
+        # 缩放每个素材，多个素材时再拼接和截取（允许流复制时这两步通常不重新编码）
+        for material in job['used_materials']:
+            resized = estimate_encode(encoder, game_width, material_height, material['info'].get('fps') or fps,
+                                      material['duration'], material['info']['has_audio'])
+            encode_seconds += resized['seconds']
+            temp_bytes += resized['bytes']
+        if len(job['used_materials']) > 1:
+            track_duration = sum(m['duration'] for m in job['used_materials'])
+            track = estimate_encode(encoder, game_width, material_height, fps, track_duration)
+            temp_bytes += track['bytes'] * 2  # 拼接结果 + 截取结果
+            if not allow_stream_copy:
+                encode_seconds += track['seconds'] + estimate_encode(encoder, game_width, material_height, fps, game_duration)['seconds']
+
+    return {
+        'output_size': [game_width, output_height],
+        'encode_seconds': round(encode_seconds, 1),
+        'output_bytes': int(final['bytes']),
+        'temp_bytes': int(temp_bytes),
+    }
+
+
+def build_plan(node, game_videos, material_videos, audio_mode, media_ctx, encoder, merge_engine="single_pass",
+               allow_stream_copy=True, workers=1, is_up_to_date=None):
+    """
+    生成完整的合并规划（不编码）
+
+    Args:
+        node: VideoMergeNode实例（使用其探测和分配逻辑）
+        media_ctx: 运行上下文，所有输入先在线程池中并发探测
+        workers: 实际并发数，用于估算总耗时
+        is_up_to_date: 判断任务输出是否已是最新的函数 is_up_to_date(job)，已是最新的任务不计入估算
+    Returns:
+        dict: 可JSON序列化的规划
+    """
+    started = time.perf_counter()
+    # 并发探测全部输入（探测和音量分析结果留在运行上下文中，后面的分配直接命中）
+    job_pool.run_jobs(media_ctx.get, list(game_videos) + list(material_videos), job_pool.PROBE_WORKERS)
+    probe_seconds = time.perf_counter() - started
+
+    jobs = node.plan_merge_jobs(game_videos, material_videos, audio_mode, media_ctx)
+
+    planned_games = {job['game_video'] for job in jobs}
+    used_materials = {m['path'] for job in jobs for m in job['used_materials']}
+    unreadable = [path for path in list(game_videos) + list(material_videos) if media_ctx.get(path) is None]
+    unassigned = [path for path in game_videos if path not in planned_games and media_ctx.get(path) is not None]
+    keyframe_aligned = merge_engine == "classic" and allow_stream_copy
+
+    entries = []
+    totals = {'encode_seconds': 0.0, 'output_bytes': 0, 'peak_temp_bytes': 0}
+    temp_sizes = []
+    shortfall_games = 0
+    for job in jobs:
+        game_duration = job['game_info']['duration']
+        material_seconds = sum(m['duration'] for m in job['used_materials'])
+        shortfall = material_shortfall(job)
+        # 与编码时的判断相同：素材不足的任务会被跳过，不计入待编码任务和估算
+        skip = "material_shortfall" if shortfall > 0 else None
+        if skip:
+            shortfall_games += 1
+        up_to_date = bool(is_up_to_date and is_up_to_date(job))
+        estimate = estimate_job(job, encoder, merge_engine, allow_stream_copy)
+        if not up_to_date and not skip:
+            totals['encode_seconds'] += estimate['encode_seconds']
+            totals['output_bytes'] += estimate['output_bytes']
+            temp_sizes.append(estimate['temp_bytes'])
+        entries.append(dict({
+            'game_video': job['game_video'],
+            'game_duration': round(game_duration, 3),
+            'material_seconds': round(material_seconds, 3),
+            'shortfall_seconds': round(shortfall, 3),
+            'up_to_date': up_to_date,
+            'skip': skip,
+            'cuts': material_cuts(job, keyframe_aligned),
+        }, **estimate))
+
+    # 同时进行的任务最多占用并发数个任务的临时文件
+    totals['peak_temp_bytes'] = sum(sorted(temp_sizes, reverse=True)[:max(workers, 1)])
+    totals['encode_seconds'] = round(totals['encode_seconds'], 1)
+    totals['estimated_wall_seconds'] = round(totals['encode_seconds'] / max(workers, 1), 1)
+
+    return {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'merge_engine': merge_engine,
+        'encoder': encoder,
+        'workers': workers,
+        'probe_seconds': round(probe_seconds, 3),
+        'summary': {
+            'game_videos': len(game_videos),
+            'planned_jobs': len(jobs),
+            'pending_jobs': sum(1 for entry in entries if not entry['up_to_date'] and not entry['skip']),
+            'unassigned_game_videos': len(unassigned),
+            'short_material_jobs': shortfall_games,
+            'materials': len(material_videos),
+            'used_materials': len(used_materials),
+            'unused_materials': len(material_videos) - len(used_materials) - sum(1 for path in unreadable if path in material_videos),
+            'unreadable_files': len(unreadable),
+            **totals,
+        },
+        'jobs': entries,
+        'unassigned_game_videos': unassigned,
+        'unreadable_files': unreadable,
+    }
+
+
+def write_plan(output_path, plan):
+    """把规划写到输出文件夹，返回规划文件路径"""
+    plan_path = os.path.join(output_path, PLAN_FILENAME)
+    temp_path = f"{plan_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, plan_path)
+    return plan_path
+
+
+def print_summary(plan):
+    """在控制台打印规划摘要"""
+    summary = plan['summary']
+    print(f"📋 合并规划: {summary['planned_jobs']}/{summary['game_videos']} 个游戏视频已分配素材，"
+          f"待编码 {summary['pending_jobs']} 个，使用素材 {summary['used_materials']}/{summary['materials']} 个")
+    if summary['unassigned_game_videos']:
+        print(f"⚠️ 素材不足: {summary['unassigned_game_videos']} 个游戏视频没有可分配的素材")
+    if summary['short_material_jobs']:
+        print(f"⚠️ {summary['short_material_jobs']} 个游戏视频分配到的素材总时长短于游戏视频，编码时将跳过（不计入估算）")
+    if summary['unreadable_files']:
+        print(f"⚠️ {summary['unreadable_files']} 个文件无法读取")
+    print(f"⏱️ 估算编码耗时: {summary['encode_seconds'] / 3600:.2f} 小时（{plan['workers']} 并发约 {summary['estimated_wall_seconds'] / 3600:.2f} 小时）")
+    print(f"💾 估算输出大小: {summary['output_bytes'] / 1024 ** 3:.2f} GB，临时文件峰值: {summary['peak_temp_bytes'] / 1024 ** 3:.2f} GB")
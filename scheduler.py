@@ -0,0 +1,240 @@
+"""
+资源调度
+根据可用核心数、系统负载和视频分辨率确定并发任务数和每个ffmpeg进程的 -threads / -filter_threads，
+启动新的ffmpeg进程前测量正在运行的ffmpeg进程的内存占用（RSS），超过内存上限时等待其他进程结束
+"""
+
+import os
+import time
+import threading
+
+try:
+    import psutil
+except ImportError:
+    psutil = None  # 没有psutil时从/proc读取（仅Linux），都不可用时不限制内存
+
+from . import media_cache
+
+# 每个编码任务按分辨率（像素数）需要的核心数，超过最后一档时使用 MAX_CORES_PER_JOB
+CORES_BY_PIXELS = [(1280 * 720, 2), (1920 * 1080, 4), (2560 * 1440, 6)]
+MAX_CORES_PER_JOB = 8
+# memory_limit_gb为0（自动）时使用物理内存的比例
+AUTO_MEMORY_FRACTION = 0.75
+# 单个ffmpeg进程的内存估算：固定开销 + 编码器和滤镜缓存的帧（yuv420p）
+BASE_PROCESS_BYTES = 150 * 1024 * 1024
+BUFFERED_FRAMES = 60
+# 内存超过上限时重新测量的间隔
+ADMIT_POLL_SECONDS = 1.0
+# 刚启动的进程还没有达到稳定的内存占用，这段时间内按估算值计入
+RESERVATION_SECONDS = 5.0
+FFMPEG_PROCESS_NAMES = ('ffmpeg', 'ffprobe')
+
+# ComfyUI主进程的pid（进程池通过fork创建，子进程中仍是父进程的pid），统计它的所有后代ffmpeg进程
+_ROOT_PID = os.getpid()
+
+_active = None
+_reservations = []
+_lock = threading.Lock()
+
+
+class Allocation:
+    """一次批处理的资源分配"""
+
+    def __init__(self, workers, threads, filter_threads, memory_limit_bytes, job_bytes):
+        self.workers = workers
+        self.threads = threads
+        self.filter_threads = filter_threads
+        self.memory_limit_bytes = memory_limit_bytes
+        self.job_bytes = job_bytes
+
+    def describe(self):
+        memory = f"{self.memory_limit_bytes / 1024 ** 3:.1f}GB" if self.memory_limit_bytes else "不限制"
+        return (f"并发任务 {self.workers}，每个ffmpeg线程 {self.threads} / 滤镜线程 {self.filter_threads}，"
+                f"内存上限 {memory}（单任务估算 {self.job_bytes / 1024 ** 3:.2f}GB）")
+
+
+def available_cores():
+    """本进程可用的核心数，扣除其他工作流正在占用的部分（1分钟平均负载，最多扣除一半）"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        busy = int(os.getloadavg()[0])
+    except (AttributeError, OSError):
+        busy = 0
+    return max(1, cores - min(busy, cores // 2))
+
+
+def cores_per_job(width, height):
+    """单个编码任务在该分辨率下大致能用满的核心数"""
+    pixels = width * height
+    for limit, cores in CORES_BY_PIXELS:
+        if pixels <= limit:
+            return cores
+    return MAX_CORES_PER_JOB
+
+
+def estimate_job_bytes(width, height):
+    """单个ffmpeg进程的内存估算"""
+    return BASE_PROCESS_BYTES + BUFFERED_FRAMES * width * height * 3 // 2
+
+
+def total_memory_bytes():
+    """物理内存大小，无法获取时返回None"""
+    if psutil is not None:
+        return psutil.virtual_memory().total
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def source_size(video_files, default=(1920, 1080)):
+    """批处理的代表分辨率：取前几个能探测到的视频中最大的一个"""
+    best = None
+    for video_file in video_files[:3]:
+        try:
+            stream = media_cache.first_stream(media_cache.probe(video_file), 'video')
+        except Exception:
+            continue
+        if stream:
+            size = (int(stream['width']), int(stream['height']))
+            if best is None or size[0] * size[1] > best[0] * best[1]:
+                best = size
+    return best or default
+
+
+def plan(max_parallel_jobs, job_count, width=1920, height=1080, encoder_threads=0, memory_limit_gb=0):
+    """
+    计算资源分配
+
+    Args:
+        max_parallel_jobs: 用户设置的并发数，0表示自动
+        job_count: 任务数量
+        width, height: 每个任务处理的画面尺寸（合并时为合并后的尺寸）
+        encoder_threads: 用户设置的每个编码进程的线程数，0表示自动
+        memory_limit_gb: ffmpeg进程的内存上限（GB），0表示物理内存的75%
+    Returns:
+        Allocation
+    """
+    cores = available_cores()
+    per_job = encoder_threads if encoder_threads and encoder_threads > 0 else cores_per_job(width, height)
+    job_bytes = estimate_job_bytes(width, height)
+
+    if memory_limit_gb and memory_limit_gb > 0:
+        memory_limit = int(memory_limit_gb * 1024 ** 3)
+    else:
+        total = total_memory_bytes()
+        memory_limit = int(total * AUTO_MEMORY_FRACTION) if total else None
+
+    if max_parallel_jobs and max_parallel_jobs > 0:
+        workers = max_parallel_jobs
+    else:
+        workers = max(1, cores // per_job)
+        if memory_limit:
+            workers = min(workers, max(1, memory_limit // job_bytes))
+    workers = max(1, min(workers, job_count))
+
+    threads = encoder_threads if encoder_threads and encoder_threads > 0 else max(1, cores // workers)
+    return Allocation(workers, threads, max(1, threads // 2), memory_limit, job_bytes)
+
+
+def activate(allocation):
+    """设置当前批处理的资源分配（之后启动的ffmpeg进程使用它的线程数和内存上限）"""
+    global _active
+    _active = allocation
+    print(f"🧮 资源分配: {allocation.describe()}")
+    return allocation
+
+
+def current():
+    """当前批处理的资源分配，没有时返回None"""
+    return _active
+
+
+def _proc_ffmpeg_rss():
+    """从/proc统计后代ffmpeg进程的RSS"""
+    if not os.path.isdir('/proc'):
+        return None
+    children = {}
+    names = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 进程名在括号中，可能包含空格；其后依次是状态和父进程pid
+        fields = stat[stat.rindex(')') + 2:].split()
+        pid = int(entry)
+        names[pid] = stat[stat.index('(') + 1:stat.rindex(')')]
+        children.setdefault(int(fields[1]), []).append(pid)
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    stack = [_ROOT_PID]
+    while stack:
+        for pid in children.get(stack.pop(), []):
+            stack.append(pid)
+            if names.get(pid) in FFMPEG_PROCESS_NAMES:
+                try:
+                    with open(f'/proc/{pid}/statm', 'r') as f:
+                        total += int(f.read().split()[1]) * page_size
+                except (OSError, ValueError, IndexError):
+                    continue
+    return total
+
+
+def ffmpeg_rss():
+    """ComfyUI主进程所有后代ffmpeg进程的RSS总和（字节），无法测量时返回None"""
+    if psutil is None:
+        return _proc_ffmpeg_rss()
+    try:
+        total = 0
+        for child in psutil.Process(_ROOT_PID).children(recursive=True):
+            try:
+                if child.name() in FFMPEG_PROCESS_NAMES:
+                    total += child.memory_info().rss
+            except psutil.Error:
+                continue
+        return total
+    except psutil.Error:
+        return None
+
+
+def admit(job_bytes=None):
+    """
+    启动新的ffmpeg进程前调用：正在运行的ffmpeg内存占用加上新进程的估算值超过上限时等待
+
+    没有正在运行的ffmpeg时总是放行，单个任务超过上限也不会一直等待
+    """
+    allocation = _active
+    if allocation is None or not allocation.memory_limit_bytes:
+        return
+    job_bytes = job_bytes or allocation.job_bytes
+    limit = allocation.memory_limit_bytes
+    waited_since = None
+    while True:
+        used = ffmpeg_rss()
+        if used is None:
+            return
+        with _lock:
+            now = time.time()
+            _reservations[:] = [r for r in _reservations if r[0] > now]
+            reserved = sum(r[1] for r in _reservations)
+            if (used == 0 and reserved == 0) or used + reserved + job_bytes <= limit:
+                _reservations.append((now + RESERVATION_SECONDS, job_bytes))
+                break
+        if waited_since is None:
+            waited_since = time.time()
+            print(f"⏳ ffmpeg内存占用 {(used + reserved) / 1024 ** 3:.1f}GB 接近上限 {limit / 1024 ** 3:.1f}GB，等待其他任务结束")
+        time.sleep(ADMIT_POLL_SECONDS)
+    if waited_since is not None:
+        print(f"▶️ 内存占用已回落，等待了 {time.time() - waited_since:.0f}秒")
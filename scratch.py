@@ -0,0 +1,233 @@
+"""
+临时工作空间
+classic合并和分段编码的中间文件统一写在临时根目录下（可以指向/dev/shm等内存盘），每个任务一个目录，
+由上下文管理器保证在异常和提前返回时也会删除；所有进程（包括共享同一目录的其他实例）共用一个字节预算，
+用完时新任务等待其他任务清理；每次批处理开始时清理已退出的进程遗留的目录
+"""
+
+import os
+import time
+import json
+import uuid
+import shutil
+import socket
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # 非POSIX平台只在本进程内互斥
+
+from . import stage_timing
+
+SCRATCH_DIRNAME = "video_editing_scratch"
+JOB_DIR_PREFIX = "job_"
+OWNER_FILENAME = ".owner.json"
+LOCK_FILENAME = ".lock"
+# scratch_budget_gb为0（自动）时使用临时目录所在磁盘可用空间的比例
+AUTO_FREE_FRACTION = 0.8
+# 预算用完时重新检查的间隔
+ADMIT_POLL_SECONDS = 2.0
+# 没有持有者信息的目录（创建到一半时进程退出）超过这么久才清理
+ORPHAN_GRACE_SECONDS = 3600
+# 其他主机创建的目录无法判断进程是否存在，超过这么久没有写入才清理
+FOREIGN_STALE_SECONDS = 24 * 3600
+
+_config = {'root': None, 'budget_bytes': None}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def scratch_input_types():
+    """各节点共用的临时目录输入定义"""
+    return {
+        "scratch_dir": ("STRING", {"default": "", "multiline": False, "tooltip": "中间文件的临时目录（可以是/dev/shm等内存盘），留空时使用系统临时目录下的 video_editing_scratch"}),
+        "scratch_budget_gb": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 100000.0, "step": 1.0, "tooltip": "临时目录的空间预算（GB），用完时新任务等待其他任务清理；0表示临时目录所在磁盘可用空间的80%"}),
+    }
+
+
+def default_root():
+    return os.path.join(tempfile.gettempdir(), SCRATCH_DIRNAME)
+
+
+def _tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def _tree_mtime(path):
+    latest = 0.0
+    for dirpath, _, filenames in os.walk(path):
+        for name in [dirpath] + [os.path.join(dirpath, f) for f in filenames]:
+            try:
+                latest = max(latest, os.lstat(name).st_mtime)
+            except OSError:
+                continue
+    return latest
+
+
+def _read_owner(path):
+    try:
+        with open(os.path.join(path, OWNER_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _job_dirs(root):
+    try:
+        entries = os.listdir(root)
+    except OSError:
+        return []
+    return [os.path.join(root, entry) for entry in entries
+            if entry.startswith(JOB_DIR_PREFIX) and os.path.isdir(os.path.join(root, entry))]
+
+
+def sweep(root):
+    """
+    清理遗留的任务目录：本机上持有进程已退出的目录、没有持有者信息且超过宽限期的目录、
+    其他主机上长时间没有写入的目录
+
+    Returns:
+        int: 清理的目录数
+    """
+    hostname = socket.gethostname()
+    now = time.time()
+    removed = 0
+    freed = 0
+    for path in _job_dirs(root):
+        owner = _read_owner(path)
+        if owner is None:
+            orphaned = now - _tree_mtime(path) > ORPHAN_GRACE_SECONDS
+        elif owner.get('host') == hostname:
+            orphaned = not _pid_alive(owner.get('pid', 0))
+        else:
+            orphaned = now - _tree_mtime(path) > FOREIGN_STALE_SECONDS
+        if orphaned:
+            freed += _tree_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    if removed:
+        print(f"🧹 清理了 {removed} 个遗留的临时目录，释放 {freed / 1024 ** 3:.2f}GB")
+    return removed
+
+
+def configure(scratch_dir="", budget_gb=0.0):
+    """
+    设置当前批处理的临时根目录和预算，并清理遗留目录
+
+    Args:
+        scratch_dir: 临时根目录，留空时使用系统临时目录下的 video_editing_scratch
+        budget_gb: 所有任务目录的总大小预算（GB），0表示磁盘可用空间的80%
+    Returns:
+        str: 临时根目录
+    """
+    root = os.path.abspath(scratch_dir.strip()) if scratch_dir and scratch_dir.strip() else default_root()
+    os.makedirs(root, exist_ok=True)
+    sweep(root)
+    if budget_gb and budget_gb > 0:
+        budget = int(budget_gb * 1024 ** 3)
+    else:
+        # 其他任务已占用的空间也算在预算内
+        usage = shutil.disk_usage(root)
+        budget = int((usage.free + sum(_tree_size(path) for path in _job_dirs(root))) * AUTO_FREE_FRACTION)
+    _config.update(root=root, budget_bytes=budget)
+    print(f"🗂️ 临时目录: {root}（预算 {budget / 1024 ** 3:.1f}GB）")
+    return root
+
+
+def _active():
+    if _config['root'] is None:
+        configure()
+    return _config['root'], _config['budget_bytes']
+
+
+@contextmanager
+def _root_lock(root):
+    """根目录上的跨进程锁（检查预算和创建目录是一个原子操作）"""
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(root, LOCK_FILENAME), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _usage(root):
+    """正在使用的任务目录数，以及按 max(预计占用, 实际大小) 计算的总占用"""
+    total = 0
+    live = 0
+    for path in _job_dirs(root):
+        owner = _read_owner(path) or {}
+        total += max(owner.get('reserved', 0), _tree_size(path))
+        live += 1
+    return total, live
+
+
+def _create(root, name, reserve_bytes):
+    safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)[:40]
+    path = os.path.join(root, f"{JOB_DIR_PREFIX}{safe_name}_{uuid.uuid4().hex[:8]}")
+    os.makedirs(path)
+    with open(os.path.join(path, OWNER_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'reserved': int(reserve_bytes),
+                   'created': time.time()}, f)
+    return path
+
+
+@contextmanager
+def job_dir(name="", reserve_bytes=0):
+    """
+    为一个任务创建临时目录，退出with块时（包括异常和提前返回）删除
+
+    预算不足时等待其他任务清理；没有其他任务时总是放行，单个任务超过预算也不会一直等待。
+    嵌套在同一线程已持有的任务目录中时随外层任务计入，不再等待（避免所有任务互相等待）
+
+    Args:
+        name: 目录名中的可读部分（如游戏视频名）
+        reserve_bytes: 预计占用（字节），目录实际大小超过它时按实际大小计入
+    """
+    root, budget = _active()
+    depth = getattr(_local, 'depth', 0)
+    waited_since = None
+    while True:
+        with _root_lock(root):
+            used, live = _usage(root)
+            if depth > 0 or live == 0 or used + reserve_bytes <= budget:
+                path = _create(root, name, reserve_bytes)
+                break
+        if waited_since is None:
+            waited_since = time.time()
+            print(f"⏳ 临时目录占用 {used / 1024 ** 3:.1f}GB 接近预算 {budget / 1024 ** 3:.1f}GB，等待其他任务清理")
+        time.sleep(ADMIT_POLL_SECONDS)
+    if waited_since is not None:
+        print(f"▶️ 临时目录空间已释放，等待了 {time.time() - waited_since:.0f}秒")
+
+    _local.depth = depth + 1
+    try:
+        yield path
+    finally:
+        _local.depth = depth
+        with stage_timing.stage("cleanup"):
+            shutil.rmtree(path, ignore_errors=True)
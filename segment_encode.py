@@ -0,0 +1,147 @@
+"""
+分段并行编码
+长视频按关键帧切成N段，各段用相同的编码参数并发编码（只编码画面），
+音频对整条时间轴单独编码一次，最后用concat demuxer流复制拼接视频段并封装音频
+"""
+
+import os
+
+import ffmpeg
+
+from . import encoder_profiles
+from . import ffmpeg_progress
+from . import job_pool
+from . import keyframes
+from . import media_cache
+from . import scheduler
+from . import scratch
+
+# 每段的最短时长，短于两段的视频不分段
+MIN_SEGMENT_SECONDS = 60
+# 分段使用MPEG-TS封装（90kHz时间基，拼接时不受mp4编辑列表影响），TS不支持的编码器使用Matroska
+SEGMENT_CONTAINERS = {'libx264': '.ts', 'libx265': '.ts'}
+DEFAULT_SEGMENT_CONTAINER = '.mkv'
+
+
+def segment_count_input_type():
+    """各节点共用的分段编码输入定义"""
+    return ("INT", {"default": 1, "min": 0, "max": 64, "tooltip": "单个长视频按关键帧分成几段并行编码，1表示不分段，0表示按分到的线程数自动选择（每段至少60秒）"})
+
+
+def resolve_count(segment_count, duration, width=1920, height=1080):
+    """
+    实际分段数
+
+    Args:
+        segment_count: 用户设置的分段数，0表示自动（本任务分到的线程数够几个编码进程用满就分几段）
+        duration: 视频时长（秒）
+    """
+    if segment_count == 1 or not duration:
+        return 1
+    if segment_count <= 0:
+        allocation = scheduler.current()
+        threads = allocation.threads if allocation is not None else scheduler.available_cores()
+        segment_count = max(1, threads // scheduler.cores_per_job(width, height))
+    return max(1, min(segment_count, int(duration // MIN_SEGMENT_SECONDS)))
+
+
+def plan_ranges(source, duration, segment_count=1, width=1920, height=1080):
+    """
+    计算分段区间：目标切点均匀分布，每个切点对齐到其后的第一个关键帧
+
+    Args:
+        source: 决定切点的视频（切点处是关键帧，输入定位精确且不需要从前一个关键帧解码）
+    Returns:
+        list: [(起点, 终点)]，不分段时只有一个区间
+    """
+    count = resolve_count(segment_count, duration, width, height)
+    if count <= 1:
+        return [(0.0, duration)]
+
+    # 关键帧时间是包的绝对时间戳，-ss的位置相对于文件起始时间
+    try:
+        start_time = float(media_cache.probe(source)['format'].get('start_time') or 0)
+    except Exception:
+        start_time = 0.0
+
+    points = [0.0]
+    for index in range(1, count):
+        target = duration * index / count
+        try:
+            keyframe = keyframes.next_keyframe(source, start_time + target)
+        except Exception as e:
+            print(f"  ⚠️ 查询关键帧失败: {e}")
+            keyframe = None
+        if keyframe is None:
+            continue
+        point = keyframe - start_time
+        if point - points[-1] < MIN_SEGMENT_SECONDS or duration - point < MIN_SEGMENT_SECONDS:
+            continue
+        points.append(point)
+    return [(start, points[index + 1] if index + 1 < len(points) else duration) for index, start in enumerate(points)]
+
+
+def encode_segmented(build_video, ranges, output_file, encoder=None, audio=None, stage="分段编码"):
+    """
+    分段并行编码并无损拼接
+
+    Args:
+        build_video: 构建某个时间段画面的函数 build_video(start, length)，返回时间戳从0开始的视频流
+        ranges: plan_ranges 返回的区间列表
+        output_file: 输出文件
+        encoder: 编码配置，None时使用默认配置
+        audio: 整条时间轴的音频流，None表示没有音频
+        stage: 进度日志中的阶段名称
+    """
+    if encoder is None:
+        encoder = encoder_profiles.default_encoder()
+    # 本任务分到的线程平分给同时编码的各段
+    allocation = scheduler.current()
+    threads = encoder['threads'] or (allocation.threads if allocation is not None else scheduler.available_cores())
+    segment_encoder = dict(encoder, threads=max(1, threads // len(ranges)))
+    container = SEGMENT_CONTAINERS.get(encoder['vcodec'], DEFAULT_SEGMENT_CONTAINER)
+    total_duration = ranges[-1][1]
+
+    print(f"  ✂️ 分段并行编码: {len(ranges)} 段，切点 {[round(start, 2) for start, _ in ranges[1:]]}")
+    with scratch.job_dir(f"segments_{os.path.splitext(os.path.basename(output_file))[0]}") as temp_dir:
+        def encode(part):
+            if part == 'audio':
+                # 音频对整条时间轴只编码一次，不受分段边界影响
+                audio_path = os.path.join(temp_dir, "audio.m4a")
+                ffmpeg_progress.run(
+                    ffmpeg.output(audio, audio_path, acodec='aac', audio_bitrate=encoder['audio_bitrate']).overwrite_output(),
+                    stage=f"{stage} 音频", duration=total_duration
+                )
+                return audio_path
+            index, (start, end) = part
+            segment_path = os.path.join(temp_dir, f"segment_{index:03d}{container}")
+            ffmpeg_progress.run(
+                ffmpeg
+                .output(build_video(start, end - start), segment_path,
+                        **encoder_profiles.output_kwargs(segment_encoder, with_audio=False))
+                .overwrite_output(),
+                stage=f"{stage} {index + 1}/{len(ranges)}", duration=end - start
+            )
+            return segment_path
+
+        parts = list(enumerate(ranges)) + (['audio'] if audio is not None else [])
+        results = job_pool.run_jobs(encode, parts, len(parts))
+        for _, _, error in results:
+            if error is not None:
+                raise error
+
+        concat_file = os.path.join(temp_dir, "segments.txt")
+        with open(concat_file, 'w') as f:
+            for _, segment_path, _ in results[:len(ranges)]:
+                f.write(f"file '{segment_path}'\n")
+
+        streams = [ffmpeg.input(concat_file, format='concat', safe=0).video]
+        if audio is not None:
+            streams.append(ffmpeg.input(results[-1][1]).audio)
+        copy_kwargs = {'c': 'copy', 'movflags': '+faststart'}
+        if encoder['vcodec'] == 'libx265':
+            copy_kwargs['tag:v'] = 'hvc1'  # 与直接编码时的输出保持一致
+        ffmpeg_progress.run(
+            ffmpeg.output(*streams, output_file, **copy_kwargs).overwrite_output(),
+            stage=f"{stage} 拼接", duration=total_duration
+        )
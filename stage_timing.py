@@ -0,0 +1,141 @@
+"""
+阶段计时
+按游戏视频记录合并各阶段（探测、音量分析、缩放、拼接、截取、GIF叠加层预渲染、最终合并、清理）的耗时，
+运行结束后在输出文件夹写出JSON报告
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+REPORT_FILENAME = "merge_timing_report.json"
+
+# 报告中的阶段顺序
+STAGES = ["probe", "audio_analysis", "resize", "concat", "trim", "gif_overlay", "final_merge", "cleanup"]
+
+_local = threading.local()
+
+
+class StageTimer:
+    """
+    单个任务的阶段计时器
+
+    阶段可以嵌套（例如缩放时探测流参数），记录的是各阶段的独占时间，
+    外层阶段不重复计入内层阶段的耗时，所有阶段之和不超过总耗时
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        self.wall_seconds = 0.0
+        self._stack = []
+
+    def add(self, name, seconds, count=1):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    @contextmanager
+    def stage(self, name):
+        frame = {'child_seconds': 0.0}
+        self._stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stack.pop()
+            self.add(name, max(elapsed - frame['child_seconds'], 0.0))
+            if self._stack:
+                self._stack[-1]['child_seconds'] += elapsed
+
+    @contextmanager
+    def measure_wall(self):
+        """累计任务的总耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.wall_seconds += time.perf_counter() - started
+
+    def merge(self, other):
+        """并入另一个计时器的记录（例如在探测线程中完成的预先探测）"""
+        for name, seconds in other.seconds.items():
+            self.add(name, seconds, other.counts.get(name, 0))
+        self.wall_seconds += other.wall_seconds
+
+    def to_dict(self):
+        stages = {}
+        for name in STAGES + sorted(set(self.seconds) - set(STAGES)):
+            if name in self.seconds:
+                stages[name] = {'seconds': round(self.seconds[name], 3), 'count': self.counts[name]}
+        return {
+            'wall_seconds': round(self.wall_seconds, 3),
+            'stages': stages,
+        }
+
+
+@contextmanager
+def use_timer(timer):
+    """设置当前线程的计时器，其中的 stage() 调用记录到该计时器"""
+    previous = getattr(_local, 'timer', None)
+    _local.timer = timer
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+@contextmanager
+def stage(name):
+    """在当前线程的计时器中记录一个阶段，没有计时器时不做任何事"""
+    timer = getattr(_local, 'timer', None)
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def summarize(entries):
+    """汇总所有任务的阶段耗时"""
+    totals = {}
+    for entry in entries:
+        for name, value in entry.get('stages', {}).items():
+            total = totals.setdefault(name, {'seconds': 0.0, 'count': 0})
+            total['seconds'] = round(total['seconds'] + value['seconds'], 3)
+            total['count'] += value['count']
+    return {name: totals[name] for name in STAGES + sorted(set(totals) - set(STAGES)) if name in totals}
+
+
+def write_report(output_path, meta, entries):
+    """
+    在输出文件夹写出计时报告并在控制台打印汇总
+
+    Args:
+        output_path: 输出文件夹
+        meta: 本次运行的参数（引擎、编码配置、并发数、总耗时等）
+        entries: 每个游戏视频的计时记录
+    Returns:
+        str: 报告文件路径
+    """
+    totals = summarize(entries)
+    report = {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'run': meta,
+        'totals': totals,
+        'jobs': entries,
+    }
+    report_path = os.path.join(output_path, REPORT_FILENAME)
+    temp_path = f"{report_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, report_path)
+
+    if totals:
+        print("⏱️ 阶段耗时汇总:")
+        for name, value in totals.items():
+            print(f"  {name:<15} {value['seconds']:>9.2f}秒 ({value['count']} 次)")
+    print(f"⏱️ 计时报告: {report_path}")
+    return report_path
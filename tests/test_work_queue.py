@@ -0,0 +1,110 @@
+"""
+共享任务队列测试
+
+两个实例（两个WorkQueue，同一个队列数据库）各自以多并发处理同一批文件：
+每个任务恰好处理一次，双方都能结束（不因等待对方持有的任务而互相等待）
+
+用法:
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import time
+import types
+import shutil
+import tempfile
+import unittest
+import importlib
+import threading
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "video_editing_test"
+
+
+def load_modules(workdir):
+    """
+    以包的形式加载队列相关模块（不执行包的__init__，不需要cv2等节点依赖），
+    使用独立的folder_paths模块，缓存写到测试工作目录
+    """
+    module = types.ModuleType("folder_paths")
+    module.get_input_directory = lambda: os.path.join(workdir, "input")
+    module.get_output_directory = lambda: os.path.join(workdir, "output")
+    sys.modules["folder_paths"] = module
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [REPO_ROOT]
+        sys.modules[PACKAGE_NAME] = package
+    return (importlib.import_module(f"{PACKAGE_NAME}.work_queue"),
+            importlib.import_module(f"{PACKAGE_NAME}.job_pool"))
+
+
+class SharedQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="work_queue_test_")
+        self.work_queue, self.job_pool = load_modules(self.workdir)
+        self.poll_seconds = self.work_queue.POLL_SECONDS
+        self.work_queue.POLL_SECONDS = 0.05
+        self.files = []
+        for index in range(6):
+            path = os.path.join(self.workdir, f"video_{index}.mp4")
+            with open(path, 'wb') as f:
+                f.write(b"\0" * (index + 1))
+            self.files.append(path)
+
+    def tearDown(self):
+        self.work_queue.POLL_SECONDS = self.poll_seconds
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_two_instances_with_workers(self):
+        work_queue, job_pool = self.work_queue, self.job_pool
+        db_path = os.path.join(self.workdir, work_queue.QUEUE_FILENAME)
+        processed = []
+        lock = threading.Lock()
+        # 两个实例都领取到第一个任务后再继续：各自持有一个对方要等待的任务，
+        # 已完成的任务还在iter_jobs的窗口中时就必须标记完成，否则双方互相等待
+        barrier = threading.Barrier(2, timeout=30)
+
+        def process(video_file):
+            time.sleep(0.1)
+            with lock:
+                processed.append(video_file)
+            return video_file
+
+        def items(order):
+            yield order[0]
+            barrier.wait()
+            yield from order[1:]
+
+        def run_instance(order, results):
+            work = work_queue.WorkQueue(db_path, "batch")
+            with work_queue.session(work):
+                encoded = job_pool.iter_jobs(
+                    process,
+                    work_queue.claimed_items(work, items(order), lambda video_file: [video_file]),
+                    2,
+                    on_done=work_queue.finish_callback(work, lambda video_file: [video_file])
+                )
+                for video_file, result, error in encoded:
+                    results.append((video_file, error))
+
+        first_results, second_results = [], []
+        instances = [
+            threading.Thread(target=run_instance, args=(self.files, first_results), daemon=True),
+            threading.Thread(target=run_instance, args=(self.files[1:] + self.files[:1], second_results), daemon=True),
+        ]
+        for instance in instances:
+            instance.start()
+        for instance in instances:
+            instance.join(timeout=30)
+        self.assertFalse(any(instance.is_alive() for instance in instances), "两个实例互相等待对方的任务")
+
+        self.assertEqual(sorted(processed), sorted(self.files))
+        self.assertTrue(first_results and second_results)
+        self.assertEqual(sorted(video_file for video_file, _ in first_results + second_results), sorted(self.files))
+        self.assertTrue(all(error is None for _, error in first_results + second_results))
+
+
+if __name__ == '__main__':
+    unittest.main()
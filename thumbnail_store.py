@@ -0,0 +1,123 @@
+"""
+缩略图存储
+预览帧按 (文件指纹, 时间点) 以原分辨率存放在受预算限制的磁盘缓存中，超出预算时按最近使用时间淘汰；
+抽帧只解码关键帧（-skip_frame nokey），需要固定文件名的位置用硬链接发布，不重复复制
+"""
+
+import os
+import shutil
+import threading
+
+import ffmpeg
+
+from . import disk_cache
+from . import media_cache
+
+DEFAULT_BUDGET_MB = 256
+# 发布到固定路径的预览帧来自缓存，缓存不能被完全禁用
+MIN_BUDGET_MB = 16
+# 旧版本直接写在输出目录下、不会被清理的预览帧目录
+LEGACY_DIR_NAME = "video_previews"
+
+_legacy_cleaned = False
+_legacy_lock = threading.Lock()
+
+
+def remove_legacy_previews(output_dir):
+    """删除旧版本在 video_previews 中留下的预览帧副本（每个进程只执行一次）"""
+    global _legacy_cleaned
+    with _legacy_lock:
+        if _legacy_cleaned:
+            return
+        _legacy_cleaned = True
+
+    legacy_dir = os.path.join(output_dir, LEGACY_DIR_NAME)
+    if not os.path.isdir(legacy_dir):
+        return
+    removed = 0
+    for filename in os.listdir(legacy_dir):
+        if filename.endswith("_frame.jpg") or filename.startswith("video_preview_"):
+            try:
+                os.remove(os.path.join(legacy_dir, filename))
+                removed += 1
+            except OSError:
+                pass
+    try:
+        os.rmdir(legacy_dir)  # 只在目录已空时删除
+    except OSError:
+        pass
+    if removed:
+        print(f"🧹 已清理 {removed} 个旧版预览帧: {legacy_dir}")
+
+
+def publish(source_path, target_path):
+    """
+    把缓存中的文件发布到固定路径（优先硬链接，跨文件系统时复制），原子替换已有文件
+    """
+    temp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        try:
+            os.link(source_path, temp_path)
+        except OSError:
+            shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, target_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return target_path
+
+
+class ThumbnailStore:
+    """
+    预览帧缓存
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_MB * 1024 * 1024):
+        self.cache = disk_cache.DiskCache("thumbnails", max(budget_bytes, MIN_BUDGET_MB * 1024 * 1024))
+
+    def _temp_path(self, key):
+        path = self.cache.path_for(key, ".jpg")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _extract_keyframe(self, video_file, frame_time, temp_path):
+        """
+        抽取 frame_time 处（或之前）最近的关键帧
+
+        只解码关键帧并跳过精确定位，不需要从关键帧解码到目标时间点
+        """
+        for seek in (frame_time, 0):
+            (
+                ffmpeg
+                .input(video_file, ss=seek, skip_frame='nokey', noaccurate_seek=None)
+                .output(temp_path, vframes=1, format='image2', vcodec='mjpeg', **{'q:v': 2})
+                .overwrite_output()
+                .run(quiet=True)
+            )
+            if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
+                return
+            # 视频短于frame_time时没有输出，改为取第一帧
+        raise RuntimeError(f"无法从视频中提取关键帧: {video_file}")
+
+    def get(self, video_file, frame_time=1.0):
+        """
+        获取原分辨率的预览帧（前端按图片尺寸换算裁切坐标，不能缩小）
+
+        Args:
+            video_file: 视频文件
+            frame_time: 时间点（秒）
+        Returns:
+            tuple: (缓存中的图片路径, 是否命中缓存)
+        """
+        key = disk_cache.make_key(media_cache.file_fingerprint(video_file), frame_time)
+        cached_path = self.cache.lookup(key, ".jpg")
+        if cached_path:
+            return cached_path, True
+
+        temp_path = self._temp_path(key)
+        try:
+            self._extract_keyframe(video_file, frame_time, temp_path)
+            return self.cache.store(key, temp_path, ".jpg"), False
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,274 @@
+"""
+共享任务队列
+多个ComfyUI实例（可以在不同主机上）处理同一批文件时，通过共享存储上的SQLite文件按租约领取任务：
+领取是原子的，编码期间后台线程续租，持有者崩溃后租约过期，任务被其他实例重新领取
+"""
+
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from . import manifest
+
+QUEUE_FILENAME = ".video_editing_queue.sqlite3"
+QUEUE_MODES = ["off", "shared"]
+
+# 租约时长：持有者超过这么久没有续租即视为已退出
+LEASE_SECONDS = 120
+# 等待其他实例持有的任务时的轮询间隔
+POLL_SECONDS = 5
+# 同一个任务因持有者退出被重新领取的次数上限（避免反复导致崩溃的文件无限重试）
+MAX_ATTEMPTS = 3
+
+
+def queue_input_types():
+    """各节点共用的队列参数输入定义"""
+    return {
+        "queue_mode": (QUEUE_MODES, {"default": "off", "tooltip": "off: 单独处理整批文件, shared: 多个ComfyUI实例通过共享队列分摊同一批文件"}),
+        "queue_path": ("STRING", {"default": "", "multiline": False, "tooltip": "队列数据库路径（所有实例必须指向同一个文件），留空时使用输出文件夹中的 .video_editing_queue.sqlite3"}),
+    }
+
+
+def item_key(paths):
+    """
+    任务标识：输入文件名、大小和修改时间
+
+    不使用绝对路径和inode，不同主机挂载共享存储的路径不同时也能得到相同的标识（与输出清单的输入指纹相同）
+    """
+    return manifest.params_digest(manifest.input_fingerprints(paths))
+
+
+class WorkQueue:
+    """
+    基于租约的任务队列
+
+    任务状态: pending（待领取）/ leased（已领取）/ done / failed
+    本次运行开始之前就已完成或失败的任务可以重新领取（由输出清单判断是否需要重新编码），
+    运行期间由其他实例完成的任务不再重复处理
+    """
+
+    def __init__(self, db_path, batch, lease_seconds=LEASE_SECONDS):
+        """
+        Args:
+            db_path: 队列数据库路径
+            batch: 批次标识（节点参数和输出文件夹的摘要），参数不同的批次互不影响
+        """
+        self.db_path = db_path
+        self.batch = batch
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.started_at = time.time()
+        self.claimed = 0
+        self._stop = threading.Event()
+        self._heartbeat = None
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作单独连接，线程池和续租线程都安全；不使用WAL，网络文件系统上WAL不可用
+        # 退出时提交（出错时回滚）并关闭，续租和轮询不会累积连接和共享存储上的文件句柄
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS work_items ("
+                " batch TEXT NOT NULL,"
+                " item TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " owner TEXT,"
+                " lease_expires REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " updated REAL NOT NULL,"
+                " PRIMARY KEY (batch, item))"
+            )
+
+    def start(self):
+        """启动续租线程"""
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew_loop, name="work-queue-heartbeat", daemon=True)
+            self._heartbeat.start()
+        return self
+
+    def close(self):
+        """停止续租，释放本实例还持有的任务（放回待领取状态）"""
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE work_items SET status = 'pending', owner = NULL, lease_expires = NULL, updated = ? "
+                    "WHERE batch = ? AND owner = ? AND status = 'leased'",
+                    (time.time(), self.batch, self.owner)
+                )
+        except Exception as e:
+            print(f"⚠️ 释放队列任务失败: {e}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE work_items SET lease_expires = ? WHERE batch = ? AND owner = ? AND status = 'leased'",
+                        (time.time() + self.lease_seconds, self.batch, self.owner)
+                    )
+            except Exception as e:
+                print(f"⚠️ 队列续租失败: {e}")
+
+    def claim(self, key, name=""):
+        """
+        尝试领取任务（原子操作）
+
+        Returns:
+            bool: 是否由本实例领取成功
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO work_items (batch, item, name, status, updated) VALUES (?, ?, ?, 'pending', ?)",
+                (self.batch, key, name, now)
+            )
+            cursor = conn.execute(
+                "UPDATE work_items SET status = 'leased', owner = ?, lease_expires = ?, updated = ?,"
+                " attempts = CASE WHEN status IN ('done', 'failed') THEN 1 ELSE attempts + 1 END "
+                "WHERE batch = ? AND item = ? AND ("
+                " status = 'pending'"
+                " OR (status = 'leased' AND lease_expires < ? AND attempts < ?)"
+                " OR (status IN ('done', 'failed') AND updated < ?))",
+                (self.owner, now + self.lease_seconds, now, self.batch, key, now, MAX_ATTEMPTS, self.started_at)
+            )
+            claimed = cursor.rowcount == 1
+        if claimed:
+            self.claimed += 1
+        return claimed
+
+    def complete(self, key, success=True):
+        """标记本实例持有的任务已完成"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE work_items SET status = ?, owner = NULL, lease_expires = NULL, updated = ? "
+                "WHERE batch = ? AND item = ? AND owner = ?",
+                ('done' if success else 'failed', time.time(), self.batch, key, self.owner)
+            )
+
+    def is_busy_elsewhere(self, key):
+        """任务是否正由其他仍在续租的实例处理"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status, owner, lease_expires, attempts FROM work_items WHERE batch = ? AND item = ?",
+                (self.batch, key)
+            ).fetchone()
+        if row is None:
+            return False
+        status, owner, lease_expires, attempts = row
+        if status != 'leased' or owner == self.owner:
+            return False
+        if lease_expires is not None and lease_expires < time.time():
+            if attempts >= MAX_ATTEMPTS:
+                return False  # 已多次因持有者退出而中断，放弃该任务
+        return True
+
+
+def open_queue(queue_mode, queue_path, output_path, batch_params):
+    """
+    按节点参数创建队列，queue_mode为off时返回None
+
+    Args:
+        batch_params: 决定批次的节点参数和编码配置（与输出清单使用的参数相同）
+    """
+    if queue_mode != "shared":
+        return None
+    db_path = queue_path.strip() if queue_path and queue_path.strip() else os.path.join(output_path, QUEUE_FILENAME)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    batch = manifest.params_digest(dict(batch_params, output_folder=os.path.basename(os.path.normpath(output_path))))
+    work = WorkQueue(db_path, batch)
+    print(f"🔗 共享队列: {db_path} (实例: {work.owner})")
+    return work
+
+
+@contextmanager
+def session(work):
+    """在with块中持有队列（续租，退出时释放未完成的任务），work为None时不做任何事"""
+    if work is None:
+        yield None
+        return
+    with work:
+        yield work
+
+
+def finish(work, inputs, success):
+    """标记任务完成，work为None时不做任何事"""
+    if work is None:
+        return
+    try:
+        work.complete(item_key(inputs), success)
+    except Exception as e:
+        print(f"⚠️ 更新队列任务状态失败: {e}")
+
+
+def finish_callback(work, inputs_of):
+    """
+    job_pool.iter_jobs 的 on_done 回调：任务结束时立即标记完成，work为None时返回None
+
+    不能等到按顺序汇总时再标记：claimed_items 在等待其他实例的任务时不会产出新任务，
+    iter_jobs 也就不会产出窗口中已完成的结果，两个实例会互相等待对方的租约
+    """
+    if work is None:
+        return None
+    return lambda item, result, error: finish(work, inputs_of(item), error is None)
+
+
+def claimed_items(work, items, inputs_of, name_of=os.path.basename):
+    """
+    按顺序产出本实例领取到的任务
+
+    第一轮跳过其他实例正在处理的任务；之后定期检查这些任务，
+    持有者退出（租约过期）的任务重新领取，直到全部由某个实例处理完
+
+    Args:
+        work: WorkQueue，为None时原样产出所有任务
+        items: 任务（列表或生成器）
+        inputs_of: 任务的输入文件列表 inputs_of(item)
+        name_of: 任务在队列中显示的名称
+    """
+    if work is None:
+        yield from items
+        return
+
+    waiting = []
+    for item in items:
+        key = item_key(inputs_of(item))
+        if work.claim(key, name_of(item)):
+            yield item
+        else:
+            waiting.append((key, item))
+
+    while waiting:
+        still_waiting = []
+        for key, item in waiting:
+            if work.claim(key, name_of(item)):
+                print(f"🔁 重新领取其他实例未完成的任务: {name_of(item)}")
+                yield item
+            elif work.is_busy_elsewhere(key):
+                still_waiting.append((key, item))
+        waiting = still_waiting
+        if waiting:
+            time.sleep(POLL_SECONDS)